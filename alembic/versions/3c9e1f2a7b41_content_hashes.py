@@ -0,0 +1,30 @@
+"""content hashes for documents and chunks
+
+Revision ID: 3c9e1f2a7b41
+Revises: a0fcfb0bb64c
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9e1f2a7b41'
+down_revision: Union[str, None] = 'a0fcfb0bb64c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('documents', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.add_column('chunks', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index('ix_documents_filename', 'documents', ['filename'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_documents_filename', table_name='documents')
+    op.drop_column('chunks', 'content_hash')
+    op.drop_column('documents', 'content_hash')
@@ -0,0 +1,47 @@
+"""query stats rollups
+
+Revision ID: 7d2b5e9c4a10
+Revises: 3c9e1f2a7b41
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2b5e9c4a10'
+down_revision: Union[str, None] = '3c9e1f2a7b41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('query_history', sa.Column('cache_hit', sa.Boolean(), nullable=True))
+    op.create_table(
+        'query_stats_rollups',
+        sa.Column('granularity', sa.String(length=8), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('requests', sa.Integer(), nullable=False),
+        sa.Column('cache_hits', sa.Integer(), nullable=False),
+        sa.Column('latency_sum_ms', sa.Float(), nullable=False),
+        sa.Column('generated_tokens', sa.BigInteger(), nullable=False),
+        sa.Column('generation_ms', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('granularity', 'bucket_start'),
+    )
+    op.create_table(
+        'query_latency_histogram',
+        sa.Column('granularity', sa.String(length=8), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('bin', sa.Integer(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('granularity', 'bucket_start', 'bin'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('query_latency_histogram')
+    op.drop_table('query_stats_rollups')
+    op.drop_column('query_history', 'cache_hit')
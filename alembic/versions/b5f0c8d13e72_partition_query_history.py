@@ -0,0 +1,99 @@
+"""partition query_history by month
+
+Revision ID: b5f0c8d13e72
+Revises: 7d2b5e9c4a10
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5f0c8d13e72'
+down_revision: Union[str, None] = '7d2b5e9c4a10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Старая таблица уходит в сторону вместе с индексами и PK
+    op.execute("ALTER TABLE query_history RENAME TO query_history_old")
+    op.execute("ALTER TABLE query_history_old RENAME CONSTRAINT query_history_pkey TO query_history_old_pkey")
+    op.execute("ALTER INDEX IF EXISTS ix_query_history_created_at RENAME TO ix_query_history_old_created_at")
+    op.execute("ALTER INDEX IF EXISTS ix_query_history_id RENAME TO ix_query_history_old_id")
+
+    # Партиционированная таблица: ключ партиционирования входит в PK, id — из прежней последовательности
+    op.execute("""
+        CREATE TABLE query_history (
+            id INTEGER NOT NULL DEFAULT nextval('query_history_id_seq'),
+            question TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            tokens INTEGER,
+            latency_ms INTEGER,
+            cache_hit BOOLEAN,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("ALTER SEQUENCE query_history_id_seq OWNED BY query_history.id")
+    op.execute("CREATE INDEX ix_query_history_created_at ON query_history (created_at)")
+    op.execute("CREATE TABLE query_history_default PARTITION OF query_history DEFAULT")
+
+    # Месячные партиции: от первого месяца с данными до текущего + 2
+    op.execute("""
+        DO $$
+        DECLARE
+            month_start date;
+            last_month date := date_trunc('month', now() + interval '2 months')::date;
+        BEGIN
+            SELECT COALESCE(date_trunc('month', min(created_at))::date, date_trunc('month', now())::date)
+              INTO month_start
+              FROM query_history_old;
+            WHILE month_start <= last_month LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF query_history FOR VALUES FROM (%L) TO (%L)',
+                    'query_history_y' || to_char(month_start, 'YYYY') || 'm' || to_char(month_start, 'MM'),
+                    month_start,
+                    (month_start + interval '1 month')::date
+                );
+                month_start := (month_start + interval '1 month')::date;
+            END LOOP;
+        END $$;
+    """)
+
+    op.execute("""
+        INSERT INTO query_history (id, question, answer, tokens, latency_ms, cache_hit, created_at)
+        SELECT id, question, answer, tokens, latency_ms, cache_hit, COALESCE(created_at, now())
+          FROM query_history_old
+    """)
+    op.execute("ALTER SEQUENCE query_history_id_seq OWNED BY NONE")
+    op.execute("DROP TABLE query_history_old")
+    op.execute("ALTER SEQUENCE query_history_id_seq OWNED BY query_history.id")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE query_history RENAME TO query_history_partitioned")
+    op.execute("ALTER INDEX ix_query_history_created_at RENAME TO ix_query_history_partitioned_created_at")
+    op.execute("ALTER SEQUENCE query_history_id_seq OWNED BY NONE")
+    op.execute("""
+        CREATE TABLE query_history (
+            id INTEGER NOT NULL DEFAULT nextval('query_history_id_seq') PRIMARY KEY,
+            question TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            tokens INTEGER,
+            latency_ms INTEGER,
+            cache_hit BOOLEAN,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+        )
+    """)
+    op.execute("CREATE INDEX ix_query_history_id ON query_history (id)")
+    op.execute("CREATE INDEX ix_query_history_created_at ON query_history (created_at)")
+    op.execute("""
+        INSERT INTO query_history (id, question, answer, tokens, latency_ms, cache_hit, created_at)
+        SELECT id, question, answer, tokens, latency_ms, cache_hit, created_at
+          FROM query_history_partitioned
+    """)
+    op.execute("DROP TABLE query_history_partitioned CASCADE")
+    op.execute("ALTER SEQUENCE query_history_id_seq OWNED BY query_history.id")
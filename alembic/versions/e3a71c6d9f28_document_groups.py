@@ -0,0 +1,31 @@
+"""document groups for sharded vector index
+
+Revision ID: e3a71c6d9f28
+Revises: b5f0c8d13e72
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3a71c6d9f28'
+down_revision: Union[str, None] = 'b5f0c8d13e72'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'documents',
+        sa.Column('group_name', sa.String(length=64), nullable=False, server_default='default')
+    )
+    op.create_index('ix_documents_group_name', 'documents', ['group_name'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_documents_group_name', table_name='documents')
+    op.drop_column('documents', 'group_name')
@@ -1,21 +1,34 @@
 import asyncio
-import io
 import os
+import time
 import traceback
 
-from PyPDF2 import PdfReader
-from fastapi import FastAPI, Request, UploadFile, File, HTTPException
-from fastapi.responses import HTMLResponse
-from typing import List
+from fastapi import FastAPI, Form, Request, Response, UploadFile, File, HTTPException, Query
+from fastapi.responses import FileResponse, HTMLResponse
+from datetime import datetime, timedelta
+from typing import List, Literal, Optional
 
 from app.database.schema_models import AskResponse, AskRequest
-from app.core.logger import logger
-from app.database.session import init_db
+from app.core.logger import get_logger
+from app.database.session import engine, init_db
+from app.database.partitions import maintenance_loop as partition_maintenance_loop
 from app.services.rag import rag
+from app.services.admission import admission, QueueFullError
 from app.services.cache import cache
-from app.services.other_functions import split_text_into_chunks
-from app.core.config import templates
-from app.database.crud import save_query, save_document
+from app.services.metrics import metrics
+from app.services.prewarm import prewarm
+from app.services.profiling import (
+    finish_profile, is_admin, list_profiles, profile_file, save_profile, should_profile, start_profile
+)
+from app.services.stats import bucket_start
+from app.services.vector_store import GROUP_NAME_RE
+from app.services.other_functions import SUPPORTED_EXTENSIONS, content_hash, extract_text, split_text_into_chunks
+from app.core.config import irkutsk_tz, settings, templates
+from app.database.crud import save_query, get_document_by_filename, upsert_document, get_stats
+from app.database.models import DEFAULT_DOCUMENT_GROUP
+
+
+logger = get_logger(__name__)
 
 
 app = FastAPI(title="Askio")
@@ -25,7 +38,12 @@ app = FastAPI(title="Askio")
 async def startup_event():
     await init_db()
     logger.info("БД подключена")
+    if engine.dialect.name == "postgresql":
+        # Партиции query_history: создание будущих и архивация старых
+        asyncio.create_task(partition_maintenance_loop())
     await cache.init_redis()
+    if settings.PREWARM_ON_STARTUP:
+        prewarm.start()
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -38,14 +56,53 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/api/metrics")
+async def metrics_endpoint():
+    """Метрики процесса (счётчики решений ранжирования и т.д.)"""
+    return metrics.snapshot()
+
+
+@app.get("/api/stats")
+async def stats_endpoint(
+    granularity: Literal["minute", "hour"] = "hour",
+    hours: int = Query(default=24, gt=0, le=24 * 90),
+):
+    """
+    Задержки (p50/p95/p99), токены/с, доля ответов из кэша и QPS по интервалам.
+    Читается из предагрегированных таблиц, а не из query_history.
+    Минутные интервалы хранятся STATS_MINUTE_RETENTION_HOURS часов, часовые — без ограничения.
+    """
+    since = datetime.now(irkutsk_tz) - timedelta(hours=hours)
+    return await get_stats(granularity, bucket_start(since, granularity))
+
+
+@app.post("/api/prewarm", status_code=202)
+async def start_prewarm(window_hours: Optional[int] = None, limit: Optional[int] = None):
+    """Запуск прогрева кэша по истории запросов"""
+    started = prewarm.start(window_hours, limit)
+    return {"started": started, **prewarm.state}
+
+
+@app.get("/api/prewarm")
+async def prewarm_status():
+    """Прогресс прогрева кэша"""
+    return prewarm.state
+
+
 @app.post("/api/documents")
-async def upload_documents(files: List[UploadFile] = File(...)):
+async def upload_documents(files: List[UploadFile] = File(...), group: str = Form(DEFAULT_DOCUMENT_GROUP)):
     """
     Загрузка одного или нескольких документов (PDF/TXT/MD).
     Каждый файл автоматически разбивается на чанки и добавляется в базу.
+    Повторная загрузка файла с тем же именем: неизменённый файл пропускается,
+    у изменённого заменяются только новые/изменённые чанки.
+    group — группа документов (отдел/тенант); по ней можно ограничить поиск (scope в /api/ask).
     """
+    if not GROUP_NAME_RE.match(group):
+        raise HTTPException(status_code=400, detail=f"Некорректное имя группы: {group}")
+
     results = []
-    new_documents_loaded = False  # ← Флаг для отслеживания новых документов
+    added, moved, removed = [], [], []  # ← Изменения для инкрементальной индексации
 
     for file in files:
         filename = file.filename
@@ -57,37 +114,54 @@ async def upload_documents(files: List[UploadFile] = File(...)):
             if not content:
                 raise ValueError("Файл пустой")
 
-            # 2. Определяем расширение и извлекаем текст
+            # 2. Определяем расширение
             ext = os.path.splitext(filename)[1].lower()
-
-            if ext in [".txt", ".md"]:
-                text = content.decode("utf-8", errors="ignore")
-            elif ext == ".pdf":
-                pdf = PdfReader(io.BytesIO(content))
-                text = "\n".join(page.extract_text() or "" for page in pdf.pages)
-            else:
+            if ext not in SUPPORTED_EXTENSIONS:
                 raise HTTPException(
                     status_code=400,
                     detail=f"Формат {ext} не поддерживается (только .txt, .md, .pdf)",
                 )
 
-            # 3. Разбиваем на чанки
+            # 3. Неизменённый файл (тот же sha256) — ничего не делаем
+            file_hash = content_hash(content)
+            existing = await get_document_by_filename(filename, group)
+            if existing and existing.content_hash == file_hash:
+                logger.info(f"{filename}: не изменился (id={existing.id}), пропускаем")
+                results.append({
+                    "filename": filename,
+                    "status": "ok",
+                    "document_id": existing.id,
+                    "group": group,
+                    "change": "unchanged",
+                })
+                continue
+
+            # 4. Извлекаем текст
+            text = extract_text(filename, content)
+
+            # 5. Разбиваем на чанки
             chunks = split_text_into_chunks(text)
             logger.info(f"{filename}: получено {len(chunks)} чанков")
 
-            # 4. Добавляем документ и чанки в БД
-            doc_id = await save_document(filename, chunks)
-
-            # Устанавливаем флаг, что появились новые документы
-            new_documents_loaded = True
+            # 6. Добавляем документ или заменяем изменившиеся чанки
+            changes = await upsert_document(
+                filename, file_hash, chunks, existing.id if existing else None, group_name=group
+            )
+            added.extend(changes["added"])
+            moved.extend(changes["moved"])
+            removed.extend(changes["removed"])
 
-            logger.info(f"{filename}: добавлен в базу (id={doc_id})")
+            logger.info(f"{filename}: сохранён в базу (id={changes['document_id']}, {changes['change']})")
 
             results.append({
                 "filename": filename,
                 "status": "ok",
-                "document_id": doc_id,
+                "document_id": changes["document_id"],
+                "group": group,
                 "chunks": len(chunks),
+                "change": changes["change"],
+                "added": len(changes["added"]),
+                "removed": len(changes["removed"]),
             })
 
         except HTTPException:
@@ -100,39 +174,138 @@ async def upload_documents(files: List[UploadFile] = File(...)):
                 "detail": str(e),
             })
 
-    # 5. Индексируем ВСЕ чанки ОДИН РАЗ после загрузки всех документов
-    if new_documents_loaded:
-        logger.info("Начинаем индексацию новых чанков в ChromaDB")
-        await rag.index_chunks()
+    # 7. Обновляем индекс ОДИН РАЗ после загрузки всех документов (только изменения)
+    if added or moved or removed:
+        logger.info("Начинаем индексацию изменённых чанков в ChromaDB")
+        await rag.apply_chunk_changes(added, moved, removed)
         logger.info("Индексация завершена")
+        # Версия корпуса сменилась — популярные ответы пересчитываем в фоне
+        prewarm.start()
 
     # Возвращаем суммарный результат
     return {"results": results}
 
 
+async def _run_until_disconnect(http_request: Request, coro):
+    """
+    Выполняет корутину, пока клиент подключён.
+    Если клиент отключился — работа отменяется, чтобы не тратить LLM на брошенный запрос.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=settings.DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                logger.info("Клиент отключился — отменяем обработку запроса")
+                metrics.inc("ask_client_disconnected")
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        # Отмена снаружи (дедлайн) — отменяем и внутреннюю задачу
+        if not task.done():
+            task.cancel()
+
+
 @app.post("/api/ask", response_model=AskResponse)
-async def ask_endpoint(request: AskRequest):
+async def ask_endpoint(request: AskRequest, http_request: Request, response: Response,
+                       profile: Optional[str] = Query(default=None)):
+    """
+    Ответ на вопрос. Профилирование запроса: заголовок X-Profile или ?profile=<PROFILE_ADMIN_TOKEN>,
+    либо случайная выборка PROFILE_SAMPLE_RATE; id профиля — в заголовке ответа X-Profile-Id.
+    """
+    if not should_profile(http_request.headers.get("X-Profile") or profile):
+        return await _ask(request, http_request)
+
+    request_profile = start_profile({"path": "/api/ask", "question": request.question[:200]})
+    response.headers["X-Profile-Id"] = request_profile.id
     try:
-        # Получаем ответ (с кэшированием внутри RAGService)
-        answer, tokens_used, duration, sources = await rag.ask(
-            request.question,
-            request.top_k
-        )
+        return await _ask(request, http_request)
+    except HTTPException as e:
+        # Заголовки response к ответу об ошибке не применяются — id профиля добавляем в исключение
+        e.headers = {**(e.headers or {}), "X-Profile-Id": request_profile.id}
+        raise
+    finally:
+        finish_profile(request_profile)
+        await asyncio.to_thread(save_profile, request_profile)
+
 
-        # Асинхронно сохраняем в БД (не блокируем ответ)
+async def _ask(request: AskRequest, http_request: Request) -> AskResponse:
+    timeout_ms = request.timeout_ms or settings.ASK_DEFAULT_TIMEOUT_MS
+    started = time.perf_counter()
+    try:
+        # Получаем ответ (с кэшированием внутри RAGService) с учётом дедлайна
+        async with asyncio.timeout(timeout_ms / 1000):
+            answer, tokens_used, duration, sources, cached, answer_mode, generation_ms = await _run_until_disconnect(
+                http_request,
+                rag.ask(
+                    request.question,
+                    request.top_k,
+                    priority=request.priority,
+                    answer_mode=request.answer_mode,
+                    latency_budget_ms=timeout_ms,
+                    scope=request.scope,
+                )
+            )
+
+        # Асинхронно сохраняем в БД (не блокируем ответ); задержка — фактическое время запроса
+        latency_ms = (time.perf_counter() - started) * 1000
         asyncio.create_task(
-            save_query(request.question, answer, tokens_used, duration)
+            save_query(request.question, answer, tokens_used, latency_ms, cache_hit=cached, generation_ms=generation_ms)
         )
 
         return AskResponse(
             answer=answer,
             tokens=tokens_used,
             latency_ms=duration,
-            sources=sources
+            sources=sources,
+            answer_mode=answer_mode
         )
 
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        logger.warning(f"Очередь LLM заполнена, запрос отклонён (Retry-After={e.retry_after})")
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except TimeoutError:
+        logger.warning(f"Дедлайн запроса истёк ({timeout_ms} ms)")
+        metrics.inc("ask_deadline_exceeded")
+        raise HTTPException(
+            status_code=503,
+            detail="Deadline exceeded",
+            headers={"Retry-After": str(admission.retry_after())}
+        )
     except Exception as e:
         logger.error(f"Ошибка в ask endpoint: {str(e)}")
         logger.error(f"Тип ошибки: {type(e)}")
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail="Internal server error")
+
+
+def _require_admin(http_request: Request, profile: Optional[str]):
+    if not is_admin(http_request.headers.get("X-Profile") or profile):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+@app.get("/api/admin/profiles")
+async def list_profiles_endpoint(http_request: Request, profile: Optional[str] = None):
+    """Сохранённые профили запросов (новые первыми)"""
+    _require_admin(http_request, profile)
+    return await asyncio.to_thread(list_profiles)
+
+
+@app.get("/api/admin/profiles/{profile_id}/{kind}")
+async def get_profile_endpoint(profile_id: str, kind: Literal["speedscope", "collapsed", "stages"],
+                               http_request: Request, profile: Optional[str] = None):
+    """Файл профиля: speedscope (JSON для speedscope.app), collapsed (flamegraph) или stages (этапы)"""
+    _require_admin(http_request, profile)
+    path = profile_file(profile_id, kind)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    media_type = "text/plain" if kind == "collapsed" else "application/json"
+    return FileResponse(path, media_type=media_type, filename=f"{profile_id}-{path.name}")
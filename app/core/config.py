@@ -1,6 +1,5 @@
 import pytz
 
-from datetime import datetime
 from fastapi.templating import Jinja2Templates
 from pathlib import Path
 from pydantic_settings import BaseSettings
@@ -15,8 +14,111 @@ class Settings(BaseSettings):
     DATABASE_URL: str
     REDIS_URL: str
     REDIS_CACHE_TTL: int
+    # TTL оценок релевантности (вопрос, чанк) — их можно хранить дольше готовых ответов
+    REDIS_RERANK_TTL: int = 86400
     MODEL_PATH: str
 
+    # ---- Пул соединений PostgreSQL ----
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_STATEMENT_CACHE_SIZE: int = 500
+    # ---- Адаптивное ранжирование по расстояниям Chroma (L2 для нормированных эмбеддингов, 0..4) ----
+    RERANK_ADAPTIVE: bool = True
+    RERANK_ACCEPT_DISTANCE: float = 0.5   # ближе — чанк берётся без LLM-оценки
+    RERANK_REJECT_DISTANCE: float = 1.4   # дальше — чанк отбрасывается без LLM-оценки
+    RERANK_MARGIN: float = 0.25           # отрыв лучшего кандидата от второго для пропуска ранжирования
+
+    # ---- Контроль допуска к LLM ----
+    ADMISSION_MAX_CONCURRENT: int = 1     # одна модель Llama — одна задача за раз
+    ADMISSION_MAX_QUEUE: int = 32         # больше — 429 Retry-After
+    ASK_DEFAULT_TIMEOUT_MS: int = 60000   # дедлайн запроса, если клиент не передал timeout_ms
+    DISCONNECT_POLL_INTERVAL: float = 0.5  # как часто проверять, не отключился ли клиент (с)
+
+    # ---- Деградация под нагрузкой: экстрактивный ответ без ранжирования и генерации ----
+    DEGRADE_ENABLED: bool = True
+    DEGRADE_QUEUE_DEPTH: int = 8               # очередь к LLM не короче — отвечаем экстрактивно
+    DEGRADE_LATENCY_BUDGET_MS: int = 15000     # ожидание слота LLM дольше бюджета — тоже
+    EXTRACTIVE_MAX_SENTENCES: int = 3
+
+    # ---- Прогрев кэша по истории запросов ----
+    PREWARM_ON_STARTUP: bool = True
+    PREWARM_WINDOW_HOURS: int = 168       # окно истории (по умолчанию неделя)
+    PREWARM_TOP_N: int = 50
+    PREWARM_TOP_K: int = 5                # top_k, с которым считаются ответы (как в AskRequest)
+    PREWARM_INTERVAL_SEC: float = 1.0     # пауза между пересчётами
+    PREWARM_IDLE_POLL_SEC: float = 0.5
+
+    # ---- Партиции query_history ----
+    PARTITION_MONTHS_AHEAD: int = 2          # сколько будущих месячных партиций держать готовыми
+    PARTITION_RETENTION_MONTHS: int = 6      # партиции старше — выгружаются в архив и удаляются
+    PARTITION_ARCHIVE_DIR: str = "archive/query_history"
+    PARTITION_EXPORT_BATCH: int = 5000
+    PARTITION_MAINTENANCE_INTERVAL_HOURS: int = 24
+    # Минутные агрегаты /api/stats старше — удаляются при обслуживании партиций (часовые хранятся все)
+    STATS_MINUTE_RETENTION_HOURS: int = 48
+
+    # ---- ChromaDB ----
+    CHROMA_HTTP_HOST: str = "chroma"
+    CHROMA_HTTP_PORT: int = 8000
+    CHROMA_COLLECTION: str = "document_chunks"
+    # Шардирование индекса: none — одна коллекция; group — коллекция на группу документов
+    # (<CHROMA_COLLECTION>__<группа>); hash — CHROMA_SHARD_COUNT коллекций по id документа
+    CHROMA_SHARDING: str = "none"
+    CHROMA_SHARD_COUNT: int = 4
+    CHROMA_SHARD_REFRESH_SEC: float = 30.0  # как часто перечитывать список шардов-групп из Chroma
+
+    # Размер пачки при экспорте/импорте снимка индекса
+    SNAPSHOT_BATCH_SIZE: int = 1000
+
+    # ---- Эмбеддинги ----
+    EMBED_MODEL_NAME: str = "all-MiniLM-L6-v2"
+    EMBED_BACKEND: str = "sentence-transformers"  # или "onnx" (int8, onnxruntime)
+    EMBED_ONNX_PATH: str = "models/all-MiniLM-L6-v2-int8"  # model.onnx + tokenizer.json
+    EMBED_THREADS: int = 2
+    EMBED_BATCH_WINDOW_MS: float = 3.0  # окно сбора вопросов в одну пачку
+    EMBED_MAX_BATCH: int = 64
+    EMBED_INGEST_BATCH: int = 256        # размер пачки при индексации
+
+    # Размер пачки при потоковом чтении чанков для индексации
+    INDEX_BATCH_SIZE: int = 500
+
+    # ---- Профилирование запросов /api/ask ----
+    # Заголовок X-Profile или ?profile=<токен> профилирует запрос; пустой токен — только выборка
+    PROFILE_ADMIN_TOKEN: str = ""
+    PROFILE_SAMPLE_RATE: float = 0.0   # доля запросов, профилируемых автоматически
+    PROFILE_INTERVAL_MS: float = 5.0   # интервал сэмплирования стеков
+    PROFILE_DIR: str = "profiles"
+    PROFILE_MAX_STORED: int = 200
+
+    # ---- Режим поддельных моделей (нагрузочное тестирование, python -m app.loadtest) ----
+    # Llama и эмбеддер заменяются детерминированными заглушками с заданной задержкой
+    FAKE_MODELS: bool = False
+    FAKE_LLM_LATENCY_MS: float = 150.0   # задержка на вызов
+    FAKE_LLM_TOKEN_MS: float = 5.0       # + на каждый сгенерированный токен
+    FAKE_LLM_ANSWER_TOKENS: int = 60
+    FAKE_EMBED_LATENCY_MS: float = 2.0   # задержка на пачку
+    FAKE_EMBED_DIM: int = 384
+    # Chroma в памяти процесса вместо HTTP-сервера
+    CHROMA_IN_MEMORY: bool = False
+
+    # ---- Пакетная загрузка документов (python -m app.ingest) ----
+    # Процессов для разбора файлов (0 — по числу ядер)
+    INGEST_WORKERS: int = 0
+    # Сколько чанков копить перед пакетной записью новых документов в БД, векторизацией и записью в Chroma
+    INGEST_EMBED_BATCH: int = 2000
+    # Файл прогресса внутри загружаемой директории (для продолжения после прерывания)
+    INGEST_CHECKPOINT_FILE: str = ".ingest_checkpoint.json"
+
+    # ---- Логирование ----
+    LOG_LEVEL: str = "INFO"
+    # Уровни для отдельных модулей: "app.services.rag=DEBUG,app.services.cache=WARNING"
+    LOG_LEVELS: str = ""
+    LOG_JSON: bool = True
+    LOG_FILE_MAX_BYTES: int = 10 * 1024 * 1024
+    LOG_FILE_BACKUP_COUNT: int = 5
+
     class Config:
         env_file = BASE_DIR / ".env"  # имя файла с переменными окружения
 
@@ -25,7 +127,6 @@ TEMPLATES_DIR = BASE_DIR / "app/templates"
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
 
 irkutsk_tz = pytz.timezone("Asia/Irkutsk")
-created_at_irkutsk_tz = datetime.now(irkutsk_tz)
 
 # Создаём объект settings для использования в проекте
 settings = Settings()
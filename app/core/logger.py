@@ -1,6 +1,14 @@
+import atexit
+import json
 import logging
+import queue
+
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from os import path, makedirs
 
+from app.core.config import settings
+
 logging.getLogger("aiogram.event").propagate = False
 logging.getLogger("aiogram").propagate = False
 
@@ -17,24 +25,91 @@ log_file_path = path.join(log_dir, "prod.log")
 # Создать папку logs, если не существует
 makedirs(log_dir, exist_ok=True)
 
-# Открываем файл для записи (w+ или a+ — по необходимости)
-out = open(log_file_path, 'w+')
+# Корневой логгер приложения: все модули пишут в его потомков (app.services.rag и т.д.)
+APP_LOGGER_NAME = "app"
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Форматирует запись лога в одну JSON-строку (удобно для сбора и парсинга логов).
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+        }
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+def _parse_module_levels(raw: str) -> dict:
+    """
+    Разбирает строку вида "app.services.rag=DEBUG,app.services.cache=WARNING"
+    в словарь {имя логгера: уровень}.
+    """
+    levels = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def _setup_logging() -> QueueListener:
+    """
+    Настройка асинхронного логирования: логгеры кладут записи в очередь,
+    а запись на диск и в консоль выполняется в отдельном потоке QueueListener.
+    """
+    # Файл открывается в режиме append и ротируется по размеру (без обнуления при рестарте)
+    file_handler = RotatingFileHandler(
+        log_file_path,
+        maxBytes=settings.LOG_FILE_MAX_BYTES,
+        backupCount=settings.LOG_FILE_BACKUP_COUNT,
+        encoding="utf-8",
+    )
+    if settings.LOG_JSON:
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+
+    app_logger = logging.getLogger(APP_LOGGER_NAME)
+    app_logger.setLevel(settings.LOG_LEVEL.upper())
+    app_logger.addHandler(QueueHandler(log_queue))
+    app_logger.propagate = False
+
+    # Уровни для отдельных модулей
+    for name, level in _parse_module_levels(settings.LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
 
-# Настройка базового логгера
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+def get_logger(name: str) -> logging.Logger:
+    """
+    Логгер модуля. Имена вида app.* наследуют обработчики и уровень логгера приложения.
+    """
+    return logging.getLogger(name)
 
-# Создание обработчика для записи в файл
-file_handler = logging.StreamHandler(out)
-file_handler.setLevel(logging.INFO)
 
-# Форматирование логов
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
+listener = _setup_logging()
 
-# Добавляем обработчик к логгеру
-logger.addHandler(file_handler)
+# Общий логгер приложения (для модулей без собственного логгера)
+logger = get_logger(APP_LOGGER_NAME)
 
-# Тест
 logger.info("Логирование успешно настроено!")
 logger.info("Сервис начинает работает!")
@@ -1,64 +1,387 @@
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from itertools import islice
+from typing import Optional
+
+from sqlalchemy import delete, func, insert, update
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
 
 from app.database.session import async_session
-from app.database.models import QueryHistory, Document, DocumentChunk
-from app.core.config import created_at_irkutsk_tz
-from app.core.logger import logger
+from app.database.models import (
+    DEFAULT_DOCUMENT_GROUP, QueryHistory, Document, DocumentChunk, QueryStatsRollup, QueryLatencyHistogram
+)
+from app.core.config import irkutsk_tz
+from app.core.logger import get_logger
+from app.services.other_functions import content_hash, normalize_question
+from app.services.stats import GRANULARITIES, bucket_start, latency_bin, percentiles_from_histogram
 
 
-async def save_document(filename: str, chunks: list):
-    """Сохранение документа в базу данных"""
-    try:
-        async with async_session() as session:
-            doc = Document(filename=filename, chunks_count=len(chunks))
+logger = get_logger(__name__)
+
+# Чанк в виде, нужном для векторного индекса
+IndexedChunk = namedtuple(
+    "IndexedChunk",
+    ["id", "document_id", "chunk_index", "text", "filename", "group_name"],
+    defaults=(DEFAULT_DOCUMENT_GROUP,)
+)
+
+
+async def get_document_by_filename(filename: str, group_name: str = DEFAULT_DOCUMENT_GROUP):
+    """
+    Последний загруженный документ с таким именем в группе: (id, content_hash) или None.
+    """
+    async with async_session() as session:
+        result = await session.execute(
+            select(Document.id, Document.content_hash)
+            .where(Document.filename == filename, Document.group_name == group_name)
+            .order_by(Document.id.desc())
+            .limit(1)
+        )
+        return result.first()
+
+
+async def upsert_document(filename: str, file_hash: str, chunks: list, document_id: Optional[int] = None,
+                          group_name: str = DEFAULT_DOCUMENT_GROUP) -> dict:
+    """
+    Создание документа или инкрементальная замена его чанков.
+    Чанки сопоставляются по sha256 текста: совпавшие остаются (без повторной векторизации),
+    новые добавляются, исчезнувшие удаляются.
+
+    Возвращает словарь:
+    - document_id, change ("created" / "updated");
+    - added: новые чанки (IndexedChunk) — их нужно проиндексировать;
+    - moved: оставшиеся чанки, у которых поменялся chunk_index;
+    - removed: id удалённых чанков.
+    """
+    chunk_hashes = [content_hash(text) for text in chunks]
+
+    async with async_session() as session:
+        existing = defaultdict(list)  # hash -> [(id, chunk_index)]
+        if document_id is None:
+            doc = Document(filename=filename, content_hash=file_hash, chunks_count=len(chunks), group_name=group_name)
             session.add(doc)
             await session.flush()  # получаем ID документа
+            change = "created"
+        else:
+            doc = await session.get(Document, document_id)
+            doc.content_hash = file_hash
+            doc.chunks_count = len(chunks)
+            result = await session.execute(
+                select(DocumentChunk.id, DocumentChunk.content_hash, DocumentChunk.chunk_index)
+                .where(DocumentChunk.document_id == document_id)
+                .order_by(DocumentChunk.chunk_index)
+            )
+            for chunk_id, chunk_hash, chunk_index in result.all():
+                existing[chunk_hash].append((chunk_id, chunk_index))
+            change = "updated"
 
-            # Добавляем чанки
-            for i, text in enumerate(chunks):
-                chunk = DocumentChunk(
-                    document_id=doc.id,
-                    text=text,
-                    chunk_index=i
-                )
-                session.add(chunk)
+        new_chunks = []
+        moved = []
+        for i, (text, chunk_hash) in enumerate(zip(chunks, chunk_hashes)):
+            if existing.get(chunk_hash):
+                chunk_id, old_index = existing[chunk_hash].pop(0)
+                if old_index != i:
+                    moved.append(IndexedChunk(chunk_id, doc.id, i, text, filename, group_name))
+                continue
 
-            await session.commit()
-            logger.info(f"Документ сохранен в БД: {filename}...")
-            return doc.id
-    except Exception as e:
-        logger.error(f"Ошибка сохранения документа в БД: {e}")
+            chunk = DocumentChunk(document_id=doc.id, text=text, chunk_index=i, content_hash=chunk_hash)
+            session.add(chunk)
+            new_chunks.append(chunk)
 
+        # Всё, что не сопоставилось (включая старые чанки без хэша), удаляем
+        removed = [chunk_id for ids in existing.values() for chunk_id, _ in ids]
+        if removed:
+            await session.execute(delete(DocumentChunk).where(DocumentChunk.id.in_(removed)))
+        if moved:
+            await session.execute(
+                update(DocumentChunk),
+                [{"id": c.id, "chunk_index": c.chunk_index} for c in moved]
+            )
+
+        await session.flush()
+        added = [IndexedChunk(c.id, doc.id, c.chunk_index, c.text, filename, group_name) for c in new_chunks]
+        await session.commit()
+
+    logger.info(
+        "Документ %s (id=%s) %s: +%d, -%d, перемещено %d чанков",
+        filename, doc.id, change, len(added), len(removed), len(moved)
+    )
+    return {
+        "document_id": doc.id,
+        "change": change,
+        "added": added,
+        "moved": moved,
+        "removed": removed,
+    }
+
+
+async def insert_documents(documents: list[tuple[str, str, list]],
+                           group_name: str = DEFAULT_DOCUMENT_GROUP) -> list[dict]:
+    """
+    Пакетное создание новых документов (офлайн-загрузка): [(имя файла, sha256 файла, чанки)].
+    Документы и все их чанки пишутся двумя INSERT ... RETURNING (executemany) в одной транзакции.
+    Для каждого документа возвращает то же, что upsert_document для нового документа.
+    """
+    if not documents:
+        return []
+
+    async with async_session() as session:
+        doc_ids = (await session.scalars(
+            insert(Document).returning(Document.id, sort_by_parameter_order=True),
+            [
+                {"filename": filename, "content_hash": file_hash, "chunks_count": len(chunks),
+                 "group_name": group_name}
+                for filename, file_hash, chunks in documents
+            ]
+        )).all()
+        rows = [
+            {"document_id": doc_id, "text": text, "chunk_index": i, "content_hash": content_hash(text)}
+            for doc_id, (_, _, chunks) in zip(doc_ids, documents)
+            for i, text in enumerate(chunks)
+        ]
+        chunk_ids = (await session.scalars(
+            insert(DocumentChunk).returning(DocumentChunk.id, sort_by_parameter_order=True), rows
+        )).all() if rows else []
+        await session.commit()
+
+    results = []
+    created = iter(zip(chunk_ids, rows))  # чанки идут подряд в порядке документов
+    for doc_id, (filename, _, chunks) in zip(doc_ids, documents):
+        added = [
+            IndexedChunk(chunk_id, doc_id, row["chunk_index"], row["text"], filename, group_name)
+            for chunk_id, row in islice(created, len(chunks))
+        ]
+        results.append({"document_id": doc_id, "change": "created", "added": added, "moved": [], "removed": []})
+    logger.info("Пакетно создано документов: %d, чанков: %d", len(doc_ids), len(chunk_ids))
+    return results
 
-async def save_query(question: str, answer: str, tokens: int, latency_ms: float):
-    """Сохранение запроса в базу данных"""
+
+async def save_query(question: str, answer: str, tokens: int, latency_ms: float, cache_hit: bool = False,
+                     generation_ms: float = 0.0):
+    """
+    Сохранение запроса в базу данных (вместе с инкрементальным обновлением статистики).
+    generation_ms — длительность вызова LLM, породившего ответ (0 — ответ из кэша или без генерации).
+    """
     try:
         async with async_session() as session:
+            created_at = datetime.now(irkutsk_tz)
             query = QueryHistory(
                 question=question,
                 answer=answer,
                 tokens=tokens,
-                latency_ms=latency_ms,
-                created_at=created_at_irkutsk_tz
+                latency_ms=int(round(latency_ms)),  # колонка целочисленная (asyncpg не примет float)
+                cache_hit=cache_hit,
+                created_at=created_at
             )
             session.add(query)
+            await _update_stats_rollups(session, created_at, latency_ms, tokens, cache_hit, generation_ms)
             await session.commit()
-            logger.info(f"Запрос сохранен в БД: {question[:50]}...")
+            logger.debug("Запрос сохранен в БД: %.50s...", question)
     except Exception as e:
         logger.error(f"Ошибка сохранения запроса в БД: {e}")
 
 
-async def get_sources_for_chunks(chunk_ids: list[int]) -> list[DocumentChunk]:
+def _upsert_increment(session, model, keys: dict, increments: dict):
+    """INSERT ... ON CONFLICT DO UPDATE SET col = col + excluded.col"""
+    if session.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    stmt = insert(model).values(**keys, **increments)
+    return stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={name: getattr(model, name) + stmt.excluded[name] for name in increments},
+    )
+
+
+async def _update_stats_rollups(session, created_at: datetime, latency_ms: float, tokens: int, cache_hit: bool,
+                                generation_ms: float):
+    """
+    Инкрементальное обновление минутных и часовых агрегатов и гистограмм задержек.
+    Токены и время генерации учитываются только для ответов, сгенерированных LLM в этом запросе.
+    """
+    generated = not cache_hit and generation_ms > 0
+    for granularity in GRANULARITIES:
+        keys = {"granularity": granularity, "bucket_start": bucket_start(created_at, granularity)}
+        await session.execute(_upsert_increment(session, QueryStatsRollup, keys, {
+            "requests": 1,
+            "cache_hits": int(cache_hit),
+            "latency_sum_ms": latency_ms,
+            "generated_tokens": (tokens or 0) if generated else 0,
+            "generation_ms": generation_ms if generated else 0,
+        }))
+        await session.execute(_upsert_increment(
+            session, QueryLatencyHistogram, {**keys, "bin": latency_bin(latency_ms)}, {"count": 1}
+        ))
+
+
+async def prune_minute_rollups(before: datetime) -> int:
+    """Удаляет минутные агрегаты и гистограммы с интервалами раньше before, возвращает число интервалов"""
+    async with async_session() as session:
+        result = await session.execute(
+            delete(QueryStatsRollup)
+            .where(QueryStatsRollup.granularity == "minute", QueryStatsRollup.bucket_start < before)
+        )
+        await session.execute(
+            delete(QueryLatencyHistogram)
+            .where(QueryLatencyHistogram.granularity == "minute", QueryLatencyHistogram.bucket_start < before)
+        )
+        await session.commit()
+    return result.rowcount
+
+
+async def get_stats(granularity: str, since: datetime) -> dict:
     """
-    Получаем список названий документов, из которых взяты чанки.
-    Возвращаем уникальные названия.
+    Статистика по интервалам из rollup-таблиц: p50/p95/p99, токены/с, доля кэша, QPS.
+    Объём чтения зависит только от числа интервалов, а не от размера истории.
+    QPS итога — за всё окно с since до текущего момента (интервалы без запросов тоже считаются).
+    """
+    async with async_session() as session:
+        rollups = (await session.execute(
+            select(QueryStatsRollup)
+            .where(QueryStatsRollup.granularity == granularity, QueryStatsRollup.bucket_start >= since)
+            .order_by(QueryStatsRollup.bucket_start)
+        )).scalars().all()
+        histogram_rows = (await session.execute(
+            select(QueryLatencyHistogram.bucket_start, QueryLatencyHistogram.bin, QueryLatencyHistogram.count)
+            .where(QueryLatencyHistogram.granularity == granularity, QueryLatencyHistogram.bucket_start >= since)
+        )).all()
+
+    histograms = defaultdict(dict)
+    total_histogram = defaultdict(int)
+    for start, bin_index, count in histogram_rows:
+        histograms[start][bin_index] = count
+        total_histogram[bin_index] += count
+
+    bucket_seconds = GRANULARITIES[granularity].total_seconds()
+    quantiles = [0.5, 0.95, 0.99]
+
+    def summarize(requests, cache_hits, generated_tokens, generation_ms, histogram, seconds):
+        return {
+            "requests": requests,
+            "qps": round(requests / seconds, 4) if seconds else None,
+            "cache_hit_ratio": round(cache_hits / requests, 4) if requests else None,
+            "tokens_per_s": round(generated_tokens / (generation_ms / 1000), 2) if generation_ms else None,
+            "latency_ms": percentiles_from_histogram(histogram, quantiles),
+        }
+
+    buckets = [
+        {
+            "bucket_start": r.bucket_start.isoformat(),
+            **summarize(r.requests, r.cache_hits, r.generated_tokens, r.generation_ms,
+                        histograms.get(r.bucket_start, {}), bucket_seconds),
+        }
+        for r in rollups
+    ]
+    total = summarize(
+        sum(r.requests for r in rollups),
+        sum(r.cache_hits for r in rollups),
+        sum(r.generated_tokens for r in rollups),
+        sum(r.generation_ms for r in rollups),
+        total_histogram,
+        (datetime.now(since.tzinfo) - since).total_seconds(),
+    )
+    return {"granularity": granularity, "total": total, "buckets": buckets}
+
+
+async def get_sources_for_chunks(chunk_ids: list[int]) -> dict[int, str]:
+    """
+    Получаем названия документов, из которых взяты чанки.
+    Возвращаем словарь chunk_id -> имя файла (только нужные колонки, без загрузки текста).
     """
     async with async_session() as session:
         result = await session.execute(
-            select(DocumentChunk)
+            select(DocumentChunk.id, Document.filename)
+            .join(Document, DocumentChunk.document_id == Document.id)
             .where(DocumentChunk.id.in_(chunk_ids))
-            .options(selectinload(DocumentChunk.document))
         )
-        chunks = result.scalars().all()
-    return chunks
+        return {chunk_id: filename for chunk_id, filename in result.all()}
+
+
+async def iter_chunks_for_index(batch_size: int, group_name: Optional[str] = None,
+                                hash_shard: Optional[tuple[int, int]] = None):
+    """
+    Потоково читает чанки для индексации пачками по batch_size строк.
+    Каждая строка: id, document_id, chunk_index, text, filename, group_name.
+    Весь корпус в память не загружается.
+    group_name / hash_shard=(номер, число шардов) — только чанки одного шарда индекса.
+    """
+    query = (
+        select(
+            DocumentChunk.id,
+            DocumentChunk.document_id,
+            DocumentChunk.chunk_index,
+            DocumentChunk.text,
+            Document.filename,
+            Document.group_name,
+        )
+        .join(Document, DocumentChunk.document_id == Document.id)
+        .order_by(DocumentChunk.id)
+        .execution_options(yield_per=batch_size)
+    )
+    if group_name is not None:
+        query = query.where(Document.group_name == group_name)
+    if hash_shard is not None:
+        shard, shard_count = hash_shard
+        query = query.where(DocumentChunk.document_id % shard_count == shard)
+
+    async with async_session() as session:
+        result = await session.stream(query)
+        async for partition in result.partitions():
+            yield partition
+
+
+async def get_document_chunks(document_id: int) -> list[IndexedChunk]:
+    """
+    Чанки документа для (до)индексации, по порядку.
+    """
+    async with async_session() as session:
+        result = await session.execute(
+            select(
+                DocumentChunk.id,
+                DocumentChunk.document_id,
+                DocumentChunk.chunk_index,
+                DocumentChunk.text,
+                Document.filename,
+                Document.group_name,
+            )
+            .join(Document, DocumentChunk.document_id == Document.id)
+            .where(DocumentChunk.document_id == document_id)
+            .order_by(DocumentChunk.chunk_index)
+        )
+        return [IndexedChunk(*row) for row in result.all()]
+
+
+async def get_document_groups() -> list[str]:
+    """Все группы документов"""
+    async with async_session() as session:
+        result = await session.execute(select(Document.group_name).distinct().order_by(Document.group_name))
+        return list(result.scalars().all())
+
+
+async def get_top_questions(since: datetime, limit: int) -> list[tuple[str, int]]:
+    """
+    Самые частые вопросы с момента since: [(вопрос, количество)], по убыванию частоты.
+    Варианты одного вопроса (регистр, пробелы, знаки в конце) считаются вместе.
+    """
+    normalized = func.lower(func.trim(QueryHistory.question))
+    hits = func.count(QueryHistory.id)
+    async with async_session() as session:
+        result = await session.execute(
+            select(func.min(QueryHistory.question), hits)
+            .where(QueryHistory.created_at >= since)
+            .group_by(normalized)
+            .order_by(hits.desc())
+            .limit(limit * 4)  # запас на варианты, которые сольются после нормализации
+        )
+        rows = result.all()
+
+    merged = {}
+    for question, count in rows:
+        key = normalize_question(question)
+        if key in merged:
+            merged[key] = (merged[key][0], merged[key][1] + count)
+        else:
+            merged[key] = (question, count)
+    return sorted(merged.values(), key=lambda item: item[1], reverse=True)[:limit]
@@ -2,6 +2,9 @@ from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy import (
     Column,
     Integer,
+    BigInteger,
+    Boolean,
+    Float,
     String,
     Text,
     DateTime,
@@ -13,22 +16,27 @@ from sqlalchemy import (
 
 Base = declarative_base()
 
+# Группа (тенант/продукт) документа по умолчанию
+DEFAULT_DOCUMENT_GROUP = "default"
+
 
 class QueryHistory(Base):
     """
     История вопросов/ответов (для аналитики, метрик, ретрейсинга).
     Сохраняем вопрос, ответ, количество токенов и модель.
+    В PostgreSQL таблица партиционирована по месяцам (created_at), см. database/partitions.py.
     """
     __tablename__ = "query_history"
     __table_args__ = (
         Index("ix_query_history_created_at", "created_at"),
     )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     question = Column(Text, nullable=False)
     answer = Column(Text, nullable=False)
     tokens = Column(Integer, nullable=True)
     latency_ms = Column(Integer, nullable=True)  # время ответа в ms
+    cache_hit = Column(Boolean, nullable=True)  # ответ отдан из кэша Redis
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     def __repr__(self):
@@ -41,14 +49,30 @@ class Document(Base):
     Текст сам по себе сохраняется в DocumentChunk.
     """
     __tablename__ = "documents"
+    __table_args__ = (
+        Index("ix_documents_filename", "filename"),
+        Index("ix_documents_group_name", "group_name"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String(255), nullable=False)
+    content_hash = Column(String(64), nullable=True)  # sha256 исходного файла
+    # Группа документов: по ней шардируется векторный индекс и ограничивается поиск (scope)
+    group_name = Column(String(64), nullable=False, default=DEFAULT_DOCUMENT_GROUP,
+                        server_default=DEFAULT_DOCUMENT_GROUP)
     chunks_count = Column(Integer, default=0)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # relationship -> DocumentChunk.document
-    chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan", lazy="selectin")
+    # lazy="select": чанки (с текстом) подгружаются только по явному обращению;
+    # в горячих путях используем запросы с выбором нужных колонок (см. crud.py)
+    chunks = relationship(
+        "DocumentChunk",
+        back_populates="document",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        lazy="select",
+    )
 
     def __repr__(self):
         return f"<Document(id={self.id}, filename='{self.filename}', created_at={self.created_at})>"
@@ -68,10 +92,47 @@ class DocumentChunk(Base):
     document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False)
     text = Column(Text, nullable=False)
     chunk_index = Column(Integer, nullable=False, default=0)
+    content_hash = Column(String(64), nullable=True)  # sha256 текста чанка
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # relationship -> Document.chunks
-    document = relationship("Document", back_populates="chunks", lazy="joined")
+    document = relationship("Document", back_populates="chunks", lazy="select")
 
     def __repr__(self):
         return f"<DocumentChunk(id={self.id}, document_id={self.document_id}, created_at={self.created_at})>"
+
+
+class QueryStatsRollup(Base):
+    """
+    Предагрегированная статистика запросов за минуту/час.
+    Обновляется инкрементально при записи каждой строки query_history,
+    поэтому /api/stats не читает сырую историю.
+    """
+    __tablename__ = "query_stats_rollups"
+
+    granularity = Column(String(8), primary_key=True)  # minute / hour
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    requests = Column(Integer, nullable=False, default=0)
+    cache_hits = Column(Integer, nullable=False, default=0)
+    latency_sum_ms = Column(Float, nullable=False, default=0)
+    generated_tokens = Column(BigInteger, nullable=False, default=0)  # токены ответов, сгенерированных LLM
+    generation_ms = Column(Float, nullable=False, default=0)  # время вызовов LLM, сгенерировавших ответы
+
+    def __repr__(self):
+        return f"<QueryStatsRollup(granularity={self.granularity}, bucket_start={self.bucket_start}, requests={self.requests})>"
+
+
+class QueryLatencyHistogram(Base):
+    """
+    Гистограмма задержек (логарифмические корзины) для каждого интервала rollup-таблицы.
+    По ней считаются p50/p95/p99 без чтения сырой истории.
+    """
+    __tablename__ = "query_latency_histogram"
+
+    granularity = Column(String(8), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    bin = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<QueryLatencyHistogram(bucket_start={self.bucket_start}, bin={self.bin}, count={self.count})>"
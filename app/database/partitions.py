@@ -0,0 +1,244 @@
+import asyncio
+import gzip
+import json
+import re
+
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import text
+
+from app.core.config import BASE_DIR, irkutsk_tz, settings
+from app.core.logger import get_logger
+from app.database.crud import prune_minute_rollups
+from app.database.session import engine
+
+
+logger = get_logger(__name__)
+
+# query_history разбита на месячные партиции: query_history_y2026m10 и т.д.
+PARENT_TABLE = "query_history"
+DEFAULT_PARTITION = "query_history_default"
+PARTITION_NAME_RE = re.compile(r"^query_history_y(\d{4})m(\d{2})$")
+
+# Родительская таблица (если БД создаётся без Alembic). Ключ партиционирования должен входить в PK.
+CREATE_PARENT_DDL = """
+CREATE TABLE IF NOT EXISTS query_history (
+    id SERIAL NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    tokens INTEGER,
+    latency_ms INTEGER,
+    cache_hit BOOLEAN,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at)
+"""
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+def add_months(month: date, months: int) -> date:
+    """Первое число месяца через months месяцев"""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+async def ensure_parent_table(conn) -> bool:
+    """
+    Создаёт партиционированную query_history, если таблицы ещё нет (только PostgreSQL).
+    False — если query_history уже есть, но обычная (нужно применить миграции Alembic).
+    """
+    relkind = (await conn.execute(
+        text("SELECT relkind FROM pg_class WHERE relname = :name AND relkind IN ('r', 'p')"),
+        {"name": PARENT_TABLE}
+    )).scalar()
+    if relkind == "r":
+        logger.warning("query_history не партиционирована — выполните alembic upgrade head")
+        return False
+
+    await conn.execute(text(CREATE_PARENT_DDL))
+    await conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT"
+    ))
+    await conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS ix_query_history_created_at ON {PARENT_TABLE} (created_at)"
+    ))
+    return True
+
+
+async def ensure_partitions(conn, months_ahead: int = None):
+    """Создаёт партиции с текущего месяца на months_ahead месяцев вперёд"""
+    months_ahead = settings.PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    current = datetime.now(irkutsk_tz).date().replace(day=1)
+    for offset in range(months_ahead + 1):
+        start = add_months(current, offset)
+        end = add_months(start, 1)
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF {PARENT_TABLE} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+
+
+async def list_partitions(conn) -> list[tuple[str, date]]:
+    """Месячные партиции query_history: [(имя, первое число месяца)] по возрастанию"""
+    result = await conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :parent"
+    ), {"parent": PARENT_TABLE})
+    partitions = []
+    for (name,) in result.all():
+        match = PARTITION_NAME_RE.match(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda item: item[1])
+
+
+async def list_detached_partitions(conn) -> list[tuple[str, date]]:
+    """
+    Месячные таблицы query_history_y*, не подключённые к query_history
+    (остались от прерванной архивации) — их тоже нужно выгрузить и удалить.
+    """
+    result = await conn.execute(text(
+        "SELECT c.relname FROM pg_class c "
+        "WHERE c.relkind = 'r' AND c.relname LIKE :pattern "
+        "AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)"
+    ), {"pattern": f"{PARENT_TABLE}_y%"})
+    partitions = []
+    for (name,) in result.all():
+        match = PARTITION_NAME_RE.match(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda item: item[1])
+
+
+async def _export_rows(query: str, params: dict, path: Path) -> int:
+    """Выгружает строки query_history (результат query) в gzip JSONL, возвращает число строк"""
+    rows = 0
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    gz = await asyncio.to_thread(gzip.open, tmp_path, "wt", encoding="utf-8")
+    try:
+        async with engine.connect() as conn:
+            result = await conn.stream(text(query), params)
+            async for batch in result.mappings().partitions(settings.PARTITION_EXPORT_BATCH):
+                lines = "".join(
+                    json.dumps({**row, "created_at": row["created_at"].isoformat()}, ensure_ascii=False) + "\n"
+                    for row in batch
+                )
+                await asyncio.to_thread(gz.write, lines)
+                rows += len(batch)
+    finally:
+        await asyncio.to_thread(gz.close)
+    tmp_path.replace(path)
+    return rows
+
+
+async def _export_partition(name: str, path: Path) -> int:
+    return await _export_rows(
+        f"SELECT id, question, answer, tokens, latency_ms, cache_hit, created_at FROM {name} ORDER BY id",
+        {}, path
+    )
+
+
+async def _archive_default_partition(cutoff: date, archive_dir: Path) -> Optional[dict]:
+    """
+    Строки старше cutoff в DEFAULT-партиции (попали туда, пока не было месячной партиции):
+    выгружаются в отдельный архив и удаляются.
+    """
+    condition = f"FROM {DEFAULT_PARTITION} WHERE created_at < :cutoff"
+    params = {"cutoff": cutoff}
+    async with engine.connect() as conn:
+        if not (await conn.execute(text(f"SELECT count(*) {condition}"), params)).scalar():
+            return None
+
+    path = archive_dir / f"{DEFAULT_PARTITION}_{datetime.now(irkutsk_tz):%Y%m%dT%H%M%S}.jsonl.gz"
+    rows = await _export_rows(
+        f"SELECT id, question, answer, tokens, latency_ms, cache_hit, created_at {condition} ORDER BY id",
+        params, path
+    )
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DELETE {condition}"), params)
+    logger.info("Из %s выгружено в %s и удалено %d строк старше %s", DEFAULT_PARTITION, path, rows, cutoff)
+    return {"partition": DEFAULT_PARTITION, "rows": rows, "path": str(path)}
+
+
+async def archive_old_partitions(retention_months: int = None) -> list[dict]:
+    """
+    Выгружает партиции старше retention_months в PARTITION_ARCHIVE_DIR/<партиция>.jsonl.gz,
+    затем отсоединяет и удаляет их. Выгрузка идёт, пока партиция подключена: если она
+    не удалась, данные остаются доступны запросам и архивация повторится в следующий раз.
+    Подхватываются и отсоединённые ранее таблицы, и старые строки DEFAULT-партиции.
+    """
+    retention_months = settings.PARTITION_RETENTION_MONTHS if retention_months is None else retention_months
+    cutoff = add_months(datetime.now(irkutsk_tz).date().replace(day=1), -retention_months)
+    archive_dir = BASE_DIR / settings.PARTITION_ARCHIVE_DIR
+    archive_dir.mkdir(parents=True, exist_ok=True)
+
+    async with engine.connect() as conn:
+        old = [(name, month, True) for name, month in await list_partitions(conn) if month < cutoff]
+        old += [(name, month, False) for name, month in await list_detached_partitions(conn) if month < cutoff]
+
+    archived = []
+    for name, month, attached in old:
+        path = archive_dir / f"{name}.jsonl.gz"
+        try:
+            rows = await _export_partition(name, path)
+        except Exception as e:
+            logger.error(f"Ошибка выгрузки партиции {name}, партиция оставлена: {e}")
+            continue
+
+        async with engine.begin() as conn:
+            if attached:
+                await conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+            await conn.execute(text(f"DROP TABLE {name}"))
+        logger.info("Партиция %s выгружена в %s (%d строк) и удалена", name, path, rows)
+        archived.append({"partition": name, "rows": rows, "path": str(path)})
+
+    try:
+        default = await _archive_default_partition(cutoff, archive_dir)
+    except Exception as e:
+        logger.error(f"Ошибка архивации старых строк {DEFAULT_PARTITION}: {e}")
+    else:
+        if default:
+            archived.append(default)
+    return archived
+
+
+async def prune_stats_rollups(retention_hours: int = None) -> int:
+    """Удаляет минутные агрегаты статистики старше retention_hours (часовые не трогает)"""
+    retention_hours = settings.STATS_MINUTE_RETENTION_HOURS if retention_hours is None else retention_hours
+    pruned = await prune_minute_rollups(datetime.now(irkutsk_tz) - timedelta(hours=retention_hours))
+    if pruned:
+        logger.info("Удалено минутных интервалов статистики старше %d ч: %d", retention_hours, pruned)
+    return pruned
+
+
+async def run_maintenance():
+    """Создание будущих партиций, удаление старых минутных агрегатов статистики и архивация старых партиций"""
+    async with engine.begin() as conn:
+        await ensure_partitions(conn)
+    try:
+        await prune_stats_rollups()
+    except Exception as e:
+        logger.error(f"Ошибка удаления старых минутных агрегатов статистики: {e}")
+    return await archive_old_partitions()
+
+
+async def maintenance_loop():
+    """Фоновое обслуживание партиций (раз в PARTITION_MAINTENANCE_INTERVAL_HOURS)"""
+    while True:
+        try:
+            await run_maintenance()
+        except Exception as e:
+            logger.error(f"Ошибка обслуживания партиций query_history: {e}")
+        await asyncio.sleep(settings.PARTITION_MAINTENANCE_INTERVAL_HOURS * 3600)
+
+
+if __name__ == "__main__":
+    # python -m app.database.partitions — создать партиции и архивировать старые
+    print(json.dumps(asyncio.run(run_maintenance()), ensure_ascii=False, indent=2))
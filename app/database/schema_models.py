@@ -1,10 +1,19 @@
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 
 
 class AskRequest(BaseModel):
     question: str
     top_k: int = 5
+    # Дедлайн запроса в миллисекундах (по умолчанию — ASK_DEFAULT_TIMEOUT_MS)
+    timeout_ms: Optional[int] = Field(default=None, gt=0)
+    # interactive — запросы из UI, batch — пакетные задания (обслуживаются после interactive)
+    priority: Literal["interactive", "batch"] = "interactive"
+    # auto — генерация LLM, при перегрузке очереди — экстрактивный ответ;
+    # extractive — всегда без LLM (кэш генеративных ответов не используется)
+    answer_mode: Literal["auto", "generative", "extractive"] = "auto"
+    # Группы документов для поиска (шарды индекса); не задано — поиск по всем группам
+    scope: Optional[List[str]] = Field(default=None, min_length=1)
 
 
 class AskResponse(BaseModel):
@@ -12,3 +21,5 @@ class AskResponse(BaseModel):
     tokens: int
     latency_ms: float
     sources: List[str]
+    # extractive — ответ собран из предложений документов без LLM (перегрузка или запрос клиента)
+    answer_mode: Literal["generative", "extractive"] = "generative"
@@ -1,13 +1,45 @@
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from app.database.models import Base
 
 from app.core.config import settings
 
 
-engine = create_async_engine(settings.DATABASE_URL, echo=False, future=True)
+def engine_options(database_url: str) -> dict:
+    """
+    Параметры пула и драйвера для async-движка.
+    Размер пула и кэш подготовленных выражений asyncpg настраиваются через Settings.
+    """
+    options = {"echo": False, "future": True}
+    url = make_url(database_url)
+    if url.get_backend_name() != "postgresql":
+        return options
+
+    options.update(
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+    if url.get_driver_name() == "asyncpg":
+        # Кэш подготовленных выражений на каждое соединение (SQLAlchemy-адаптер asyncpg)
+        options["connect_args"] = {
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        }
+    return options
+
+
+engine = create_async_engine(settings.DATABASE_URL, **engine_options(settings.DATABASE_URL))
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
 async def init_db():
     async with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            # query_history партиционирована по месяцам — создаём её до create_all
+            from app.database.partitions import ensure_parent_table, ensure_partitions
+
+            if await ensure_parent_table(conn):
+                await ensure_partitions(conn)
         await conn.run_sync(Base.metadata.create_all)
@@ -0,0 +1,239 @@
+"""
+Пакетная загрузка директории документов без HTTP и без LLM.
+
+    python -m app.ingest files/
+    python -m app.ingest files/ --workers 8
+    python -m app.ingest files/ --restart   # игнорировать сохранённый прогресс
+    python -m app.ingest files/hr --group hr  # документы группы hr (шард индекса при CHROMA_SHARDING=group)
+
+- файлы (PDF/TXT/MD, рекурсивно) разбираются и режутся на чанки в пуле процессов;
+- новые документы и их чанки пишутся в PostgreSQL пакетами (INSERT ... RETURNING на пачку
+  INGEST_EMBED_BATCH чанков); изменённые — той же upsert_document, что и при загрузке через API
+  (неизменённые файлы пропускаются, у изменённых заменяются только новые чанки);
+- новые чанки векторизуются крупными пачками (INGEST_EMBED_BATCH) и пишутся в шарды индекса Chroma;
+- прогресс сохраняется в <директория>/INGEST_CHECKPOINT_FILE после каждой пачки,
+  прерванный запуск продолжается с места остановки (прогресс ведётся отдельно для каждой группы).
+
+Имя документа — путь файла относительно загружаемой директории.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.database.crud import get_document_by_filename, get_document_chunks, insert_documents, upsert_document
+from app.database.models import DEFAULT_DOCUMENT_GROUP
+from app.database.session import init_db
+from app.services.cache import cache
+from app.services.embeddings import embedding_service
+from app.services.other_functions import SUPPORTED_EXTENSIONS, content_hash, extract_text, split_text_into_chunks
+from app.services.vector_store import GROUP_NAME_RE, ShardedIndex, connect_chroma
+
+
+logger = get_logger(__name__)
+
+
+class IngestCheckpoint:
+    """
+    Прогресс загрузки группы документов: {относительный путь: {size, mtime_ns, content_hash}}.
+    В файле хранятся все группы: {"groups": {группа: {...}}}, загрузка той же директории
+    в другую группу начинается с нуля.
+    Файл попадает сюда только после того, как его чанки записаны и в БД, и в индекс.
+    """
+
+    def __init__(self, path: Path, restart: bool = False, group_name: str = DEFAULT_DOCUMENT_GROUP):
+        self.path = path
+        self.group_name = group_name
+        self.groups = {}
+        if path.exists():
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            # Прежний формат {"files": {...}} — прогресс группы по умолчанию
+            self.groups = data.get("groups") or {DEFAULT_DOCUMENT_GROUP: data.get("files", {})}
+        if restart:
+            self.groups.pop(group_name, None)
+        self.files = self.groups.setdefault(group_name, {})
+
+    @staticmethod
+    def _signature(stat: os.stat_result) -> dict:
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def is_done(self, name: str, stat: os.stat_result) -> bool:
+        entry = self.files.get(name)
+        return entry is not None and {k: entry[k] for k in ("size", "mtime_ns")} == self._signature(stat)
+
+    def mark_done(self, name: str, stat: os.stat_result, file_hash: str):
+        self.files[name] = {**self._signature(stat), "content_hash": file_hash}
+
+    def save(self):
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"groups": self.groups}, f, ensure_ascii=False)
+        tmp_path.replace(self.path)
+
+
+def discover_files(root: Path) -> list[Path]:
+    """Документы поддерживаемых форматов в директории (рекурсивно), в стабильном порядке"""
+    return sorted(
+        path for path in root.rglob("*")
+        if path.is_file() and path.suffix.lower() in SUPPORTED_EXTENSIONS
+    )
+
+
+def parse_file(path: str) -> dict:
+    """Чтение, хэш и разбиение на чанки одного файла (выполняется в процессе пула)"""
+    content = Path(path).read_bytes()
+    if not content:
+        raise ValueError("Файл пустой")
+    return {
+        "file_hash": content_hash(content),
+        "chunks": split_text_into_chunks(extract_text(path, content)),
+    }
+
+
+async def ingest_directory(root: Path, index: ShardedIndex, checkpoint: IngestCheckpoint, workers: int,
+                           embed_batch: int = None, embedder=None, group_name: str = DEFAULT_DOCUMENT_GROUP) -> dict:
+    """
+    Загружает все документы директории в группу group_name. Возвращает отчёт с количеством
+    файлов/чанков и пропускной способностью (файлов/с, чанков/с).
+    """
+    embed_batch = embed_batch or settings.INGEST_EMBED_BATCH
+    started = time.perf_counter()
+    report = {
+        "files": 0, "skipped": 0, "created": 0, "updated": 0, "unchanged": 0, "failed": 0,
+        "chunks_added": 0, "chunks_removed": 0,
+    }
+
+    todo = []
+    for path in discover_files(root):
+        name = path.relative_to(root).as_posix()
+        stat = path.stat()
+        if checkpoint.is_done(name, stat):
+            report["skipped"] += 1
+        else:
+            todo.append((path, name, stat))
+    report["files"] = len(todo) + report["skipped"]
+    logger.info("Загрузка %s: %d файлов, %d уже загружено ранее", root, report["files"], report["skipped"])
+
+    pending_chunks, pending_files = [], []
+    pending_new = []  # новые документы: (имя, sha256, чанки) — в БД пишутся пачкой в flush
+
+    async def flush():
+        if pending_new:
+            for created in await insert_documents(pending_new, group_name):
+                pending_chunks.extend(created["added"])
+            report["created"] += len(pending_new)
+            pending_new.clear()
+        if pending_chunks:
+            await index.add(pending_chunks, embedder)
+            report["chunks_added"] += len(pending_chunks)
+        for name, stat, file_hash in pending_files:
+            checkpoint.mark_done(name, stat, file_hash)
+        checkpoint.save()
+        logger.info("Загрузка: обработано %d/%d файлов, %d чанков в индексе",
+                    len(checkpoint.files), report["files"], report["chunks_added"])
+        pending_chunks.clear()
+        pending_files.clear()
+
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Скользящее окно: пул всегда занят, но в памяти не больше workers * 2 разобранных файлов
+        items = iter(todo)
+        in_flight = deque()
+
+        def submit_next():
+            item = next(items, None)
+            if item is not None:
+                in_flight.append((item, loop.run_in_executor(pool, parse_file, str(item[0]))))
+
+        for _ in range(workers * 2):
+            submit_next()
+
+        while in_flight:
+            (path, name, stat), future = in_flight.popleft()
+            submit_next()
+            try:
+                parsed = await future
+            except Exception as e:
+                logger.error(f"Ошибка при разборе {name}: {e}")
+                report["failed"] += 1
+                continue
+
+            existing = await get_document_by_filename(name, group_name)
+            if existing and existing.content_hash == parsed["file_hash"]:
+                # Документ уже в БД (например, запуск прервался до записи в индекс) —
+                # векторизуем только те чанки, которых нет в Chroma
+                chunks = await get_document_chunks(existing.id)
+                missing = await index.missing_chunk_ids(chunks)
+                pending_chunks.extend(c for c in chunks if c.id in missing)
+                report["unchanged"] += 1
+            elif existing is None:
+                pending_new.append((name, parsed["file_hash"], parsed["chunks"]))
+            else:
+                changes = await upsert_document(name, parsed["file_hash"], parsed["chunks"], existing.id,
+                                                group_name=group_name)
+                if changes["removed"]:
+                    await index.remove(changes["removed"])
+                if changes["moved"]:
+                    await index.update_metadata(changes["moved"])
+                pending_chunks.extend(changes["added"])
+                report[changes["change"]] += 1
+                report["chunks_removed"] += len(changes["removed"])
+
+            pending_files.append((name, stat, parsed["file_hash"]))
+            if len(pending_chunks) + sum(len(chunks) for _, _, chunks in pending_new) >= embed_batch:
+                await flush()
+
+    await flush()
+
+    elapsed = time.perf_counter() - started
+    processed = report["files"] - report["skipped"]
+    report.update({
+        "elapsed_sec": round(elapsed, 3),
+        "files_per_sec": round(processed / elapsed, 2) if elapsed else 0.0,
+        "chunks_per_sec": round(report["chunks_added"] / elapsed, 2) if elapsed else 0.0,
+    })
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Пакетная загрузка директории документов")
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--workers", type=int, default=settings.INGEST_WORKERS or os.cpu_count())
+    parser.add_argument("--checkpoint", type=Path, default=None)
+    parser.add_argument("--restart", action="store_true", help="начать заново, игнорируя прогресс")
+    parser.add_argument("--group", default=DEFAULT_DOCUMENT_GROUP, help="группа документов")
+    args = parser.parse_args()
+    if not GROUP_NAME_RE.match(args.group):
+        parser.error(f"Некорректное имя группы: {args.group}")
+
+    checkpoint = IngestCheckpoint(args.checkpoint or args.path / settings.INGEST_CHECKPOINT_FILE, args.restart,
+                                  args.group)
+
+    await init_db()
+    embedding_service.load()
+    index = ShardedIndex(connect_chroma())
+    await cache.init_redis()
+
+    report = await ingest_directory(args.path, index, checkpoint, args.workers, group_name=args.group)
+    if report["chunks_added"] or report["chunks_removed"] or report["updated"]:
+        # Корпус изменился — кэш ответов и оценок старой версии больше не используется
+        await cache.bump_corpus_version()
+
+    logger.info(
+        "Загрузка завершена: %d файлов (%.2f файлов/с), %d чанков (%.2f чанков/с) за %.1f с",
+        report["files"] - report["skipped"], report["files_per_sec"],
+        report["chunks_added"], report["chunks_per_sec"], report["elapsed_sec"]
+    )
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
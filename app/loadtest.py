@@ -0,0 +1,268 @@
+"""
+Нагрузочный тест HTTP API (/api/ask и /api/documents).
+
+Сервис для теста удобно запускать с поддельными моделями — тогда не нужны
+ни GPU, ни файл модели, ни сервер Chroma:
+
+    FAKE_MODELS=true CHROMA_IN_MEMORY=true python -m app.main
+
+    python -m app.loadtest --url http://localhost:8000 --duration 60 --concurrency 32
+    python -m app.loadtest --rate 20 --mix ask=0.9,upload=0.1 --cache-hit-ratio 0.3 -o report.json
+
+--rate 0 — замкнутый цикл (concurrency клиентов шлют запросы друг за другом);
+--rate N — открытый поток: запросы приходят по Пуассону с интенсивностью N/с,
+задержка считается от запланированного момента отправки (ожидание свободного
+клиента тоже входит в задержку).
+
+Результат — JSON: пропускная способность, перцентили задержки и доля ошибок
+в целом и по типам запросов.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import httpx
+
+from app.core.config import irkutsk_tz
+
+
+DEFAULT_QUESTIONS = [
+    "Как оформить отпуск?",
+    "Сколько дней отпуска положено в год?",
+    "Как получить пароль от Wi-Fi?",
+    "Куда обращаться при поломке ноутбука?",
+    "Как оформить командировку?",
+    "Какой график работы офиса?",
+    "Как получить справку о доходах?",
+    "Кто согласует больничный?",
+    "Как заказать пропуск для гостя?",
+    "Где найти шаблоны документов?",
+]
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    """"ask=0.9,upload=0.1" -> {"ask": 0.9, "upload": 0.1}"""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("ask", "upload"):
+            raise argparse.ArgumentTypeError(f"Неизвестный тип запроса: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentiles(values: list[float]) -> dict:
+    """p50/p90/p95/p99 (nearest-rank), среднее и максимум"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    result = {f"p{p}": round(ordered[max(0, -(-p * len(ordered) // 100) - 1)], 2) for p in PERCENTILES}
+    result["mean"] = round(sum(ordered) / len(ordered), 2)
+    result["max"] = round(ordered[-1], 2)
+    return result
+
+
+class QuestionPicker:
+    """
+    Вопросы с заданной долей попаданий в кэш: с вероятностью cache_hit_ratio
+    повторяется вопрос из «горячего» набора, иначе вопрос делается уникальным
+    (другой ключ кэша — гарантированный промах).
+    """
+
+    def __init__(self, questions: list[str], cache_hit_ratio: float, rng: random.Random):
+        self.questions = questions
+        self.cache_hit_ratio = cache_hit_ratio
+        self.rng = rng
+        self._unique = 0
+
+    def next(self) -> str:
+        question = self.rng.choice(self.questions)
+        if self.rng.random() < self.cache_hit_ratio:
+            return question
+        self._unique += 1
+        return f"{question} (вариант {self._unique})"
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, mix: dict[str, float], picker: QuestionPicker,
+                 rng: random.Random, top_k: int = 5, doc_chars: int = 5000):
+        self.client = client
+        self.kinds = list(mix)
+        self.weights = list(mix.values())
+        self.picker = picker
+        self.rng = rng
+        self.top_k = top_k
+        self.doc_chars = doc_chars
+        self.results = []  # (тип, задержка мс, статус или имя исключения)
+        self._uploads = 0
+
+    def _document(self) -> tuple[str, bytes]:
+        """Синтетический TXT-документ с уникальным именем"""
+        self._uploads += 1
+        parts, size = [], 0
+        while size < self.doc_chars:
+            parts.append(self.rng.choice(self.picker.questions))
+            size += len(parts[-1]) + 1
+        text = " ".join(parts)[:self.doc_chars]
+        return f"loadtest-{self._uploads}-{self.rng.getrandbits(32):08x}.txt", text.encode("utf-8")
+
+    async def request(self, kind: str, scheduled: Optional[float] = None):
+        started = scheduled if scheduled is not None else time.perf_counter()
+        try:
+            if kind == "ask":
+                response = await self.client.post(
+                    "/api/ask", json={"question": self.picker.next(), "top_k": self.top_k}
+                )
+            else:
+                filename, content = self._document()
+                response = await self.client.post(
+                    "/api/documents", files={"files": (filename, content, "text/plain")}
+                )
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        self.results.append((kind, (time.perf_counter() - started) * 1000, status))
+
+    def _kind(self) -> str:
+        return self.rng.choices(self.kinds, weights=self.weights)[0]
+
+    async def run_closed(self, concurrency: int, duration: float, max_requests: Optional[int]):
+        """Замкнутый цикл: concurrency клиентов, каждый шлёт следующий запрос после ответа"""
+        deadline = time.perf_counter() + duration
+        sent = 0
+
+        async def worker():
+            nonlocal sent
+            while time.perf_counter() < deadline and (max_requests is None or sent < max_requests):
+                sent += 1
+                await self.request(self._kind())
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    async def run_open(self, rate: float, concurrency: int, duration: float, max_requests: Optional[int]):
+        """Открытый поток с интенсивностью rate запросов/с, не больше concurrency одновременно"""
+        semaphore = asyncio.Semaphore(concurrency)
+        deadline = time.perf_counter() + duration
+        tasks = []
+
+        async def fire(kind: str, scheduled: float):
+            async with semaphore:
+                await self.request(kind, scheduled)
+
+        next_at = time.perf_counter()
+        while next_at < deadline and (max_requests is None or len(tasks) < max_requests):
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            tasks.append(asyncio.create_task(fire(self._kind(), next_at)))
+            next_at += self.rng.expovariate(rate)
+        await asyncio.gather(*tasks)
+
+
+def build_report(results: list[tuple], elapsed: float, config: dict) -> dict:
+    """Сводка по результатам: throughput, перцентили задержки, доля ошибок (в целом и по типам)"""
+
+    def summarize(items: list[tuple]) -> dict:
+        errors = sum(1 for _, _, status in items if not (isinstance(status, int) and status < 400))
+        return {
+            "requests": len(items),
+            "throughput_rps": round(len(items) / elapsed, 2) if elapsed else 0.0,
+            "errors": errors,
+            "error_rate": round(errors / len(items), 4) if items else 0.0,
+            "latency_ms": percentiles([latency for _, latency, _ in items]),
+        }
+
+    by_kind = defaultdict(list)
+    for item in results:
+        by_kind[item[0]].append(item)
+
+    return {
+        "config": config,
+        "elapsed_sec": round(elapsed, 3),
+        **summarize(results),
+        "status_codes": dict(Counter(str(status) for _, _, status in results)),
+        "by_type": {kind: summarize(items) for kind, items in sorted(by_kind.items())},
+    }
+
+
+async def run_load_test(client: httpx.AsyncClient, *, mix: dict[str, float], concurrency: int, rate: float,
+                        duration: float, max_requests: Optional[int] = None, questions: list[str] = None,
+                        cache_hit_ratio: float = 0.5, warmup: bool = True, top_k: int = 5,
+                        seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    questions = questions or DEFAULT_QUESTIONS
+    picker = QuestionPicker(questions, cache_hit_ratio, rng)
+    test = LoadTest(client, mix, picker, rng, top_k=top_k)
+    started_at = datetime.now(irkutsk_tz).isoformat()
+    config = {
+        "mix": mix, "concurrency": concurrency, "rate": rate, "duration_sec": duration,
+        "max_requests": max_requests, "questions": len(questions), "cache_hit_ratio": cache_hit_ratio,
+        "top_k": top_k, "seed": seed,
+    }
+
+    if warmup and cache_hit_ratio > 0 and "ask" in mix:
+        # «Горячие» вопросы задаём заранее, чтобы повторы действительно попадали в кэш
+        await asyncio.gather(*(
+            client.post("/api/ask", json={"question": question, "top_k": top_k}) for question in questions
+        ), return_exceptions=True)
+
+    started = time.perf_counter()
+    if rate > 0:
+        await test.run_open(rate, concurrency, duration, max_requests)
+    else:
+        await test.run_closed(concurrency, duration, max_requests)
+    report = {"started_at": started_at, **build_report(test.results, time.perf_counter() - started, config)}
+
+    try:
+        # Серверные счётчики (очередь LLM, решения ранжирования) — для сопоставления
+        report["server_metrics"] = (await client.get("/api/metrics")).json()
+    except (httpx.HTTPError, ValueError):
+        pass
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест Askio API")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--mix", type=parse_mix, default={"ask": 1.0}, help="например ask=0.9,upload=0.1")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=0.0, help="запросов/с (0 — замкнутый цикл)")
+    parser.add_argument("--duration", type=float, default=30.0, help="длительность, с")
+    parser.add_argument("--requests", type=int, default=None, help="ограничение числа запросов")
+    parser.add_argument("--questions", type=Path, default=None, help="файл с вопросами, по одному в строке")
+    parser.add_argument("--cache-hit-ratio", type=float, default=0.5)
+    parser.add_argument("--no-warmup", action="store_true")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=120.0, help="таймаут HTTP-запроса, с")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", type=Path, default=None)
+    args = parser.parse_args()
+
+    questions = None
+    if args.questions:
+        questions = [line.strip() for line in args.questions.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        report = await run_load_test(
+            client, mix=args.mix, concurrency=args.concurrency, rate=args.rate, duration=args.duration,
+            max_requests=args.requests, questions=questions, cache_hit_ratio=args.cache_hit_ratio,
+            warmup=not args.no_warmup, top_k=args.top_k, seed=args.seed,
+        )
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.write_text(output, encoding="utf-8")
+    print(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+
+from contextlib import asynccontextmanager
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.metrics import metrics
+
+
+logger = get_logger(__name__)
+
+# Классы приоритета: меньше — раньше
+PRIORITIES = {
+    "interactive": 0,  # запросы из UI
+    "batch": 1,        # пакетные задания
+    "background": 2,   # фоновые задачи (прогрев кэша и т.п.)
+}
+
+
+class QueueFullError(Exception):
+    """Очередь на LLM заполнена — запрос не принят"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Очередь заполнена, повторите через {retry_after} с")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Контроль допуска к работе с LLM: не более max_concurrent одновременных задач,
+    ограниченная очередь ожидания с приоритетами.
+    Ожидающий запрос можно отменить (дедлайн, отключение клиента) — он просто уходит из очереди.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._active = 0
+        self._waiters = []  # heap: (приоритет, порядковый номер, future)
+        self._seq = itertools.count()
+        # Скользящее среднее времени обработки (для оценки Retry-After)
+        self._avg_service_time = 1.0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    def retry_after(self) -> int:
+        """Оценка (в секундах), когда в очереди освободится место"""
+        wait = (self.queue_depth + 1) * self._avg_service_time / self.max_concurrent
+        return max(1, math.ceil(wait))
+
+    def estimated_wait(self) -> float:
+        """Оценка ожидания слота для нового запроса (в секундах)"""
+        if self._active < self.max_concurrent and not self.queue_depth:
+            return 0.0
+        return (self.queue_depth + 1) * self._avg_service_time / self.max_concurrent
+
+    def should_degrade(self, latency_budget_ms: float = None) -> bool:
+        """
+        Перегрузка: очередь не короче DEGRADE_QUEUE_DEPTH или ожидание слота
+        не укладывается в бюджет задержки (меньшее из DEGRADE_LATENCY_BUDGET_MS и latency_budget_ms).
+        """
+        if not settings.DEGRADE_ENABLED:
+            return False
+        budget_ms = settings.DEGRADE_LATENCY_BUDGET_MS
+        if latency_budget_ms is not None:
+            budget_ms = min(budget_ms, latency_budget_ms)
+        return self.queue_depth >= settings.DEGRADE_QUEUE_DEPTH or self.estimated_wait() * 1000 > budget_ms
+
+    @asynccontextmanager
+    async def slot(self, priority: str = "interactive"):
+        """Занять слот на время работы с LLM"""
+        queued_at = time.monotonic()
+        await self._acquire(priority)
+        started = time.monotonic()
+        metrics.observe("admission_queue_wait_ms", (started - queued_at) * 1000)
+        try:
+            yield
+        finally:
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * (time.monotonic() - started)
+            self._release()
+
+    async def _acquire(self, priority: str):
+        if self._active < self.max_concurrent and not self.queue_depth:
+            self._active += 1
+            return
+
+        if self.queue_depth >= self.max_queue:
+            metrics.inc("admission_rejected")
+            raise QueueFullError(self.retry_after())
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITIES.get(priority, PRIORITIES["batch"]), next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # Слот уже был передан, но ожидающий отменён — отдаём слот следующему
+            if fut.done() and not fut.cancelled():
+                self._release()
+            metrics.inc("admission_cancelled")
+            raise
+
+    def _release(self):
+        # Слот переходит напрямую следующему ожидающему с наивысшим приоритетом
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._active -= 1
+
+
+# Глобальный контроллер допуска
+admission = AdmissionController(settings.ADMISSION_MAX_CONCURRENT, settings.ADMISSION_MAX_QUEUE)
@@ -1,16 +1,26 @@
 import json
+import logging
 import redis.asyncio as redis
 import hashlib
 
-from typing import Optional
+from typing import Dict, List, Optional
 
 from app.core.config import settings
-from app.core.logger import logger
+from app.core.logger import get_logger
+from app.services.other_functions import normalize_question
+
+
+logger = get_logger(__name__)
 
 
 class RedisCache:
+    CORPUS_VERSION_KEY = "rag_corpus_version"
+
     def __init__(self):
         self.redis_client: Optional[redis.Redis] = None
+        # Версия корпуса: меняется при переиндексации и входит в ключи ответов и оценок релевантности.
+        # Перечитывается из Redis при каждом поиске ответа в кэше
+        self.corpus_version: int = 0
 
     async def init_redis(self):
         """Инициализация Redis подключения"""
@@ -21,6 +31,7 @@ class RedisCache:
                 decode_responses=True
             )
             await self.redis_client.ping()
+            self.corpus_version = int(await self.redis_client.get(self.CORPUS_VERSION_KEY) or 0)
             logger.info("Redis подключен успешно")
             return True
         except Exception as e:
@@ -28,30 +39,48 @@ class RedisCache:
             self.redis_client = None
             return False
 
-    def _generate_cache_key(self, question: str, top_k: int) -> str:
-        """Генерация ключа кэша на основе вопроса и параметров"""
-        content = f"{question}:{top_k}"
-        return f"rag_cache:{hashlib.md5(content.encode()).hexdigest()}"
-
-    async def get_cached_answer(self, question: str, top_k: int) -> Optional[dict]:
+    def _generate_cache_key(self, question: str, top_k: int, scope: Optional[List[str]] = None) -> str:
+        """
+        Генерация ключа кэша на основе нормализованного вопроса, параметров (top_k, группы поиска)
+        и версии корпуса (после переиндексации старые ответы не используются)
+        """
+        content = f"{normalize_question(question)}:{top_k}"
+        if scope:
+            content += ":" + ",".join(sorted(set(scope)))
+        return f"rag_cache:{self.corpus_version}:{hashlib.md5(content.encode()).hexdigest()}"
+
+    async def get_cached_answer(self, question: str, top_k: int, scope: Optional[List[str]] = None) -> Optional[dict]:
         """Получить ответ из кэша"""
         if not self.redis_client:
             logger.warning("Redis клиент не инициализирован")
             return None
 
         try:
-            cache_key = self._generate_cache_key(question, top_k)
-            logger.info(f"Ищем кэш по ключу: {cache_key}")
-
-            cached_data = await self.redis_client.get(cache_key)
+            cache_key = self._generate_cache_key(question, top_k, scope)
+            logger.debug("Ищем кэш по ключу: %s", cache_key)
+
+            # Версию корпуса читаем вместе с ответом (один запрос к Redis): её повышают
+            # и другие процессы (app.ingest, app.snapshot, app.shards)
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.get(self.CORPUS_VERSION_KEY)
+                pipe.get(cache_key)
+                version, cached_data = await pipe.execute()
+
+            version = int(version or 0)
+            if version != self.corpus_version:
+                logger.info("Версия корпуса изменилась: %d -> %d", self.corpus_version, version)
+                self.corpus_version = version
+                cache_key = self._generate_cache_key(question, top_k, scope)
+                cached_data = await self.redis_client.get(cache_key)
 
             if cached_data:
-                logger.info(f"✅ Найден кэш для вопроса: '{question[:30]}...'")
+                logger.debug("✅ Найден кэш для вопроса: '%.30s...'", question)
                 parsed_data = json.loads(cached_data)
-                logger.info(f"Данные кэша: {list(parsed_data.keys())}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Данные кэша: %s", list(parsed_data.keys()))
                 return parsed_data
             else:
-                logger.info(f"❌ Кэш НЕ найден для вопроса: '{question[:30]}...'")
+                logger.debug("❌ Кэш НЕ найден для вопроса: '%.30s...'", question)
 
         except json.JSONDecodeError as e:
             logger.error(f"Ошибка парсинга JSON из Redis: {e}")
@@ -60,14 +89,14 @@ class RedisCache:
 
         return None
 
-    async def set_cached_answer(self, question: str, top_k: int, data: dict):
+    async def set_cached_answer(self, question: str, top_k: int, data: dict, scope: Optional[List[str]] = None):
         """Сохранить ответ в кэш"""
         if not self.redis_client:
             logger.warning("Redis клиент не инициализирован - пропускаем кэширование")
             return
 
         try:
-            cache_key = self._generate_cache_key(question, top_k)
+            cache_key = self._generate_cache_key(question, top_k, scope)
 
             cache_data = {
                 "question": question,
@@ -75,9 +104,12 @@ class RedisCache:
                 **data
             }
 
-            logger.info(f"🔄 Сохраняем в кэш ключ: {cache_key}")
-            logger.info(
-                f"Данные для сохранения: { {k: str(v)[:100] + '...' if isinstance(v, str) and len(v) > 100 else v for k, v in cache_data.items()} }")
+            logger.debug("🔄 Сохраняем в кэш ключ: %s", cache_key)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Данные для сохранения: %s",
+                    {k: str(v)[:100] + '...' if isinstance(v, str) and len(v) > 100 else v for k, v in cache_data.items()}
+                )
 
             result = await self.redis_client.setex(
                 cache_key,
@@ -86,7 +118,7 @@ class RedisCache:
             )
 
             if result:
-                logger.info(f"✅ Успешно сохранено в кэш для: '{question[:30]}...'")
+                logger.debug("✅ Успешно сохранено в кэш для: '%.30s...'", question)
             else:
                 logger.error("❌ Ошибка: Redis не подтвердил запись")
 
@@ -94,5 +126,57 @@ class RedisCache:
             logger.error(f"❌ Ошибка записи в Redis: {e}")
 
 
+    async def bump_corpus_version(self) -> int:
+        """Увеличить версию корпуса (после индексации): старые оценки релевантности перестают использоваться"""
+        if not self.redis_client:
+            self.corpus_version += 1
+            return self.corpus_version
+
+        try:
+            self.corpus_version = await self.redis_client.incr(self.CORPUS_VERSION_KEY)
+        except Exception as e:
+            logger.error(f"Ошибка обновления версии корпуса в Redis: {e}")
+            self.corpus_version += 1
+        return self.corpus_version
+
+    def _generate_rerank_key(self, question_hash: str, chunk_id: int) -> str:
+        """Ключ оценки релевантности: нормализованный вопрос + чанк + версия корпуса"""
+        return f"rerank_cache:{self.corpus_version}:{question_hash}:{chunk_id}"
+
+    @staticmethod
+    def _question_hash(question: str) -> str:
+        return hashlib.md5(normalize_question(question).encode()).hexdigest()
+
+    async def get_rerank_scores(self, question: str, chunk_ids: List[int]) -> Dict[int, float]:
+        """Получить сохранённые оценки релевантности для пар (вопрос, чанк)"""
+        if not self.redis_client or not chunk_ids:
+            return {}
+
+        try:
+            question_hash = self._question_hash(question)
+            keys = [self._generate_rerank_key(question_hash, cid) for cid in chunk_ids]
+            values = await self.redis_client.mget(keys)
+            scores = {cid: float(v) for cid, v in zip(chunk_ids, values) if v is not None}
+            logger.debug("Оценки релевантности из кэша: %d из %d", len(scores), len(chunk_ids))
+            return scores
+        except Exception as e:
+            logger.error(f"Ошибка чтения оценок релевантности из Redis: {e}")
+            return {}
+
+    async def set_rerank_scores(self, question: str, scores: Dict[int, float]):
+        """Сохранить оценки релевантности (отдельный TTL)"""
+        if not self.redis_client or not scores:
+            return
+
+        try:
+            question_hash = self._question_hash(question)
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for cid, score in scores.items():
+                    pipe.setex(self._generate_rerank_key(question_hash, cid), settings.REDIS_RERANK_TTL, score)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Ошибка записи оценок релевантности в Redis: {e}")
+
+
 # Глобальный объект кэша
 cache = RedisCache()
@@ -0,0 +1,217 @@
+import asyncio
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+from app.core.config import BASE_DIR, settings
+from app.core.logger import get_logger
+from app.services.metrics import metrics
+
+
+logger = get_logger(__name__)
+
+
+class SentenceTransformerBackend:
+    """Эмбеддер на PyTorch (sentence-transformers)"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+        self.model_id = f"sentence-transformers/{model_name}"
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        return self.model.encode(texts, convert_to_numpy=True, normalize_embeddings=True).tolist()
+
+
+class OnnxBackend:
+    """
+    Тот же эмбеддер, экспортированный в ONNX и квантованный в int8 (onnxruntime).
+    В директории модели ожидаются model.onnx и tokenizer.json (см. export_onnx_model).
+    """
+
+    def __init__(self, model_dir: Path, model_name: str, max_length: int = 256):
+        import numpy as np
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.np = np
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.session = onnxruntime.InferenceSession(
+            str(model_dir / "model.onnx"),
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.model_id = f"onnx-int8/{model_name}"
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        np = self.np
+        encoded = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            inputs["token_type_ids"] = np.zeros_like(input_ids)
+
+        token_embeddings = self.session.run(None, inputs)[0]
+
+        # mean pooling по маске + L2-нормализация (как в all-MiniLM-L6-v2)
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.tolist()
+
+
+class EmbeddingService:
+    """
+    Общий сервис эмбеддингов для вопросов и индексации.
+    Вопросы, пришедшие в течение короткого окна (EMBED_BATCH_WINDOW_MS),
+    собираются в одну пачку и считаются одним вызовом модели в пуле потоков.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.executor = ThreadPoolExecutor(max_workers=settings.EMBED_THREADS, thread_name_prefix="embed")
+        self._pending = []  # [(texts, future)]
+        self._pending_size = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def model_id(self) -> str:
+        return self.backend.model_id
+
+    def load(self):
+        """Загрузка модели (при старте сервиса)"""
+        if self.backend is not None:
+            return
+
+        if settings.FAKE_MODELS:
+            from app.services.fake_models import FakeEmbeddingBackend
+
+            self.backend = FakeEmbeddingBackend(settings.FAKE_EMBED_DIM, settings.FAKE_EMBED_LATENCY_MS)
+            logger.warning("Эмбеддер: поддельный (FAKE_MODELS), только для нагрузочного тестирования")
+            return
+
+        if settings.EMBED_BACKEND == "onnx":
+            try:
+                self.backend = OnnxBackend(BASE_DIR / settings.EMBED_ONNX_PATH, settings.EMBED_MODEL_NAME)
+                logger.info("Эмбеддер: ONNX int8 (%s)", settings.EMBED_ONNX_PATH)
+                return
+            except Exception as e:
+                logger.error(f"Не удалось загрузить ONNX-эмбеддер, используем sentence-transformers: {e}")
+
+        self.backend = SentenceTransformerBackend(settings.EMBED_MODEL_NAME)
+        logger.info("Эмбеддер: sentence-transformers (%s)", settings.EMBED_MODEL_NAME)
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        """Синхронный интерфейс embedding function для Chroma"""
+        self.load()
+        return self.backend.encode(list(input))
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Эмбеддинги для небольшого числа текстов (вопросы).
+        Запросы из разных корутин объединяются в пачки.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((texts, future))
+        self._pending_size += len(texts)
+        metrics.inc("embed_requests")
+
+        if self._pending_size >= settings.EMBED_MAX_BATCH:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(settings.EMBED_BATCH_WINDOW_MS / 1000, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending = [(texts, fut) for texts, fut in self._pending if not fut.cancelled()]
+        self._pending = []
+        self._pending_size = 0
+        if pending:
+            asyncio.ensure_future(self._run_batch(pending))
+
+    async def _run_batch(self, pending: list):
+        texts = [text for batch, _ in pending for text in batch]
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            embeddings = await loop.run_in_executor(self.executor, self, texts)
+        except Exception as e:
+            for _, fut in pending:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        metrics.observe("embed_batch_size", len(texts))
+        metrics.observe("embed_batch_latency_ms", (time.perf_counter() - started) * 1000)
+
+        offset = 0
+        for batch, fut in pending:
+            if not fut.done():
+                fut.set_result(embeddings[offset:offset + len(batch)])
+            offset += len(batch)
+
+    async def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги для индексации: крупными пачками, без окна ожидания"""
+        loop = asyncio.get_running_loop()
+        embeddings = []
+        for start in range(0, len(texts), settings.EMBED_INGEST_BATCH):
+            batch = texts[start:start + settings.EMBED_INGEST_BATCH]
+            started = time.perf_counter()
+            embeddings.extend(await loop.run_in_executor(self.executor, self, batch))
+            metrics.observe("embed_ingest_batch_size", len(batch))
+            metrics.observe("embed_ingest_batch_latency_ms", (time.perf_counter() - started) * 1000)
+        return embeddings
+
+
+def export_onnx_model(output_dir: Path, model_name: str = "all-MiniLM-L6-v2"):
+    """
+    Экспорт модели sentence-transformers в ONNX с динамической int8-квантизацией.
+    Нужны torch, sentence-transformers и onnxruntime (только для экспорта).
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    model = SentenceTransformer(model_name)
+    transformer = model[0].auto_model
+    tokenizer = model.tokenizer
+
+    sample = tokenizer(["пример"], return_tensors="pt")
+    fp32_path = output_dir / "model-fp32.onnx"
+    torch.onnx.export(
+        transformer,
+        (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+        str(fp32_path),
+        input_names=["input_ids", "attention_mask", "token_type_ids"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={name: {0: "batch", 1: "sequence"} for name in
+                      ["input_ids", "attention_mask", "token_type_ids", "last_hidden_state"]},
+        opset_version=14,
+    )
+    quantize_dynamic(str(fp32_path), str(output_dir / "model.onnx"), weight_type=QuantType.QInt8)
+    fp32_path.unlink()
+    tokenizer.save_pretrained(str(output_dir))
+    logger.info("ONNX-модель сохранена: %s", output_dir)
+
+
+# Глобальный сервис эмбеддингов
+embedding_service = EmbeddingService()
+
+
+if __name__ == "__main__":
+    # python -m app.services.embeddings models/all-MiniLM-L6-v2-int8
+    import sys
+
+    export_onnx_model(BASE_DIR / (sys.argv[1] if len(sys.argv) > 1 else settings.EMBED_ONNX_PATH))
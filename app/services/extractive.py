@@ -0,0 +1,56 @@
+import math
+import re
+
+from typing import List, Tuple
+
+# Граница предложения: знак конца предложения + пробел, либо перевод строки
+SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+WORD_RE = re.compile(r"\w+")
+MIN_SENTENCE_LENGTH = 20
+
+
+def _terms(text: str) -> set:
+    """
+    Термины для сравнения: слова длиннее 2 символов, усечённые до 5 символов —
+    грубая замена стемминга (формы «отпуск», «отпуска», «отпуском» совпадают).
+    """
+    return {word[:5] for word in WORD_RE.findall(text.lower()) if len(word) > 2}
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in SENTENCE_RE.split(text) if len(s.strip()) >= MIN_SENTENCE_LENGTH]
+
+
+def extract_answer(question: str, chunks: List[str], max_sentences: int) -> List[Tuple[int, str]]:
+    """
+    Экстрактивный ответ без LLM: предложения найденных чанков с наибольшим
+    пересечением терминов с вопросом (чанки — по возрастанию расстояния).
+    Возвращает [(номер чанка, предложение)] в порядке следования в чанках.
+    Если совпадений нет — первое предложение ближайшего чанка.
+    """
+    question_terms = _terms(question)
+    candidates = []
+    seen = set()
+    for rank, text in enumerate(chunks):
+        for position, sentence in enumerate(split_sentences(text)):
+            # Соседние чанки перекрываются — одно и то же предложение берём один раз
+            if sentence in seen:
+                continue
+            seen.add(sentence)
+            terms = _terms(sentence)
+            overlap = len(question_terms & terms)
+            if not overlap:
+                continue
+            # Короткие точные предложения лучше длинных, ближайшие чанки — лучше дальних
+            score = overlap / math.sqrt(len(terms)) / (1 + 0.1 * rank)
+            candidates.append((score, rank, position, sentence))
+
+    if not candidates:
+        for rank, text in enumerate(chunks):
+            sentences = split_sentences(text)
+            if sentences:
+                return [(rank, sentences[0])]
+        return []
+
+    best = sorted(candidates, key=lambda c: c[0], reverse=True)[:max_sentences]
+    return [(rank, sentence) for _, rank, _, sentence in sorted(best, key=lambda c: (c[1], c[2]))]
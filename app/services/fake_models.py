@@ -0,0 +1,93 @@
+import hashlib
+import math
+import re
+import time
+
+from collections import Counter
+from typing import List
+
+import numpy as np
+
+
+WORD_RE = re.compile(r"\w+")
+
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:8], "little")
+
+
+class FakeLlama:
+    """
+    Детерминированная замена llama_cpp.Llama для нагрузочного тестирования (FAKE_MODELS).
+    Тот же интерфейс вызова и формат ответа; задержка = latency_ms + token_ms на каждый токен.
+    """
+
+    SCORES = ("0.0", "0.5", "0.8", "1.0")
+
+    def __init__(self, latency_ms: float, token_ms: float, answer_tokens: int):
+        self.latency_ms = latency_ms
+        self.token_ms = token_ms
+        self.answer_tokens = answer_tokens
+
+    def __call__(self, prompt: str, max_tokens: int = 16, **kwargs) -> dict:
+        seed = _seed(prompt)
+        if max_tokens <= 5:
+            # Оценка релевантности — одно число
+            text = self.SCORES[seed % len(self.SCORES)]
+            tokens = 1
+        else:
+            tokens = min(max_tokens, self.answer_tokens)
+            words = [f"слово{(seed >> (i % 48)) % 97}" for i in range(tokens)]
+            text = " ".join(words) + "."
+
+        time.sleep((self.latency_ms + tokens * self.token_ms) / 1000)
+        prompt_tokens = len(prompt) // 4
+        return {
+            "choices": [{"text": text, "index": 0, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": tokens,
+                "total_tokens": prompt_tokens + tokens,
+            },
+        }
+
+
+class FakeEmbeddingBackend:
+    """
+    Детерминированный эмбеддер (FAKE_MODELS): хэшированный мешок слов, поэтому вопрос
+    близок к чанкам со словами из него — поиск, ранжирование и генерация работают как
+    с настоящей моделью. Общая компонента (COMMON_WEIGHT) сжимает шкалу расстояний:
+    тексты без общих слов — ~1.5 (дальше RERANK_REJECT_DISTANCE), с общими — 0.5–1.3
+    (зона LLM-ранжирования), почти совпадающие — ближе RERANK_ACCEPT_DISTANCE.
+    """
+
+    COMMON_WEIGHT = 0.5
+
+    def __init__(self, dim: int, latency_ms: float):
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.model_id = f"fake-bow/{dim}"
+        common = np.random.default_rng(0).standard_normal(dim)
+        self._common = common / np.linalg.norm(common)
+
+    def _bag_of_words(self, text: str) -> np.ndarray:
+        """Слова длиннее 2 символов, усечённые до 5 (грубый стемминг), со знаковым хэшированием"""
+        counts = Counter(word[:5] for word in WORD_RE.findall(text.lower()) if len(word) > 2)
+        vector = np.zeros(self.dim)
+        for term, count in counts.items():
+            seed = _seed(term)
+            vector[seed % self.dim] += (1 if (seed >> 32) & 1 else -1) * (1 + math.log(count))
+        if not vector.any():
+            # Нет слов — случайный (но детерминированный) вектор
+            vector = np.random.default_rng(_seed(text)).standard_normal(self.dim)
+        return vector / np.linalg.norm(vector)
+
+    def _encode(self, text: str) -> np.ndarray:
+        vector = self.COMMON_WEIGHT * self._common + math.sqrt(1 - self.COMMON_WEIGHT ** 2) * self._bag_of_words(text)
+        return vector / np.linalg.norm(vector)
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency_ms / 1000)
+        if not texts:
+            return []
+        return np.stack([self._encode(text) for text in texts]).tolist()
@@ -0,0 +1,45 @@
+import threading
+
+from collections import defaultdict
+
+
+class Metrics:
+    """
+    Простые метрики процесса: счётчики и наблюдения (count/sum/min/max).
+    Отдаются через /api/metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.observations = {}
+
+    def inc(self, name: str, value: int = 1):
+        """Увеличить счётчик"""
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name: str, value: float):
+        """Записать наблюдение (размер пачки, задержка и т.д.)"""
+        with self._lock:
+            stats = self.observations.get(name)
+            if stats is None:
+                self.observations[name] = {"count": 1, "sum": value, "min": value, "max": value}
+                return
+            stats["count"] += 1
+            stats["sum"] += value
+            stats["min"] = min(stats["min"], value)
+            stats["max"] = max(stats["max"], value)
+
+    def snapshot(self) -> dict:
+        """Текущее состояние метрик"""
+        with self._lock:
+            observations = {
+                name: {**stats, "avg": stats["sum"] / stats["count"]}
+                for name, stats in self.observations.items()
+            }
+            return {"counters": dict(self.counters), "observations": observations}
+
+
+# Глобальный объект метрик
+metrics = Metrics()
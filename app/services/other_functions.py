@@ -1,3 +1,14 @@
+import hashlib
+import io
+import os
+
+from PyPDF2 import PdfReader
+
+
+# Форматы документов, которые принимает загрузка
+SUPPORTED_EXTENSIONS = (".txt", ".md", ".pdf")
+
+
 def split_text_into_chunks(text: str, chunk_size: int = 1000, overlap: int = 100):
     """
     Простая функция для разбиения текста на перекрывающиеся чанки.
@@ -10,3 +21,34 @@ def split_text_into_chunks(text: str, chunk_size: int = 1000, overlap: int = 100
         chunks.append(chunk.strip())
         start += chunk_size - overlap
     return [c for c in chunks if len(c.strip()) > 50]
+
+
+def normalize_question(question: str) -> str:
+    """
+    Нормализация вопроса для ключей кэша: регистр, лишние пробелы и
+    знаки препинания в конце не влияют на ключ.
+    """
+    normalized = " ".join(question.lower().split())
+    return normalized.rstrip("?!.,;: ")
+
+
+def content_hash(data) -> str:
+    """
+    sha256 содержимого (bytes или str) — для дедупликации файлов и чанков.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def extract_text(filename: str, content: bytes) -> str:
+    """
+    Извлечение текста из документа по расширению файла (PDF/TXT/MD).
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in (".txt", ".md"):
+        return content.decode("utf-8", errors="ignore")
+    if ext == ".pdf":
+        pdf = PdfReader(io.BytesIO(content))
+        return "\n".join(page.extract_text() or "" for page in pdf.pages)
+    raise ValueError(f"Формат {ext} не поддерживается")
@@ -0,0 +1,100 @@
+import asyncio
+
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app.core.config import irkutsk_tz, settings
+from app.core.logger import get_logger
+from app.database.crud import get_top_questions
+from app.services.admission import admission
+from app.services.cache import cache
+from app.services.metrics import metrics
+from app.services.rag import rag
+
+
+logger = get_logger(__name__)
+
+
+class PrewarmJob:
+    """
+    Прогрев кэша ответов по истории запросов (после рестарта, сброса Redis или переиндексации).
+    Берёт top-N самых частых вопросов за окно и пересчитывает ответы в фоне:
+    с приоритетом background, только когда LLM свободна, не чаще PREWARM_INTERVAL_SEC.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.state = {"status": "idle"}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, window_hours: Optional[int] = None, limit: Optional[int] = None) -> bool:
+        """Запустить прогрев в фоне. False — если он уже идёт"""
+        if self.running:
+            return False
+        self._task = asyncio.create_task(self.run(
+            window_hours or settings.PREWARM_WINDOW_HOURS,
+            limit or settings.PREWARM_TOP_N,
+        ))
+        return True
+
+    async def run(self, window_hours: int, limit: int):
+        self.state = {
+            "status": "running",
+            "window_hours": window_hours,
+            "total": 0,
+            "warmed": 0,
+            "already_cached": 0,
+            "failed": 0,
+            "started_at": datetime.now(irkutsk_tz).isoformat(),
+            "finished_at": None,
+        }
+        try:
+            since = datetime.now(irkutsk_tz) - timedelta(hours=window_hours)
+            questions = await get_top_questions(since, limit)
+            self.state["total"] = len(questions)
+            logger.info("Прогрев кэша: %d вопросов за %d ч", len(questions), window_hours)
+
+            for question, _ in questions:
+                if await cache.get_cached_answer(question, settings.PREWARM_TOP_K):
+                    self.state["already_cached"] += 1
+                    continue
+
+                await self._wait_for_idle_llm()
+                try:
+                    await rag.ask(question, settings.PREWARM_TOP_K, priority="background")
+                    self.state["warmed"] += 1
+                    metrics.inc("prewarm_answers")
+                except Exception as e:
+                    logger.error(f"Прогрев кэша: ошибка для вопроса '{question[:50]}': {e}")
+                    self.state["failed"] += 1
+
+                # Ограничение скорости: между пересчётами не меньше PREWARM_INTERVAL_SEC
+                await asyncio.sleep(settings.PREWARM_INTERVAL_SEC)
+
+            self.state["status"] = "done"
+            logger.info(
+                "Прогрев кэша завершён: прогрето %d, уже в кэше %d, ошибок %d",
+                self.state["warmed"], self.state["already_cached"], self.state["failed"]
+            )
+        except asyncio.CancelledError:
+            self.state["status"] = "cancelled"
+            raise
+        except Exception as e:
+            logger.exception(f"Прогрев кэша прерван: {e}")
+            self.state["status"] = "failed"
+            self.state["error"] = str(e)
+        finally:
+            self.state["finished_at"] = datetime.now(irkutsk_tz).isoformat()
+
+    @staticmethod
+    async def _wait_for_idle_llm():
+        """Ждём, пока живой трафик не занимает LLM"""
+        while admission.active or admission.queue_depth:
+            await asyncio.sleep(settings.PREWARM_IDLE_POLL_SEC)
+
+
+# Глобальная задача прогрева
+prewarm = PrewarmJob()
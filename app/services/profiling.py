@@ -0,0 +1,275 @@
+"""
+Профилирование отдельных запросов (по запросу администратора или по выборке).
+
+Для профилируемого запроса сохраняются в PROFILE_DIR/<id>/:
+- profile.speedscope.json — сэмплы стеков для https://www.speedscope.app;
+- profile.collapsed.txt — те же стеки в collapsed-формате (flamegraph.pl, speedscope);
+- stages.json — время по этапам запроса (кэш, эмбеддинг, Chroma, очередь LLM, ранжирование, генерация).
+
+Сэмплер снимает стеки всех потоков процесса (цикл событий и потоки с вызовами LLM/Chroma),
+поэтому при параллельной нагрузке в профиль попадают и соседние запросы; этапы в stages.json —
+только этого запроса.
+
+Без активного профиля stage() — одно чтение contextvar и общий nullcontext.
+"""
+import hmac
+import json
+import random
+import shutil
+import sys
+import threading
+import time
+import uuid
+
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from app.core.config import BASE_DIR, irkutsk_tz, settings
+from app.core.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+PROFILE_FILES = {
+    "speedscope": "profile.speedscope.json",
+    "collapsed": "profile.collapsed.txt",
+    "stages": "stages.json",
+}
+
+_current: ContextVar[Optional["RequestProfile"]] = ContextVar("request_profile", default=None)
+_NULL = nullcontext()
+# Сэмплер одновременно работает только для одного запроса
+_sampler_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    """Сэмплирующий профайлер: раз в interval секунд снимает стеки всех потоков"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = Counter()  # (поток, кадр, ..., кадр) -> число сэмплов
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def is_running(self) -> bool:
+        return not self._stop.is_set()
+
+    def _run(self):
+        names = {}
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({self._short_path(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.samples[(names.get(thread_id, str(thread_id)), *reversed(stack))] += 1
+
+    @staticmethod
+    def _short_path(filename: str) -> str:
+        try:
+            return Path(filename).relative_to(BASE_DIR).as_posix()
+        except ValueError:
+            return Path(filename).name
+
+    def collapsed(self) -> str:
+        """Collapsed-стеки: «поток;внешний;...;внутренний число_сэмплов»"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+    def speedscope(self, name: str) -> dict:
+        """Профиль в формате speedscope (sampled, вес сэмпла — интервал в мс)"""
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, count in self.samples.items():
+            sample = []
+            for frame_name in stack:
+                if frame_name not in index:
+                    index[frame_name] = len(frames)
+                    frames.append({"name": frame_name})
+                sample.append(index[frame_name])
+            samples.append(sample)
+            weights.append(count * self.interval * 1000)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+            "exporter": "askio",
+        }
+
+
+class RequestProfile:
+    """Профиль одного запроса: этапы с временем + (если свободен) сэмплер стеков"""
+
+    def __init__(self, meta: dict):
+        self.id = f"{datetime.now(irkutsk_tz):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.meta = meta
+        self.started = time.perf_counter()
+        self.finished = None
+        self.stages = []  # {"name", "start_ms", "duration_ms"}
+        self.sampler = None
+        self.token = None  # токен contextvar для сброса в finish_profile
+
+    def record(self, name: str, started: float, ended: float = None):
+        ended = time.perf_counter() if ended is None else ended
+        self.stages.append({
+            "name": name,
+            "start_ms": round((started - self.started) * 1000, 3),
+            "duration_ms": round((ended - started) * 1000, 3),
+        })
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+    def breakdown(self) -> dict:
+        """Этапы по порядку и суммарно по имени"""
+        totals = {}
+        for entry in self.stages:
+            total = totals.setdefault(entry["name"], {"count": 0, "total_ms": 0.0})
+            total["count"] += 1
+            total["total_ms"] = round(total["total_ms"] + entry["duration_ms"], 3)
+        return {
+            "id": self.id,
+            **self.meta,
+            "total_ms": round(((self.finished or time.perf_counter()) - self.started) * 1000, 3),
+            "sampled": self.sampler is not None,
+            "sample_interval_ms": settings.PROFILE_INTERVAL_MS if self.sampler else None,
+            "stages": sorted(self.stages, key=lambda entry: entry["start_ms"]),
+            "totals": totals,
+        }
+
+    def stop_sampler(self):
+        """Остановить сэмплер (join потока — блокирующий вызов, не для цикла событий)"""
+        if self.sampler is not None and self.sampler.is_running():
+            self.sampler.stop()
+            _sampler_lock.release()
+
+    def save(self, profile_dir: Path) -> Path:
+        path = profile_dir / self.id
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path / PROFILE_FILES["stages"], "w", encoding="utf-8") as f:
+            json.dump(self.breakdown(), f, ensure_ascii=False, indent=2)
+        if self.sampler is not None:
+            (path / PROFILE_FILES["collapsed"]).write_text(self.sampler.collapsed(), encoding="utf-8")
+            with open(path / PROFILE_FILES["speedscope"], "w", encoding="utf-8") as f:
+                json.dump(self.sampler.speedscope(self.id), f, ensure_ascii=False)
+        return path
+
+
+def stage(name: str):
+    """Контекст этапа запроса; без активного профиля ничего не делает"""
+    profile = _current.get()
+    return _NULL if profile is None else profile.stage(name)
+
+
+def record_stage(name: str, started: float):
+    """Записать этап, начавшийся в started (time.perf_counter()) и закончившийся сейчас"""
+    profile = _current.get()
+    if profile is not None:
+        profile.record(name, started)
+
+
+def profile_dir() -> Path:
+    return BASE_DIR / settings.PROFILE_DIR
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(settings.PROFILE_ADMIN_TOKEN) and token is not None and hmac.compare_digest(
+        token.encode(), settings.PROFILE_ADMIN_TOKEN.encode()
+    )
+
+
+def should_profile(token: Optional[str]) -> bool:
+    """Профилировать ли запрос: администраторский флаг или случайная выборка PROFILE_SAMPLE_RATE"""
+    if is_admin(token):
+        return True
+    return settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+def start_profile(meta: dict) -> RequestProfile:
+    """Начать профиль для текущего контекста (задачи, созданные дальше, его наследуют)"""
+    profile = RequestProfile(meta)
+    if _sampler_lock.acquire(blocking=False):
+        profile.sampler = SamplingProfiler(settings.PROFILE_INTERVAL_MS / 1000)
+        profile.sampler.start()
+    profile.token = _current.set(profile)
+    return profile
+
+
+def finish_profile(profile: RequestProfile):
+    """Завершить профиль (в том же контексте, где он начат); сэмплер останавливает save_profile"""
+    profile.finished = time.perf_counter()
+    _current.reset(profile.token)
+
+
+def save_profile(profile: RequestProfile) -> Path:
+    """
+    Остановить сэмплер, сохранить профиль и удалить старые сверх PROFILE_MAX_STORED
+    (блокирующая, для потока)
+    """
+    profile.stop_sampler()
+    directory = profile_dir()
+    path = profile.save(directory)
+    for old in sorted(p for p in directory.iterdir() if p.is_dir())[:-settings.PROFILE_MAX_STORED]:
+        shutil.rmtree(old, ignore_errors=True)
+    logger.info("Профиль запроса сохранён: %s", path)
+    return path
+
+
+def list_profiles() -> list[dict]:
+    """Сохранённые профили (новые первыми) с кратким итогом по этапам"""
+    directory = profile_dir()
+    if not directory.exists():
+        return []
+    profiles = []
+    for path in sorted((p for p in directory.iterdir() if p.is_dir()), reverse=True):
+        try:
+            with open(path / PROFILE_FILES["stages"], encoding="utf-8") as f:
+                stages = json.load(f)
+        except (OSError, ValueError):
+            continue
+        profiles.append({
+            "id": path.name,
+            "total_ms": stages.get("total_ms"),
+            "path": stages.get("path"),
+            "sampled": stages.get("sampled"),
+            "files": [kind for kind, name in PROFILE_FILES.items() if (path / name).exists()],
+        })
+    return profiles
+
+
+def profile_file(profile_id: str, kind: str) -> Optional[Path]:
+    """Путь к файлу профиля или None (в т.ч. для некорректного id)"""
+    name = PROFILE_FILES.get(kind)
+    if name is None or not profile_id.replace("-", "").isalnum():
+        return None
+    path = profile_dir() / profile_id / name
+    return path if path.exists() else None
@@ -1,161 +1,398 @@
+import asyncio
+import functools
+import logging
 import time
-import chromadb
 
-from chromadb.utils import embedding_functions
-from llama_cpp import Llama
-from typing import List, Tuple
-from sqlalchemy.future import select
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from llama_cpp import Llama
+except ImportError:  # в режиме FAKE_MODELS llama_cpp не нужна
+    Llama = None
+from typing import Dict, List, Optional, Tuple
 
-from app.database.models import DocumentChunk
 from app.core.config import BASE_DIR, settings
-from app.database.session import async_session
+from app.services.admission import admission
 from app.services.cache import cache
-from app.core.logger import logger
-from app.database.crud import get_sources_for_chunks
+from app.services.embeddings import embedding_service
+from app.services.extractive import extract_answer
+from app.services.metrics import metrics
+from app.services.profiling import record_stage, stage
+from app.services.vector_store import ShardedIndex, connect_chroma
+from app.services.rerank_policy import ACCEPT, REJECT, RERANK, plan_rerank
+from app.core.logger import get_logger
+from app.database.crud import get_sources_for_chunks, iter_chunks_for_index
+
+
+logger = get_logger(__name__)
 
 
 class RAGService:
     def __init__(self):
         # ---- LLaMA модель ----
-        model_path = BASE_DIR / settings.MODEL_PATH
-        if not model_path.exists():
-            raise FileNotFoundError(f"Модель не найдена: {model_path}")
-
-        logger.info(f"Загружаем модель LLaMA: {model_path}")
-
-        self.llm = Llama(
-            model_path=str(model_path),
-            n_ctx=2048,
-            n_threads=4,
-            verbose=False
-        )
-
-        # # ---- ChromaDB ----
-        # Ждем пока ChromaDB запустится
-        max_retries = 30
-        for i in range(max_retries):
-            try:
-                self.chroma_client = chromadb.HttpClient(host="chroma", port=8000)
-                # Проверяем подключение
-                self.chroma_client.heartbeat()
-                logger.info("✅ Подключение к ChromaDB установлено")
-                break
-            except Exception as e:
-                if i < max_retries - 1:
-                    logger.warning(f"⏳ ChromaDB не готов, ждем... ({i + 1}/{max_retries})")
-                    time.sleep(2)
-                else:
-                    logger.error(f"❌ Не удалось подключиться к ChromaDB: {e}")
-                    raise
-
-        # ---- Встроенный эмбеддер (SentenceTransformer от Chroma) ----
-        self.embedder = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name="all-MiniLM-L6-v2"
-        )
-        self.collection = self.chroma_client.get_or_create_collection(
-            name="document_chunks",
-            embedding_function=self.embedder
-        )
+        if settings.FAKE_MODELS:
+            from app.services.fake_models import FakeLlama
+
+            logger.warning("LLM: поддельная модель (FAKE_MODELS), только для нагрузочного тестирования")
+            self.llm = FakeLlama(
+                settings.FAKE_LLM_LATENCY_MS,
+                settings.FAKE_LLM_TOKEN_MS,
+                settings.FAKE_LLM_ANSWER_TOKENS,
+            )
+        else:
+            model_path = BASE_DIR / settings.MODEL_PATH
+            if not model_path.exists():
+                raise FileNotFoundError(f"Модель не найдена: {model_path}")
+
+            logger.info(f"Загружаем модель LLaMA: {model_path}")
+
+            self.llm = Llama(
+                model_path=str(model_path),
+                n_ctx=2048,
+                n_threads=4,
+                verbose=False
+            )
+        # Llama не потокобезопасна: все вызовы — в одном отдельном потоке
+        self._llm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm")
+
+        # ---- ChromaDB ----
+        self.chroma_client = connect_chroma()
+
+        # ---- Эмбеддер: общий сервис с микробатчингом (sentence-transformers или ONNX int8) ----
+        self.embedder = embedding_service
+        self.embedder.load()
+        # Индекс может быть разбит на шарды (CHROMA_SHARDING); коллекции известных шардов открываем сразу
+        self.index = ShardedIndex(self.chroma_client)
+        for name in self.index.shard_names():
+            self.index.collection(name)
+        # Запасная карта chunk_id -> имя файла (для чанков без filename в метаданных индекса)
+        self.chunk_sources: Dict[int, str] = {}
         logger.info("RAGService инициализирован (LLaMA + ChromaDB)")
 
     async def index_chunks(self):
         """
         Загружает все чанки из БД в Chroma (например, при первом запуске).
+        Чанки читаются из БД потоково и добавляются в индекс пачками (каждый — в свой шард).
+        Отдельный шард перестраивается через python -m app.shards rebuild.
         """
-        async with async_session() as session:
-            result = await session.execute(select(DocumentChunk))
-            chunks = result.scalars().all()
-        logger.info(f"Найдено {len(chunks)} чанков в БД для индексации")
+        total = 0
+        async for batch in iter_chunks_for_index(settings.INDEX_BATCH_SIZE):
+            # ДИАГНОСТИКА: посмотрим на первые 3 чанка
+            if total == 0 and logger.isEnabledFor(logging.DEBUG):
+                for i, chunk in enumerate(batch[:3]):
+                    logger.debug("Чанк %d: ID=%s, Документ=%s, Текст=%.100s...", i, chunk.id, chunk.document_id, chunk.text)
+
+            await self._add_to_index(batch)
+            total += len(batch)
 
-        if not chunks:
+        if not total:
             logger.warning("Нет чанков для индексации.")
             return
 
-        # ДИАГНОСТИКА: посмотрим на первые 3 чанка
-        for i, chunk in enumerate(chunks[:3]):
-            logger.info(f"Чанк {i}: ID={chunk.id}, Документ={chunk.document_id}, Текст={chunk.text[:100]}...")
+        # Новый корпус — старые оценки релевантности больше не действительны
+        await cache.bump_corpus_version()
+        logger.info("Индексация завершена: %d чанков", total)
+
+    async def _add_to_index(self, chunks):
+        """
+        Добавляет чанки в Chroma. chunks: объекты с полями id, document_id, chunk_index, text, filename, group_name.
+        """
+        logger.info("Добавляем %d чанков в Chroma...", len(chunks))
+        await self.index.add(chunks, self.embedder)
+        self.chunk_sources.update({c.id: c.filename for c in chunks})
+
+    async def apply_chunk_changes(self, added: list, moved: list, removed: List[int]):
+        """
+        Инкрементальное обновление индекса после повторной загрузки документов:
+        векторизуются только новые чанки, удалённые убираются из Chroma,
+        у перемещённых обновляются только метаданные.
+        """
+        if removed:
+            await self.index.remove(removed)
+            for cid in removed:
+                self.chunk_sources.pop(cid, None)
+        if moved:
+            await self.index.update_metadata(moved)
+        for start in range(0, len(added), settings.INDEX_BATCH_SIZE):
+            await self._add_to_index(added[start:start + settings.INDEX_BATCH_SIZE])
+
+        if added or moved or removed:
+            await cache.bump_corpus_version()
+        logger.info("Индекс обновлён: +%d, -%d, перемещено %d чанков", len(added), len(removed), len(moved))
+
+    def _sources_from_metadata(self, chunk_ids: List[int], metadatas: List[dict]) -> Dict[int, str]:
+        """
+        Карта chunk_id -> имя файла: сначала из метаданных Chroma, затем из карты в памяти.
+        """
+        chunk_map = {}
+        for cid, meta in zip(chunk_ids, metadatas):
+            filename = (meta or {}).get("filename")
+            if filename:
+                chunk_map[cid] = filename
+        for cid in chunk_ids:
+            if cid not in chunk_map and cid in self.chunk_sources:
+                chunk_map[cid] = self.chunk_sources[cid]
+        return chunk_map
+
+    async def _score_chunk(self, question: str, text: str) -> Optional[float]:
+        """
+        Оценка релевантности чанка вопросу через LLM (0..1).
+        None — если LLM упала (такую оценку не кэшируем).
+        """
+        prompt = f"""
+        Оцени, насколько следующий текст отвечает на вопрос.
+        Возьми текст и вопрос, и выдай число от 0 до 1, где:
+        
+        1.0 - текст полностью отвечает на вопрос
+        0.8 - текст частично отвечает, содержит полезную информацию
+        0.5 - текст косвенно связан с вопросом
+        0.0 - текст не связан с вопросом
+
+        Вопрос:
+        {question}
+    
+        Текст:
+        {text}
+    
+        Оценка релевантности:"""
 
-        ids = [str(c.id) for c in chunks]
-        texts = [c.text for c in chunks]
-        metadatas = [{"document_id": c.document_id, "chunk_index": c.chunk_index} for c in chunks]
-        logger.info(f"Добавляем {len(ids)} чанков в Chroma...")
+        try:
+            output = await self._call_llm(
+                prompt,
+                max_tokens=5,
+                temperature=0.0,
+                echo=False
+            )
+            score_text = output['choices'][0]['text'].strip()
+
+            try:
+                score = float(score_text)
+            except ValueError:
+                score = 0.0
+        except Exception as e:
+            logger.error(f"Ошибка оценки релевантности: {e}")
+            return None
 
-        self.collection.add(ids=ids, documents=texts, metadatas=metadatas)
-        logger.info("Индексация завершена")
+        return score
 
-    async def ask(self, question: str, top_k: int = 5, max_context_chunks: int = 3) -> Tuple[
-        str, int, float, List[str]]:
+    async def _call_llm(self, prompt: str, **kwargs) -> dict:
+        """
+        Вызов LLM в потоке LLM. Отмена (дедлайн, отключение клиента) не прерывает
+        вызов в потоке, поэтому корутина дожидается его завершения и только потом
+        пробрасывает CancelledError — слот очереди не освобождается, пока LLM занята.
+        """
+        future = asyncio.get_running_loop().run_in_executor(
+            self._llm_executor, functools.partial(self.llm, prompt, **kwargs)
+        )
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            metrics.inc("llm_cancelled_in_flight")
+            while not future.done():
+                try:
+                    await asyncio.wait({future})
+                except asyncio.CancelledError:
+                    pass  # повторная отмена — всё равно ждём поток
+            raise
+
+    async def ask(self, question: str, top_k: int = 5, max_context_chunks: int = 3,
+                  priority: str = "interactive", answer_mode: str = "auto",
+                  latency_budget_ms: Optional[float] = None,
+                  scope: Optional[List[str]] = None) -> Tuple[str, int, float, List[str], bool, str, float]:
         """
         Вопрос -> Chroma -> LLM ранжировщик -> контекст -> ответ
+        Возвращает (ответ, токены, длительность, источники, ответ_из_кэша, режим_ответа, время_генерации_мс).
+        Время генерации — длительность вызова LLM, породившего ответ (0 для ответов из кэша и без генерации).
+
+        answer_mode:
+        - generative — ранжирование и генерация через LLM;
+        - extractive — ответ из предложений найденных чанков, без LLM;
+        - auto — generative, но при перегрузке очереди LLM (или если ожидание
+          не укладывается в latency_budget_ms) interactive-запрос получает extractive.
+
+        scope — группы документов для поиска (шарды индекса); None — поиск по всем.
         """
         start_time = time.time()
 
-        # ---- Проверка кэша ----
-        cached_data = await cache.get_cached_answer(question, top_k)
-        if cached_data:
-            return (
-                cached_data["answer"],
-                cached_data["tokens"],
-                cached_data["duration"],
-                cached_data["sources"]
-            )
+        # ---- Проверка кэша и эмбеддинг вопроса — параллельно ----
+        # Эмбеддинг считается в пуле потоков, пока идёт запрос в Redis
+        embedding_task = asyncio.ensure_future(self._embed_query(question))
+        try:
+            # В кэше только генеративные ответы — явный запрос extractive его не использует
+            cached_data = None
+            if answer_mode != "extractive":
+                with stage("cache_lookup"):
+                    cached_data = await cache.get_cached_answer(question, top_k, scope)
+            if cached_data:
+                return (
+                    cached_data["answer"],
+                    cached_data["tokens"],
+                    cached_data["duration"],
+                    cached_data["sources"],
+                    True,
+                    "generative",
+                    0.0
+                )
 
-        # ---- 1. Поиск топ чанков в Chroma ----
-        logger.info(f"Ищем в Chroma: '{question}'")
-        query_result = self.collection.query(query_texts=[question], n_results=top_k)
-        retrieved_docs = query_result["documents"][0] if query_result["documents"] else []
-        chunk_ids = [int(cid) for cid in query_result['ids'][0]]
-        logger.info(f"Chroma вернул: {len(retrieved_docs)} документов, IDs: {chunk_ids}")
+            if answer_mode == "auto":
+                degrade = priority == "interactive" and admission.should_degrade(latency_budget_ms)
+                answer_mode = "extractive" if degrade else "generative"
+                if degrade:
+                    metrics.inc("ask_degraded")
+                    logger.info("Очередь LLM перегружена — экстрактивный ответ")
+
+            if answer_mode == "extractive":
+                # LLM не нужна — слот в очереди не занимаем
+                return await self._extractive_answer(question, top_k, start_time, embedding_task, scope)
+
+            # ---- Работа с LLM — только через контроль допуска (очередь с приоритетами) ----
+            queued = time.perf_counter()
+            async with admission.slot(priority):
+                record_stage("admission_wait", queued)
+                return await self._answer(question, top_k, start_time, embedding_task, scope)
+        finally:
+            if not embedding_task.done():
+                embedding_task.cancel()
+
+    async def _embed_query(self, question: str) -> List[float]:
+        """Эмбеддинг вопроса: сервис объединяет одновременные вопросы в пачки"""
+        embeddings = await self.embedder.embed([question])
+        return embeddings[0]
+
+    async def _query_index(self, question: str, top_k: int, embedding_task: asyncio.Future,
+                           scope: Optional[List[str]] = None):
+        """Поиск в Chroma (в шардах scope или во всех): (chunk_ids, тексты, метаданные, расстояния)"""
+        logger.debug("Ищем в Chroma: '%s' (scope=%s)", question, scope)
+        with stage("embed_query"):
+            query_embedding = await embedding_task
+        with stage("chroma_query"):
+            chunk_ids, retrieved_docs, metadatas, distances = await self.index.query(query_embedding, top_k, scope)
+        logger.debug("Chroma вернул: %d документов, IDs: %s", len(retrieved_docs), chunk_ids)
 
         # ДИАГНОСТИКА: что именно вернул Chroma
-        for i, (doc, cid) in enumerate(zip(retrieved_docs, chunk_ids)):
-            logger.info(f"Документ {i}: ID={cid}, Текст={doc[:100]}...")
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, (doc, cid) in enumerate(zip(retrieved_docs, chunk_ids)):
+                logger.debug("Документ %d: ID=%s, Текст=%.100s...", i, cid, doc)
+
+        return chunk_ids, retrieved_docs, metadatas, distances
+
+    async def _resolve_sources(self, used_chunk_ids: List[int], chunk_map: Dict[int, str]) -> List[str]:
+        """Имена файлов использованных чанков; чего нет в метаданных — добираем из БД"""
+        logger.debug("used_chunk_ids=%s", used_chunk_ids)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("chunk_map keys=%s", list(chunk_map.keys()))
+        missing = [cid for cid in used_chunk_ids if cid not in chunk_map]
+        if missing:
+            # Индекс построен до появления filename в метаданных — добираем из БД и запоминаем
+            with stage("sources_db"):
+                db_sources = await get_sources_for_chunks(missing)
+            self.chunk_sources.update(db_sources)
+            chunk_map.update(db_sources)
+            missing = [cid for cid in missing if cid not in chunk_map]
+        if missing:
+            logger.warning("⚠️ Пропущены chunk_id: %s", missing)
+        return list({
+            chunk_map[cid]
+            for cid in used_chunk_ids
+            if cid in chunk_map
+        })
+
+    async def _extractive_answer(self, question: str, top_k: int, start_time: float,
+                                 embedding_task: asyncio.Future,
+                                 scope: Optional[List[str]] = None) -> Tuple[str, int, float, List[str], bool, str, float]:
+        """
+        Деградированный ответ без LLM: поиск и выбор предложений найденных чанков,
+        наиболее близких к вопросу. Такой ответ не кэшируется.
+        """
+        chunk_ids, retrieved_docs, metadatas, distances = await self._query_index(
+            question, top_k, embedding_task, scope
+        )
+        if settings.RERANK_ADAPTIVE and distances:
+            # Вместо LLM-ранжирования — только отсечение заведомо далёких кандидатов
+            kept = [i for i, distance in enumerate(distances) if distance < settings.RERANK_REJECT_DISTANCE]
+            chunk_ids = [chunk_ids[i] for i in kept]
+            retrieved_docs = [retrieved_docs[i] for i in kept]
+            metadatas = [metadatas[i] for i in kept] if metadatas else []
+
+        with stage("extract"):
+            sentences = extract_answer(question, retrieved_docs, settings.EXTRACTIVE_MAX_SENTENCES)
+        if not sentences:
+            return "В базе нет релевантных документов.", 0, time.time() - start_time, [], False, "extractive", 0.0
+
+        chunk_map = self._sources_from_metadata(chunk_ids, metadatas)
+        used_chunk_ids = list(dict.fromkeys(chunk_ids[rank] for rank, _ in sentences))
+        sources = await self._resolve_sources(used_chunk_ids, chunk_map)
+
+        answer = " ".join(sentence for _, sentence in sentences)
+        metrics.inc("answer_mode_extractive")
+        return answer, 0, time.time() - start_time, sources, False, "extractive", 0.0
+
+    async def _answer(self, question: str, top_k: int, start_time: float,
+                      embedding_task: asyncio.Future, scope: Optional[List[str]] = None) -> Tuple[str, int, float, List[str], bool, str, float]:
+        """
+        Ответ без кэша: поиск, ранжирование, генерация.
+        Вызовы LLM выполняются в потоке LLM, поэтому отменённый запрос (дедлайн,
+        отключение клиента) дожидается текущего вызова и прерывается между вызовами модели.
+        """
+        # ---- 1. Поиск топ чанков в Chroma ----
+        chunk_ids, retrieved_docs, metadatas, distances = await self._query_index(
+            question, top_k, embedding_task, scope
+        )
 
         if not retrieved_docs:
-            return "В базе нет релевантных документов.", 0, 0, []
+            return "В базе нет релевантных документов.", 0, 0, [], False, "generative", 0.0
 
-        # ---- 2. Получаем объекты DocumentChunk и источники ----
-        chunks = await get_sources_for_chunks(chunk_ids)
-        chunk_map = {c.id: c for c in chunks}
+        # ---- 2. Источники из метаданных Chroma (без обращения к БД) ----
+        chunk_map = self._sources_from_metadata(chunk_ids, metadatas)
 
         # ---- 3. Ранжирование через LLM ----
+        # По расстояниям решаем, каких кандидатов вообще нужно оценивать LLM
+        if settings.RERANK_ADAPTIVE and distances:
+            decision, actions = plan_rerank(
+                distances,
+                settings.RERANK_ACCEPT_DISTANCE,
+                settings.RERANK_REJECT_DISTANCE,
+                settings.RERANK_MARGIN,
+            )
+        else:
+            decision, actions = "full", [RERANK] * len(chunk_ids)
+        metrics.inc(f"rerank_{decision}")
+        metrics.inc("rerank_candidates_skipped", sum(1 for a in actions if a != RERANK))
+        logger.debug("Решение по ранжированию: %s, действия: %s", decision, actions)
+
+        if decision == "skipped_irrelevant":
+            return "В базе нет релевантных документов.", 0, 0, [], False, "generative", 0.0
+
+        # LLM оценивает только неоднозначных кандидатов, которых нет в кэше оценок
+        rerank_ids = [cid for cid, action in zip(chunk_ids, actions) if action == RERANK]
+        with stage("rerank_cache"):
+            cached_scores = await cache.get_rerank_scores(question, rerank_ids)
+        new_scores = {}
         relevance_scores = []
-        for cid, text in zip(chunk_ids, retrieved_docs):
-            prompt = f"""
-            Оцени, насколько следующий текст отвечает на вопрос.
-            Возьми текст и вопрос, и выдай число от 0 до 1, где:
-            
-            1.0 - текст полностью отвечает на вопрос
-            0.8 - текст частично отвечает, содержит полезную информацию
-            0.5 - текст косвенно связан с вопросом
-            0.0 - текст не связан с вопросом
-
-            Вопрос:
-            {question}
-        
-            Текст:
-            {text}
-        
-            Оценка релевантности:"""
-
-            try:
-                output = self.llm(
-                    prompt,
-                    max_tokens=5,
-                    temperature=0.0,
-                    echo=False
-                )
-                score_text = output['choices'][0]['text'].strip()
-
-                try:
-                    score = float(score_text)
-                except ValueError:
+        for cid, text, action in zip(chunk_ids, retrieved_docs, actions):
+            if action == ACCEPT:
+                relevance_scores.append((cid, 1.0, text))
+                continue
+            if action == REJECT:
+                continue
+
+            score = cached_scores.get(cid)
+            if score is None:
+                with stage("rerank_llm"):
+                    score = await self._score_chunk(question, text)
+                if score is not None:
+                    new_scores[cid] = score
+                else:
                     score = 0.0
-            except Exception:
-                score = 0.0
 
             relevance_scores.append((cid, score, text))
 
+        if new_scores:
+            await cache.set_rerank_scores(question, new_scores)
+        metrics.inc("rerank_pairs_scored", len(new_scores))
+        metrics.inc("rerank_pairs_cached", len(cached_scores))
+        logger.debug("Оценки релевантности: из кэша %d, посчитано %d", len(cached_scores), len(new_scores))
+
         # ---- 4. Берём top N наиболее релевантных ----
         relevance_scores.sort(key=lambda x: x[1], reverse=True)
         # с min_score можно поиграться и настроить, чтобы получать максимально правдивые источники
@@ -163,21 +400,12 @@ class RAGService:
         top_chunks = [(cid, score, text) for cid, score, text in relevance_scores if score >= min_score]
 
         if not top_chunks:
-            return "В базе нет релевантных документов.", 0, 0, []
+            return "В базе нет релевантных документов.", 0, 0, [], False, "generative", 0.0
 
         filtered_texts = [text for cid, score, text in top_chunks]
         used_chunk_ids = [cid for cid, score, text in top_chunks]
 
-        logger.info(f"used_chunk_ids={used_chunk_ids}")
-        logger.info(f"chunk_map keys={list(chunk_map.keys())}")
-        missing = [cid for cid in used_chunk_ids if cid not in chunk_map]
-        if missing:
-            logger.warning(f"⚠️ Пропущены chunk_id: {missing}")
-        sources = list({
-            chunk_map[cid].document.filename
-            for cid in used_chunk_ids
-            if cid in chunk_map
-        })
+        sources = await self._resolve_sources(used_chunk_ids, chunk_map)
 
         # ---- 5. Формируем контекст ----
         context_text = "\n".join(filtered_texts)
@@ -195,15 +423,18 @@ class RAGService:
         """
 
         # ---- 6. Генерация ответа ----
+        generation_started = time.perf_counter()
         try:
-            output = self.llm(
-                prompt,
-                max_tokens=200,
-                temperature=0.7,
-                top_p=0.9,
-                stop=["<|eot_id|>", "<|end_of_text|>"],
-                echo=False
-            )
+            with stage("generate"):
+                output = await self._call_llm(
+                    prompt,
+                    max_tokens=200,
+                    temperature=0.7,
+                    top_p=0.9,
+                    stop=["<|eot_id|>", "<|end_of_text|>"],
+                    echo=False
+                )
+            generation_ms = (time.perf_counter() - generation_started) * 1000
             filthy_answer = output['choices'][0]['text'].strip()
             answer = filthy_answer[:filthy_answer.rfind('.') + 1]
             tokens_used = output.get('usage', {}).get('total_tokens', len(answer) // 4)
@@ -211,6 +442,7 @@ class RAGService:
             logger.error(f"Ошибка генерации: {e}")
             answer = "Произошла ошибка при генерации ответа."
             tokens_used = 0
+            generation_ms = 0.0
 
         duration = time.time() - start_time
 
@@ -221,9 +453,10 @@ class RAGService:
             "duration": duration,
             "sources": sources
         }
-        await cache.set_cached_answer(question, top_k, cache_data)
+        with stage("cache_store"):
+            await cache.set_cached_answer(question, top_k, cache_data, scope)
 
-        return answer, tokens_used, duration, sources
+        return answer, tokens_used, duration, sources, False, "generative", generation_ms
 
 
 # Глобальный экземпляр
@@ -0,0 +1,48 @@
+from typing import List, Tuple
+
+# Действия для отдельного кандидата
+ACCEPT = "accept"   # близко к вопросу — берём без LLM-оценки
+RERANK = "rerank"   # неоднозначная зона — оцениваем через LLM
+REJECT = "reject"   # далеко от вопроса — отбрасываем без LLM-оценки
+
+
+def plan_rerank(
+    distances: List[float],
+    accept_distance: float,
+    reject_distance: float,
+    margin: float,
+) -> Tuple[str, List[str]]:
+    """
+    Адаптивная политика ранжирования по расстояниям из векторного поиска.
+    Возвращает (решение, действия для каждого кандидата).
+
+    Решения:
+    - skipped_irrelevant — даже лучший кандидат дальше reject_distance;
+    - skipped_separated — лучший кандидат близко и отделён от второго на margin;
+    - skipped_banded — все кандидаты вне неоднозначной зоны;
+    - partial — LLM оценивает только часть кандидатов;
+    - full — LLM оценивает всех кандидатов.
+    """
+    if not distances:
+        return "full", []
+
+    if distances[0] >= reject_distance:
+        return "skipped_irrelevant", [REJECT] * len(distances)
+
+    if distances[0] <= accept_distance and (len(distances) == 1 or distances[1] - distances[0] >= margin):
+        return "skipped_separated", [ACCEPT] + [REJECT] * (len(distances) - 1)
+
+    actions = []
+    for distance in distances:
+        if distance <= accept_distance:
+            actions.append(ACCEPT)
+        elif distance >= reject_distance:
+            actions.append(REJECT)
+        else:
+            actions.append(RERANK)
+
+    if RERANK not in actions:
+        return "skipped_banded", actions
+    if all(action == RERANK for action in actions):
+        return "full", actions
+    return "partial", actions
@@ -0,0 +1,55 @@
+import math
+
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+# Логарифмические корзины задержек: граница корзины i — LATENCY_BIN_BASE ** (i + 1) ms (ошибка ≤ 10%)
+LATENCY_BIN_BASE = 1.1
+MAX_LATENCY_BIN = 200
+
+GRANULARITIES = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+}
+
+
+def latency_bin(latency_ms: float) -> int:
+    """Номер корзины гистограммы для задержки"""
+    if latency_ms <= 1:
+        return 0
+    return min(int(math.log(latency_ms, LATENCY_BIN_BASE)), MAX_LATENCY_BIN)
+
+
+def bin_upper_ms(bin_index: int) -> float:
+    """Верхняя граница корзины в ms"""
+    return LATENCY_BIN_BASE ** (bin_index + 1)
+
+
+def bucket_start(ts: datetime, granularity: str) -> datetime:
+    """Начало интервала (минуты/часа), в который попадает момент ts"""
+    ts = ts.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        ts = ts.replace(minute=0)
+    return ts
+
+
+def percentiles_from_histogram(histogram: Dict[int, int], quantiles: List[float]) -> Dict[str, float]:
+    """
+    Перцентили задержки по гистограмме {корзина: количество}.
+    Возвращает {"p50": ..., "p95": ...} (верхние границы корзин, ms).
+    """
+    total = sum(histogram.values())
+    result = {f"p{round(q * 100)}": None for q in quantiles}
+    if not total:
+        return result
+
+    bins = sorted(histogram.items())
+    for q in quantiles:
+        rank = q * total
+        cumulative = 0
+        for bin_index, count in bins:
+            cumulative += count
+            if cumulative >= rank:
+                result[f"p{round(q * 100)}"] = round(bin_upper_ms(bin_index), 1)
+                break
+    return result
@@ -0,0 +1,289 @@
+import asyncio
+import math
+import re
+import time
+import chromadb
+
+from collections import defaultdict
+from typing import List, Optional
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.database.models import DEFAULT_DOCUMENT_GROUP
+from app.services.embeddings import embedding_service
+from app.services.metrics import metrics
+
+
+logger = get_logger(__name__)
+
+
+def connect_chroma(max_retries: int = 30):
+    """
+    Подключение к ChromaDB (HTTP). Ждём, пока сервер запустится.
+    CHROMA_IN_MEMORY — Chroma внутри процесса (нагрузочное тестирование без сервера).
+    """
+    if settings.CHROMA_IN_MEMORY:
+        logger.warning("ChromaDB в памяти процесса (CHROMA_IN_MEMORY), индекс не сохраняется")
+        return chromadb.EphemeralClient()
+
+    for i in range(max_retries):
+        try:
+            client = chromadb.HttpClient(host=settings.CHROMA_HTTP_HOST, port=settings.CHROMA_HTTP_PORT)
+            # Проверяем подключение
+            client.heartbeat()
+            logger.info("✅ Подключение к ChromaDB установлено")
+            return client
+        except Exception as e:
+            if i < max_retries - 1:
+                logger.warning(f"⏳ ChromaDB не готов, ждем... ({i + 1}/{max_retries})")
+                time.sleep(2)
+            else:
+                logger.error(f"❌ Не удалось подключиться к ChromaDB: {e}")
+                raise
+
+
+def get_collection(client, name: str = None):
+    """Коллекция чанков; эмбеддинги всегда считает общий сервис эмбеддингов"""
+    return client.get_or_create_collection(
+        name=name or settings.CHROMA_COLLECTION,
+        embedding_function=embedding_service
+    )
+
+
+SHARD_SEPARATOR = "__"
+SHARDING_MODES = ("none", "group", "hash")
+# Имя группы входит в имя коллекции Chroma (3-63 символа: буквы, цифры, _ и -,
+# первый и последний символ — буква или цифра)
+GROUP_NAME_RE = re.compile(r"^[A-Za-z0-9](?:[A-Za-z0-9_-]{0,38}[A-Za-z0-9])?$")
+
+
+def chunk_metadata(chunk) -> dict:
+    """
+    Метаданные чанка в индексе: filename нужен, чтобы источники отдавались без запроса в БД,
+    group — для ограничения поиска группой документов (scope)
+    """
+    return {
+        "document_id": chunk.document_id,
+        "chunk_index": chunk.chunk_index,
+        "filename": chunk.filename,
+        "group": getattr(chunk, "group_name", DEFAULT_DOCUMENT_GROUP),
+    }
+
+
+async def add_chunks(collection, chunks: list, embedder=None):
+    """
+    Векторизует и добавляет чанки в коллекцию.
+    chunks: объекты с полями id, document_id, chunk_index, text, filename.
+    """
+    embedder = embedder or embedding_service
+    texts = [c.text for c in chunks]
+    embeddings = await embedder.embed_documents(texts)
+    await asyncio.to_thread(
+        collection.add,
+        ids=[str(c.id) for c in chunks],
+        embeddings=embeddings,
+        documents=texts,
+        metadatas=[chunk_metadata(c) for c in chunks]
+    )
+
+
+async def remove_chunks(collection, chunk_ids: List[int]):
+    await asyncio.to_thread(collection.delete, ids=[str(cid) for cid in chunk_ids])
+
+
+async def update_chunk_metadata(collection, chunks: list):
+    """Обновляет только метаданные (например, chunk_index у перемещённых чанков)"""
+    await asyncio.to_thread(
+        collection.update,
+        ids=[str(c.id) for c in chunks],
+        metadatas=[chunk_metadata(c) for c in chunks]
+    )
+
+
+async def missing_chunk_ids(collection, chunk_ids: List[int]) -> set:
+    """id чанков, которых ещё нет в коллекции"""
+    if not chunk_ids:
+        return set()
+    found = await asyncio.to_thread(collection.get, ids=[str(cid) for cid in chunk_ids], include=[])
+    return set(chunk_ids) - {int(cid) for cid in found["ids"]}
+
+
+def unpack_query_result(result: dict) -> tuple[list, list, list, list]:
+    """Ответ collection.query для одного вопроса: (chunk_ids, тексты, метаданные, расстояния)"""
+    documents = result["documents"][0] if result["documents"] else []
+    chunk_ids = [int(cid) for cid in result["ids"][0]]
+    metadatas = result["metadatas"][0] if result.get("metadatas") else []
+    distances = result["distances"][0] if result.get("distances") else []
+    return chunk_ids, documents, metadatas, distances
+
+
+class ShardedIndex:
+    """
+    Векторный индекс чанков, разбитый на коллекции Chroma (шарды), CHROMA_SHARDING:
+    - none — одна коллекция CHROMA_COLLECTION;
+    - group — коллекция на группу документов (<CHROMA_COLLECTION>__<группа>), scope выбирает шарды;
+    - hash — CHROMA_SHARD_COUNT коллекций по id документа (<CHROMA_COLLECTION>__h<N>),
+      scope — фильтр по метаданным group.
+    Запрос без scope идёт во все шарды параллельно, top-k сливается по расстоянию.
+    Чанки одного документа всегда в одном шарде, поэтому шард перестраивается независимо.
+    """
+
+    def __init__(self, client, base_name: str = None, sharding: str = None, shard_count: int = None):
+        self.client = client
+        self.base_name = base_name or settings.CHROMA_COLLECTION
+        self.sharding = sharding or settings.CHROMA_SHARDING
+        self.shard_count = shard_count or settings.CHROMA_SHARD_COUNT
+        if self.sharding not in SHARDING_MODES:
+            raise ValueError(f"Неизвестный режим шардирования: {self.sharding}")
+        self._collections = {}
+        self._group_shards: set = set()
+        self._group_shards_read_at = 0.0
+
+    def collection(self, name: str):
+        if name not in self._collections:
+            self._collections[name] = get_collection(self.client, name)
+            if self.sharding == "group":
+                self._group_shards.add(name)
+        return self._collections[name]
+
+    def group_shard(self, group_name: str) -> str:
+        return f"{self.base_name}{SHARD_SEPARATOR}{group_name}"
+
+    def shard_for(self, chunk) -> str:
+        """Имя шарда для чанка"""
+        if self.sharding == "group":
+            return self.group_shard(getattr(chunk, "group_name", DEFAULT_DOCUMENT_GROUP))
+        if self.sharding == "hash":
+            return f"{self.base_name}{SHARD_SEPARATOR}h{chunk.document_id % self.shard_count}"
+        return self.base_name
+
+    def shard_names(self) -> List[str]:
+        """
+        Все шарды. Для group — список коллекций из Chroma (перечитывается не чаще
+        CHROMA_SHARD_REFRESH_SEC, блокирующий HTTP-вызов) плюс созданные этим процессом.
+        """
+        if self.sharding == "none":
+            return [self.base_name]
+        if self.sharding == "hash":
+            return [f"{self.base_name}{SHARD_SEPARATOR}h{i}" for i in range(self.shard_count)]
+
+        if time.monotonic() - self._group_shards_read_at > settings.CHROMA_SHARD_REFRESH_SEC:
+            prefix = f"{self.base_name}{SHARD_SEPARATOR}"
+            self._group_shards |= {c.name for c in self.client.list_collections() if c.name.startswith(prefix)}
+            self._group_shards_read_at = time.monotonic()
+        return sorted(self._group_shards)
+
+    def is_shard(self, name: str) -> bool:
+        """Имя коллекции — шард этого индекса (для group — любой группы, в т.ч. ещё не созданный)"""
+        if self.sharding == "group":
+            prefix = f"{self.base_name}{SHARD_SEPARATOR}"
+            return name.startswith(prefix) and bool(GROUP_NAME_RE.match(name[len(prefix):]))
+        return name in self.shard_names()
+
+    def shard_filter(self, name: str) -> dict:
+        """Какие чанки из БД относятся к шарду (аргументы для crud.iter_chunks_for_index)"""
+        suffix = name[len(self.base_name) + len(SHARD_SEPARATOR):]
+        if self.sharding == "group":
+            return {"group_name": suffix}
+        if self.sharding == "hash":
+            return {"hash_shard": (int(suffix[1:]), self.shard_count)}
+        return {}
+
+    def _targets(self, scope: Optional[List[str]]) -> list[tuple[str, Optional[dict]]]:
+        """Шарды для запроса и фильтр по метаданным: [(имя шарда, where)]"""
+        names = self.shard_names()
+        if not scope:
+            return [(name, None) for name in names]
+        if self.sharding == "group":
+            # Несуществующие группы пропускаем, чтобы запрос не создавал пустые коллекции
+            return [(self.group_shard(g), None) for g in scope if self.group_shard(g) in names]
+        where = {"group": scope[0]} if len(scope) == 1 else {"$or": [{"group": g} for g in scope]}
+        return [(name, where) for name in names]
+
+    def _query_shard(self, name: str, query_embedding: List[float], top_k: int, where: Optional[dict]) -> dict:
+        kwargs = {"where": where} if where else {}
+        return self.collection(name).query(
+            query_embeddings=[query_embedding],
+            n_results=top_k,
+            include=["documents", "metadatas", "distances"],
+            **kwargs
+        )
+
+    async def query(self, query_embedding: List[float], top_k: int,
+                    scope: Optional[List[str]] = None) -> tuple[list, list, list, list]:
+        """
+        Поиск top_k ближайших чанков: (chunk_ids, тексты, метаданные, расстояния).
+        Шарды опрашиваются параллельно (HTTP-клиент Chroma синхронный — в потоках),
+        результаты сливаются по расстоянию. Ошибка одного шарда не роняет весь поиск.
+        """
+        if self.sharding == "group":
+            targets = await asyncio.to_thread(self._targets, scope)
+        else:
+            targets = self._targets(scope)
+        if not targets:
+            return [], [], [], []
+        if len(targets) == 1:
+            name, where = targets[0]
+            result = await asyncio.to_thread(self._query_shard, name, query_embedding, top_k, where)
+            return unpack_query_result(result)
+
+        results = await asyncio.gather(*(
+            asyncio.to_thread(self._query_shard, name, query_embedding, top_k, where) for name, where in targets
+        ), return_exceptions=True)
+        merged = []
+        for (name, _), result in zip(targets, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Шард {name} не ответил: {result}")
+                metrics.inc("shard_query_errors")
+                continue
+            chunk_ids, documents, metadatas, distances = unpack_query_result(result)
+            metadatas = metadatas or [None] * len(chunk_ids)
+            distances = distances or [math.inf] * len(chunk_ids)
+            merged.extend(zip(distances, chunk_ids, documents, metadatas))
+        metrics.observe("shard_fanout", len(targets))
+
+        merged.sort(key=lambda item: item[0])
+        merged = merged[:top_k]
+        return (
+            [cid for _, cid, _, _ in merged],
+            [doc for _, _, doc, _ in merged],
+            [meta for _, _, _, meta in merged],
+            [distance for distance, _, _, _ in merged],
+        )
+
+    def _by_shard(self, chunks: list) -> dict:
+        shards = defaultdict(list)
+        for chunk in chunks:
+            shards[self.shard_for(chunk)].append(chunk)
+        return shards
+
+    async def add(self, chunks: list, embedder=None):
+        for name, shard_chunks in self._by_shard(chunks).items():
+            await add_chunks(self.collection(name), shard_chunks, embedder)
+
+    async def remove(self, chunk_ids: List[int]):
+        """Удаление по id: шард чанка неизвестен — удаляем из всех (лишние id Chroma игнорирует)"""
+        names = await asyncio.to_thread(self.shard_names)
+        await asyncio.gather(*(remove_chunks(self.collection(name), chunk_ids) for name in names))
+
+    async def update_metadata(self, chunks: list):
+        for name, shard_chunks in self._by_shard(chunks).items():
+            await update_chunk_metadata(self.collection(name), shard_chunks)
+
+    async def missing_chunk_ids(self, chunks: list) -> set:
+        missing = set()
+        for name, shard_chunks in self._by_shard(chunks).items():
+            missing |= await missing_chunk_ids(self.collection(name), [c.id for c in shard_chunks])
+        return missing
+
+    def reset_shard(self, name: str):
+        """Удалить и заново создать коллекцию шарда (перед перестройкой)"""
+        try:
+            self.client.delete_collection(name)
+        except ValueError:
+            pass  # коллекции ещё нет
+        self._collections.pop(name, None)
+        return self.collection(name)
+
+    def shard_counts(self) -> dict[str, int]:
+        return {name: self.collection(name).count() for name in self.shard_names()}
@@ -0,0 +1,104 @@
+"""
+Шарды векторного индекса (CHROMA_SHARDING=group|hash): просмотр и перестройка.
+
+    python -m app.shards list
+    python -m app.shards rebuild chunks__hr     # один шард, остальные продолжают обслуживать запросы
+    python -m app.shards rebuild --all
+    python -m app.shards backfill-groups        # метаданные group для индекса, созданного до групп
+
+Шард перестраивается из БД: коллекция удаляется, чанки шарда читаются потоково
+(iter_chunks_for_index) и векторизуются заново. Пока шард перестраивается,
+поиск по нему возвращает неполный результат, по остальным шардам — как обычно.
+
+В режимах none и hash scope — фильтр по метаданным group, которых нет у чанков,
+проиндексированных до появления групп: такие чанки scope-запрос не находит.
+backfill-groups дописывает group из documents.group_name без повторной векторизации.
+Смена CHROMA_SHARDING на group требует rebuild --all.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.database.crud import get_document_groups, iter_chunks_for_index
+from app.database.session import init_db
+from app.services.cache import cache
+from app.services.embeddings import embedding_service
+from app.services.vector_store import ShardedIndex, add_chunks, connect_chroma
+
+
+logger = get_logger(__name__)
+
+
+async def rebuild_shard(index: ShardedIndex, name: str, embedder=None) -> int:
+    """Перестраивает шард из БД, возвращает число проиндексированных чанков"""
+    collection = await asyncio.to_thread(index.reset_shard, name)
+    total = 0
+    async for batch in iter_chunks_for_index(settings.INDEX_BATCH_SIZE, **index.shard_filter(name)):
+        await add_chunks(collection, batch, embedder)
+        total += len(batch)
+    logger.info("Шард %s перестроен: %d чанков", name, total)
+    return total
+
+
+async def backfill_groups(index: ShardedIndex) -> int:
+    """Дописывает метаданные group (из БД) всем чанкам индекса, возвращает число чанков"""
+    total = 0
+    async for batch in iter_chunks_for_index(settings.INDEX_BATCH_SIZE):
+        await index.update_metadata(batch)
+        total += len(batch)
+    logger.info("Метаданные group обновлены: %d чанков", total)
+    return total
+
+
+async def all_shards(index: ShardedIndex) -> list[str]:
+    """Шарды, которые должны существовать: для group — по группам документов в БД"""
+    if index.sharding == "group":
+        return [index.group_shard(group) for group in await get_document_groups()]
+    return index.shard_names()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Шарды векторного индекса")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="шарды и число чанков в них")
+    rebuild = subparsers.add_parser("rebuild", help="перестроить шард(ы) из БД")
+    rebuild.add_argument("names", nargs="*", help="имена коллекций шардов")
+    rebuild.add_argument("--all", action="store_true", help="все шарды")
+    subparsers.add_parser("backfill-groups", help="дописать метаданные group без повторной векторизации")
+    args = parser.parse_args()
+
+    index = ShardedIndex(connect_chroma())
+
+    if args.command == "list":
+        counts = await asyncio.to_thread(index.shard_counts)
+        print(json.dumps({"sharding": index.sharding, "shards": counts}, ensure_ascii=False, indent=2))
+        return
+
+    await init_db()
+    if args.command == "backfill-groups":
+        await backfill_groups(index)
+        return
+
+    names = await all_shards(index) if args.all else args.names
+    if not names:
+        parser.error("укажите имена шардов или --all")
+    unknown = [name for name in names if not index.is_shard(name)]
+    if unknown:
+        parser.error(f"не шарды индекса {index.base_name}: {', '.join(unknown)}")
+
+    embedding_service.load()
+    await cache.init_redis()
+    started = time.perf_counter()
+    total = 0
+    for name in names:
+        total += await rebuild_shard(index, name)
+    # Содержимое индекса изменилось — кэш ответов и оценок старой версии больше не используется
+    await cache.bump_corpus_version()
+    logger.info("Перестроено шардов: %d, чанков: %d за %.1f с", len(names), total, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
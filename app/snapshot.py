@@ -0,0 +1,190 @@
+"""
+Снимок векторного индекса: экспорт и загрузка без повторной векторизации.
+
+    python -m app.snapshot export snapshots/2026-10-19
+    python -m app.snapshot import snapshots/2026-10-19
+
+Состав снимка:
+- embeddings.npy — эмбеддинги float16 (np.load(..., mmap_mode="r"));
+- records.jsonl — id чанка, текст и метаданные (в том же порядке, что и эмбеддинги);
+- manifest.json — модель эмбеддера, версия корпуса, размерность, число записей, sha256 файлов.
+
+При шардированном индексе (CHROMA_SHARDING) каждый шард — отдельный снимок
+в поддиректории <path>/<имя коллекции шарда>.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from app.core.config import irkutsk_tz, settings
+from app.core.logger import get_logger
+from app.services.cache import cache
+from app.services.embeddings import embedding_service
+from app.services.vector_store import ShardedIndex, connect_chroma
+
+
+logger = get_logger(__name__)
+
+SNAPSHOT_FORMAT = 1
+EMBEDDINGS_FILE = "embeddings.npy"
+RECORDS_FILE = "records.jsonl"
+MANIFEST_FILE = "manifest.json"
+
+
+class SnapshotError(Exception):
+    """Снимок повреждён или несовместим с текущим эмбеддером"""
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def export_snapshot(collection, snapshot_dir: Path, model_id: str, corpus_version: int) -> dict:
+    """Выгружает коллекцию Chroma в снимок, пачками по SNAPSHOT_BATCH_SIZE"""
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    count = collection.count()
+    embeddings = None
+
+    with open(snapshot_dir / RECORDS_FILE, "w", encoding="utf-8") as records:
+        for offset in range(0, count, settings.SNAPSHOT_BATCH_SIZE):
+            batch = collection.get(
+                include=["embeddings", "documents", "metadatas"],
+                limit=settings.SNAPSHOT_BATCH_SIZE,
+                offset=offset,
+            )
+            vectors = np.asarray(batch["embeddings"], dtype=np.float16)
+            if embeddings is None:
+                embeddings = np.lib.format.open_memmap(
+                    snapshot_dir / EMBEDDINGS_FILE, mode="w+", dtype=np.float16, shape=(count, vectors.shape[1])
+                )
+            embeddings[offset:offset + len(vectors)] = vectors
+
+            for chunk_id, document, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+                records.write(json.dumps({"id": chunk_id, "document": document, "metadata": metadata},
+                                         ensure_ascii=False) + "\n")
+            logger.info("Снимок: выгружено %d/%d", min(offset + settings.SNAPSHOT_BATCH_SIZE, count), count)
+
+    if embeddings is None:
+        raise SnapshotError("Коллекция пуста — снимок не создан")
+    dim = embeddings.shape[1]
+    embeddings.flush()
+    del embeddings
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "collection": collection.name,
+        "collection_metadata": collection.metadata,
+        "embedder_model_id": model_id,
+        "corpus_version": corpus_version,
+        "count": count,
+        "dim": dim,
+        "dtype": "float16",
+        "created_at": datetime.now(irkutsk_tz).isoformat(),
+        "checksums": {
+            EMBEDDINGS_FILE: file_sha256(snapshot_dir / EMBEDDINGS_FILE),
+            RECORDS_FILE: file_sha256(snapshot_dir / RECORDS_FILE),
+        },
+    }
+    with open(snapshot_dir / MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def read_manifest(snapshot_dir: Path, model_id: str) -> dict:
+    """Читает манифест и проверяет контрольные суммы и модель эмбеддера"""
+    with open(snapshot_dir / MANIFEST_FILE, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"Неподдерживаемый формат снимка: {manifest.get('format')}")
+    if manifest["embedder_model_id"] != model_id:
+        raise SnapshotError(
+            f"Снимок сделан эмбеддером {manifest['embedder_model_id']}, текущий — {model_id}"
+        )
+    for filename, expected in manifest["checksums"].items():
+        actual = file_sha256(snapshot_dir / filename)
+        if actual != expected:
+            raise SnapshotError(f"Контрольная сумма {filename} не совпадает")
+    return manifest
+
+
+def import_snapshot(collection, snapshot_dir: Path, model_id: str) -> dict:
+    """Загружает снимок в коллекцию (upsert) без пересчёта эмбеддингов"""
+    manifest = read_manifest(snapshot_dir, model_id)
+    embeddings = np.load(snapshot_dir / EMBEDDINGS_FILE, mmap_mode="r")
+    if embeddings.shape != (manifest["count"], manifest["dim"]):
+        raise SnapshotError(f"Размер эмбеддингов {embeddings.shape} не совпадает с манифестом")
+
+    loaded = 0
+    with open(snapshot_dir / RECORDS_FILE, encoding="utf-8") as records:
+        while loaded < manifest["count"]:
+            batch = [json.loads(records.readline()) for _ in range(min(settings.SNAPSHOT_BATCH_SIZE,
+                                                                         manifest["count"] - loaded))]
+            collection.upsert(
+                ids=[r["id"] for r in batch],
+                embeddings=embeddings[loaded:loaded + len(batch)].astype(np.float32).tolist(),
+                documents=[r["document"] for r in batch],
+                metadatas=[r["metadata"] for r in batch],
+            )
+            loaded += len(batch)
+            logger.info("Снимок: загружено %d/%d", loaded, manifest["count"])
+    return manifest
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Экспорт/импорт снимка векторного индекса")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", type=Path)
+    args = parser.parse_args()
+
+    embedding_service.load()
+    index = ShardedIndex(connect_chroma())
+    await cache.init_redis()
+    started = time.perf_counter()
+
+    if index.sharding == "none":
+        targets = [(index.base_name, args.path)]
+    elif args.command == "export":
+        targets = [(name, args.path / name) for name in index.shard_names()]
+    else:
+        targets = [(path.name, path) for path in sorted(args.path.iterdir()) if (path / MANIFEST_FILE).exists()]
+        foreign = [name for name, _ in targets if not index.is_shard(name)]
+        if foreign:
+            raise SnapshotError(f"Снимок содержит коллекции, не являющиеся шардами индекса: {', '.join(foreign)}")
+
+    count = 0
+    for name, path in targets:
+        collection = index.collection(name)
+        if args.command == "export":
+            manifest = export_snapshot(collection, path, embedding_service.model_id, cache.corpus_version)
+        else:
+            manifest = import_snapshot(collection, path, embedding_service.model_id)
+        count += manifest["count"]
+
+    if args.command == "import":
+        # Индекс заменён — кэш ответов и оценок старой версии корпуса больше не используется
+        await cache.bump_corpus_version()
+
+    logger.info(
+        "Снимок %s: %d записей (%d коллекций) за %.1f с (%s)",
+        args.command, count, len(targets), time.perf_counter() - started, args.path
+    )
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except SnapshotError as e:
+        logger.error(f"Снимок отклонён: {e}")
+        raise SystemExit(1)
@@ -2,6 +2,9 @@ import pytest
 import asyncio
 import sys
 import os
+import uuid
+
+from unittest.mock import patch
 
 # Добавляем корневую директорию в PYTHONPATH
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -16,3 +19,90 @@ def event_loop():
     loop = asyncio.get_event_loop_policy().new_event_loop()
     yield loop
     loop.close()
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def get(self, key):
+        self.commands.append(("get", key))
+
+    def setex(self, key, ttl, value):
+        self.commands.append(("setex", key, value))
+
+    async def execute(self):
+        self.redis.round_trips += 1
+        results = []
+        for command, key, *value in self.commands:
+            if command == "get":
+                results.append(self.redis.data.get(key))
+            else:
+                self.redis.data[key] = str(value[0])
+                results.append(True)
+        return results
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeRedis:
+    """Минимальный асинхронный Redis в памяти (get/mget/setex/incr/pipeline), TTL не учитывается"""
+
+    def __init__(self):
+        self.data = {}
+        self.round_trips = 0
+
+    async def get(self, key):
+        self.round_trips += 1
+        return self.data.get(key)
+
+    async def mget(self, keys):
+        self.round_trips += 1
+        return [self.data.get(key) for key in keys]
+
+    async def setex(self, key, ttl, value):
+        self.data[key] = value
+        return True
+
+    async def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1)
+        return int(self.data[key])
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+@pytest.fixture
+def fake_redis():
+    """Глобальный кэш поверх Redis в памяти"""
+    from app.services.cache import cache
+
+    redis = FakeRedis()
+    with patch.object(cache, "redis_client", redis), patch.object(cache, "corpus_version", 0):
+        yield redis
+
+
+@pytest.fixture
+def fake_rag(fake_redis):
+    """
+    RAGService с поддельными моделями (FAKE_MODELS) и отдельной коллекцией Chroma в памяти;
+    задержки моделей минимальные
+    """
+    from app.core.config import settings
+    from app.services.embeddings import embedding_service
+    from app.services.rag import RAGService
+
+    with patch.object(settings, "FAKE_MODELS", True), \
+            patch.object(settings, "CHROMA_IN_MEMORY", True), \
+            patch.object(settings, "CHROMA_SHARDING", "none"), \
+            patch.object(settings, "CHROMA_COLLECTION", f"test_{uuid.uuid4().hex[:8]}"), \
+            patch.object(settings, "FAKE_LLM_LATENCY_MS", 1.0), \
+            patch.object(settings, "FAKE_LLM_TOKEN_MS", 0.0), \
+            patch.object(settings, "FAKE_EMBED_LATENCY_MS", 0.0), \
+            patch.object(embedding_service, "backend", None):
+        yield RAGService()
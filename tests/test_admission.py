@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+
+from app.services.admission import AdmissionController, QueueFullError
+
+
+@pytest.mark.asyncio
+async def test_admission_rejects_when_queue_full():
+    """Очередь заполнена — новый запрос сразу получает QueueFullError с Retry-After"""
+    controller = AdmissionController(max_concurrent=1, max_queue=1)
+    release = asyncio.Event()
+
+    async def hold(priority="interactive"):
+        async with controller.slot(priority):
+            await release.wait()
+
+    running = asyncio.create_task(hold())
+    queued = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+
+    with pytest.raises(QueueFullError) as exc_info:
+        async with controller.slot():
+            pass
+    assert exc_info.value.retry_after >= 1
+
+    release.set()
+    await asyncio.gather(running, queued)
+    assert controller.active == 0
+
+
+@pytest.mark.asyncio
+async def test_admission_serves_interactive_before_batch():
+    """Освободившийся слот получает interactive-запрос, даже если batch встал в очередь раньше"""
+    controller = AdmissionController(max_concurrent=1, max_queue=10)
+    release = asyncio.Event()
+    order = []
+
+    async def work(name, priority):
+        async with controller.slot(priority):
+            order.append(name)
+            if name == "first":
+                await release.wait()
+
+    first = asyncio.create_task(work("first", "interactive"))
+    await asyncio.sleep(0)
+    batch = asyncio.create_task(work("batch", "batch"))
+    await asyncio.sleep(0)
+    interactive = asyncio.create_task(work("interactive", "interactive"))
+    await asyncio.sleep(0)
+
+    release.set()
+    await asyncio.gather(first, batch, interactive)
+    assert order == ["first", "interactive", "batch"]
+
+
+@pytest.mark.asyncio
+async def test_admission_cancelled_waiter_leaves_queue():
+    """Отменённый (дедлайн/отключение клиента) запрос уходит из очереди и не занимает слот"""
+    controller = AdmissionController(max_concurrent=1, max_queue=10)
+    release = asyncio.Event()
+
+    async def hold():
+        async with controller.slot():
+            await release.wait()
+
+    running = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+
+    with pytest.raises(TimeoutError):
+        async with asyncio.timeout(0.01):
+            async with controller.slot():
+                pass
+    assert controller.queue_depth == 0
+
+    release.set()
+    await running
+    assert controller.active == 0
+
+
+@pytest.mark.asyncio
+async def test_admission_should_degrade_on_queue_depth_and_budget():
+    """Деградация: длинная очередь или ожидание слота больше бюджета задержки"""
+    from unittest.mock import patch
+
+    controller = AdmissionController(max_concurrent=1, max_queue=10)
+    release = asyncio.Event()
+
+    async def hold():
+        async with controller.slot():
+            await release.wait()
+
+    with patch("app.services.admission.settings") as mock_settings:
+        mock_settings.DEGRADE_ENABLED = True
+        mock_settings.DEGRADE_QUEUE_DEPTH = 2
+        mock_settings.DEGRADE_LATENCY_BUDGET_MS = 60000
+
+        assert not controller.should_degrade()
+
+        tasks = [asyncio.create_task(hold()) for _ in range(2)]
+        await asyncio.sleep(0)
+        # 1 в работе, 1 в очереди: по глубине ещё нет, но ожидание ~2 с не влезает в бюджет 500 мс
+        assert not controller.should_degrade()
+        assert controller.should_degrade(latency_budget_ms=500)
+
+        tasks.append(asyncio.create_task(hold()))
+        await asyncio.sleep(0)
+        assert controller.should_degrade()
+
+        mock_settings.DEGRADE_ENABLED = False
+        assert not controller.should_degrade(latency_budget_ms=1)
+
+        release.set()
+        await asyncio.gather(*tasks)
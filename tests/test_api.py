@@ -34,7 +34,7 @@ class TestAPI:
     def test_ask_endpoint_success(self, client):
         """Тест успешного запроса к ask endpoint"""
         # Mock данных от RAG service
-        mock_response = ("Test answer", 25, 1.5, ["doc1.pdf"])
+        mock_response = ("Test answer", 25, 1.5, ["doc1.pdf"], False, "generative", 1200.0)
 
         with patch.object(rag, 'ask', new_callable=AsyncMock) as mock_ask, \
                 patch('app.database.crud.save_query', new_callable=AsyncMock) as mock_save:
@@ -50,6 +50,56 @@ class TestAPI:
             assert data["tokens"] == 25
             assert data["latency_ms"] == 1.5
             assert data["sources"] == ["doc1.pdf"]
+            assert data["answer_mode"] == "generative"
+
+    def test_ask_endpoint_scope(self, client):
+        """scope (группы документов) передаётся в RAG"""
+        with patch.object(rag, 'ask', new_callable=AsyncMock) as mock_ask, \
+                patch('app.database.crud.save_query', new_callable=AsyncMock):
+            mock_ask.return_value = ("Test answer", 25, 1.5, [], False, "generative", 1200.0)
+
+            response = client.post("/api/ask", json={"question": "Test question", "scope": ["hr", "it"]})
+
+            assert response.status_code == 200
+            assert mock_ask.call_args.kwargs["scope"] == ["hr", "it"]
+
+    def test_ask_endpoint_profiling(self, client, tmp_path):
+        """Запрос с X-Profile: ответ содержит X-Profile-Id, профиль доступен через admin endpoint"""
+        from app.core.config import settings
+
+        with patch.object(rag, 'ask', new_callable=AsyncMock) as mock_ask, \
+                patch.object(settings, "PROFILE_ADMIN_TOKEN", "secret"), \
+                patch.object(settings, "PROFILE_DIR", str(tmp_path)), \
+                patch('app.database.crud.save_query', new_callable=AsyncMock):
+            mock_ask.return_value = ("Test answer", 25, 1.5, ["doc1.pdf"], False, "generative", 1200.0)
+
+            response = client.post("/api/ask", json={"question": "Test question"})
+            assert "X-Profile-Id" not in response.headers
+
+            response = client.post("/api/ask", json={"question": "Test question"}, headers={"X-Profile": "secret"})
+            assert response.status_code == 200
+            profile_id = response.headers["X-Profile-Id"]
+
+            assert client.get(f"/api/admin/profiles/{profile_id}/stages").status_code == 403
+            stages = client.get(f"/api/admin/profiles/{profile_id}/stages", headers={"X-Profile": "secret"})
+            assert stages.status_code == 200
+            assert stages.json()["id"] == profile_id
+
+    def test_ask_endpoint_profiling_error_response(self, client, tmp_path):
+        """Профилируемый запрос, завершившийся ошибкой (429), тоже возвращает X-Profile-Id"""
+        from app.core.config import settings
+        from app.services.admission import QueueFullError
+
+        with patch.object(rag, 'ask', new_callable=AsyncMock) as mock_ask, \
+                patch.object(settings, "PROFILE_ADMIN_TOKEN", "secret"), \
+                patch.object(settings, "PROFILE_DIR", str(tmp_path)):
+            mock_ask.side_effect = QueueFullError(retry_after=3)
+
+            response = client.post("/api/ask", json={"question": "Test question"}, headers={"X-Profile": "secret"})
+
+            assert response.status_code == 429
+            assert response.headers["Retry-After"] == "3"
+            assert (tmp_path / response.headers["X-Profile-Id"]).is_dir()
 
     def test_ask_endpoint_validation_error(self, client):
         """Тест валидации запроса"""
@@ -71,11 +121,38 @@ class TestAPI:
             assert response.status_code == 500
             assert response.json()["detail"] == "Internal server error"
 
+    def test_ask_endpoint_queue_full(self, client):
+        """Очередь LLM заполнена — 429 с Retry-After"""
+        from app.services.admission import QueueFullError
+
+        with patch.object(rag, 'ask', new_callable=AsyncMock) as mock_ask:
+            mock_ask.side_effect = QueueFullError(retry_after=3)
+
+            request_data = {"question": "Test question", "top_k": 5}
+            response = client.post("/api/ask", json=request_data)
+
+            assert response.status_code == 429
+            assert response.headers["Retry-After"] == "3"
+
+    def test_ask_endpoint_deadline_exceeded(self, client):
+        """Дедлайн запроса истёк — 503 с Retry-After"""
+        async def slow_ask(*args, **kwargs):
+            await asyncio.sleep(1)
+
+        with patch.object(rag, 'ask', side_effect=slow_ask):
+            request_data = {"question": "Test question", "top_k": 5, "timeout_ms": 10}
+            response = client.post("/api/ask", json=request_data)
+
+            assert response.status_code == 503
+            assert "Retry-After" in response.headers
+
     def test_upload_documents_txt_success(self, client):
         """Тест успешной загрузки TXT документа"""
         # Mock сохранения документа
-        with patch('app.database.crud.save_document', new_callable=AsyncMock) as mock_save:
-            mock_save.return_value = 1  # Mock возвращает 1
+        with patch('app.api.endpoints.get_document_by_filename', new_callable=AsyncMock) as mock_get, \
+                patch('app.api.endpoints.upsert_document', new_callable=AsyncMock) as mock_save:
+            mock_get.return_value = None
+            mock_save.return_value = {"document_id": 1, "change": "created", "added": [], "moved": [], "removed": []}
 
             # Создаем файл для теста
             files = [('files', ('test.txt', io.BytesIO(b'Test file content'), 'text/plain'))]
@@ -89,6 +166,25 @@ class TestAPI:
             # Не проверяем точное значение document_id, так как оно может быть разным
             assert data["results"][0]["document_id"] is not None  # Просто проверяем, что есть ID
 
+    def test_upload_documents_to_group(self, client):
+        """Документ загружается в указанную группу; некорректное имя группы — 400"""
+        with patch('app.api.endpoints.get_document_by_filename', new_callable=AsyncMock) as mock_get, \
+                patch('app.api.endpoints.upsert_document', new_callable=AsyncMock) as mock_save:
+            mock_get.return_value = None
+            mock_save.return_value = {"document_id": 1, "change": "created", "added": [], "moved": [], "removed": []}
+
+            files = [('files', ('test.txt', io.BytesIO(b'Test file content'), 'text/plain'))]
+            response = client.post("/api/documents", files=files, data={"group": "hr"})
+
+            assert response.status_code == 200
+            assert response.json()["results"][0]["group"] == "hr"
+            mock_get.assert_awaited_once_with("test.txt", "hr")
+            assert mock_save.call_args.kwargs["group_name"] == "hr"
+
+            files = [('files', ('test.txt', io.BytesIO(b'Test file content'), 'text/plain'))]
+            response = client.post("/api/documents", files=files, data={"group": "../hr"})
+            assert response.status_code == 400
+
     def test_upload_documents_unsupported_format(self, client):
         """Тест загрузки неподдерживаемого формата"""
         files = [('files', ('test.jpg', io.BytesIO(b'fake image data'), 'image/jpeg'))]
@@ -102,11 +198,13 @@ class TestAPI:
 
     def test_upload_multiple_documents(self, client):
         """Тест загрузки нескольких документов"""
-        with patch('app.database.crud.save_document', new_callable=AsyncMock) as mock_save, \
-                patch('app.services.rag.rag.index_chunks', new_callable=AsyncMock) as mock_index:
+        with patch('app.api.endpoints.get_document_by_filename', new_callable=AsyncMock) as mock_get, \
+                patch('app.api.endpoints.upsert_document', new_callable=AsyncMock) as mock_save, \
+                patch('app.services.rag.rag.apply_chunk_changes', new_callable=AsyncMock) as mock_index:
 
-            mock_save.return_value = 1
-            mock_index.return_value = None  # ← Заглушить index_chunks
+            mock_get.return_value = None
+            mock_save.return_value = {"document_id": 1, "change": "created", "added": [], "moved": [], "removed": []}
+            mock_index.return_value = None  # ← Заглушить индексацию
 
             files = [
                 ('files', ('doc1.txt', io.BytesIO(b'Content 1'), 'text/plain')),
@@ -118,3 +216,23 @@ class TestAPI:
             data = response.json()
             assert len(data["results"]) == 2
             assert all(result["status"] == "ok" for result in data["results"])
+
+    def test_upload_unchanged_document_is_noop(self, client):
+        """Повторная загрузка неизменённого файла ничего не сохраняет и не индексирует"""
+        from app.services.other_functions import content_hash
+
+        existing = MagicMock(id=7, content_hash=content_hash(b'Test file content'))
+        with patch('app.api.endpoints.get_document_by_filename', new_callable=AsyncMock) as mock_get, \
+                patch('app.api.endpoints.upsert_document', new_callable=AsyncMock) as mock_save, \
+                patch('app.services.rag.rag.apply_chunk_changes', new_callable=AsyncMock) as mock_index:
+            mock_get.return_value = existing
+
+            files = [('files', ('test.txt', io.BytesIO(b'Test file content'), 'text/plain'))]
+            response = client.post("/api/documents", files=files)
+
+            assert response.status_code == 200
+            result = response.json()["results"][0]
+            assert result["change"] == "unchanged"
+            assert result["document_id"] == 7
+            mock_save.assert_not_awaited()
+            mock_index.assert_not_awaited()
@@ -0,0 +1,22 @@
+import pytest
+
+from app.services.cache import RedisCache
+
+
+@pytest.mark.asyncio
+async def test_corpus_version_bumped_by_other_process_invalidates_answers(fake_redis):
+    """Версию корпуса повысил другой процесс (app.ingest) — старый ответ из кэша не отдаётся"""
+    redis = fake_redis
+    api, ingest = RedisCache(), RedisCache()
+    api.redis_client = ingest.redis_client = redis
+
+    await api.set_cached_answer("вопрос", 5, {"answer": "старый"})
+    assert (await api.get_cached_answer("вопрос", 5))["answer"] == "старый"
+    assert redis.round_trips == 1  # версия и ответ — одним запросом
+
+    await ingest.bump_corpus_version()
+
+    assert await api.get_cached_answer("вопрос", 5) is None
+    assert api.corpus_version == 1
+    await api.set_cached_answer("вопрос", 5, {"answer": "новый"})
+    assert (await api.get_cached_answer("вопрос", 5))["answer"] == "новый"
@@ -0,0 +1,147 @@
+import pytest
+import pytest_asyncio
+from unittest.mock import patch
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.database import crud
+from app.database.models import Base
+
+
+@pytest_asyncio.fixture
+async def db():
+    """In-memory SQLite вместо PostgreSQL + счётчик SQL-запросов"""
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    statements = []
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    with patch.object(crud, "async_session", session_factory):
+        yield statements
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_get_sources_for_chunks_single_query(db):
+    """Источники чанков получаются одним запросом без загрузки текста"""
+    await crud.upsert_document("manual.pdf", "h1", ["первый чанк", "второй чанк"])
+    await crud.upsert_document("guide.pdf", "h2", ["третий чанк"])
+    db.clear()
+
+    sources = await crud.get_sources_for_chunks([1, 3])
+
+    assert sources == {1: "manual.pdf", 3: "guide.pdf"}
+    assert len(db) == 1
+    assert "chunks.text" not in db[0]
+
+
+@pytest.mark.asyncio
+async def test_iter_chunks_for_index_batches(db):
+    """Чанки для индексации читаются пачками одним потоковым запросом"""
+    await crud.upsert_document("manual.pdf", "h1", [f"чанк {i}" for i in range(5)])
+    db.clear()
+
+    batches = [batch async for batch in crud.iter_chunks_for_index(batch_size=2)]
+
+    assert [len(b) for b in batches] == [2, 2, 1]
+    assert batches[0][0].filename == "manual.pdf"
+    assert len(db) == 1
+
+
+@pytest.mark.asyncio
+async def test_upsert_document_replaces_only_changed_chunks(db):
+    """Повторная загрузка: совпавшие чанки остаются, новые добавляются, исчезнувшие удаляются"""
+    created = await crud.upsert_document("manual.pdf", "hash-1", ["чанк A", "чанк B", "чанк C"])
+    ids = {c.text: c.id for c in created["added"]}
+
+    updated = await crud.upsert_document(
+        "manual.pdf", "hash-2", ["чанк A", "чанк C", "чанк D"], document_id=created["document_id"]
+    )
+
+    assert updated["change"] == "updated"
+    assert updated["document_id"] == created["document_id"]
+    assert [c.text for c in updated["added"]] == ["чанк D"]
+    assert updated["removed"] == [ids["чанк B"]]
+    assert [(c.id, c.chunk_index) for c in updated["moved"]] == [(ids["чанк C"], 1)]
+
+    existing = await crud.get_document_by_filename("manual.pdf")
+    assert existing.content_hash == "hash-2"
+
+
+@pytest.mark.asyncio
+async def test_get_top_questions_merges_variants(db):
+    """Частые вопросы считаются с учётом нормализации (пробелы, '?')"""
+    from datetime import datetime, timedelta
+
+    for question in ["Как загрузить файл?", "Как загрузить файл", " Как загрузить  файл ", "Что такое API?"]:
+        await crud.save_query(question, "ответ", 10, 100)
+
+    top = await crud.get_top_questions(datetime.now() - timedelta(days=1), limit=1)
+
+    assert len(top) == 1
+    assert top[0][1] == 3
+
+
+@pytest.mark.asyncio
+async def test_save_query_updates_stats_rollups(db):
+    """Каждая запись истории инкрементально обновляет агрегаты; /api/stats читает только их"""
+    from datetime import datetime, timedelta
+
+    await crud.save_query("вопрос 1", "ответ", 100, 2000, cache_hit=False, generation_ms=1000)
+    await crud.save_query("вопрос 2", "ответ", 100, 5, cache_hit=True)
+    await crud.save_query("вопрос 3", "ответ", 100, 2000, cache_hit=False, generation_ms=1000)
+    # Экстрактивный ответ (без вызова LLM) в токены/с не входит
+    await crud.save_query("вопрос 4", "ответ", 0, 300, cache_hit=False)
+    db.clear()
+
+    stats = await crud.get_stats("hour", datetime.now() - timedelta(hours=2))
+
+    assert len(db) == 2
+    assert "query_history" not in " ".join(db)
+    total = stats["total"]
+    assert total["requests"] == 4
+    assert total["cache_hit_ratio"] == 0.25
+    # Токены/с — по времени вызовов LLM, а не по сквозной задержке запросов
+    assert total["tokens_per_s"] == 100.0
+    assert 2000 <= total["latency_ms"]["p95"] <= 2200
+    # QPS — за всё запрошенное окно (2 часа), а не только за интервалы с запросами
+    assert total["qps"] == round(4 / 7200, 4)
+    assert stats["buckets"][0]["qps"] == round(4 / 3600, 4)
+
+
+@pytest.mark.asyncio
+async def test_prune_minute_rollups_keeps_hourly(db):
+    """Старые минутные агрегаты удаляются вместе с гистограммами, часовые остаются"""
+    from datetime import datetime, timedelta
+    from app.core.config import irkutsk_tz
+
+    await crud.save_query("вопрос", "ответ", 10, 100)
+    since = datetime.now(irkutsk_tz) - timedelta(hours=1)
+
+    assert await crud.prune_minute_rollups(since) == 0
+    assert (await crud.get_stats("minute", since))["total"]["requests"] == 1
+
+    assert await crud.prune_minute_rollups(datetime.now(irkutsk_tz) + timedelta(minutes=1)) == 1
+    minute = await crud.get_stats("minute", since)
+    assert minute["buckets"] == [] and minute["total"]["latency_ms"]["p50"] is None
+    assert (await crud.get_stats("hour", since))["total"]["requests"] == 1
+
+
+@pytest.mark.asyncio
+async def test_save_query_stores_integer_latency(db):
+    """Задержка приходит как float, а колонка latency_ms — Integer"""
+    from sqlalchemy import select
+    from app.database.models import QueryHistory
+
+    await crud.save_query("вопрос", "ответ", 10, 123.6)
+
+    async with crud.async_session() as session:
+        latency = (await session.execute(select(QueryHistory.latency_ms))).scalar_one()
+    assert latency == 124 and isinstance(latency, int)
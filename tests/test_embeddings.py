@@ -0,0 +1,48 @@
+import asyncio
+import pytest
+
+from app.services.embeddings import EmbeddingService
+
+
+class FakeBackend:
+    """Детерминированный эмбеддер: запоминает размеры пачек"""
+    model_id = "fake"
+
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, texts):
+        self.batches.append(len(texts))
+        return [[float(len(text))] for text in texts]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_questions_are_batched():
+    """Одновременные вопросы считаются одним вызовом модели, результаты не перепутаны"""
+    service = EmbeddingService()
+    service.backend = FakeBackend()
+
+    results = await asyncio.gather(
+        service.embed(["a"]),
+        service.embed(["bb"]),
+        service.embed(["ccc"]),
+    )
+
+    assert results == [[[1.0]], [[2.0]], [[3.0]]]
+    assert service.backend.batches == [3]
+
+
+@pytest.mark.asyncio
+async def test_embed_documents_uses_ingest_batches():
+    """Индексация: тексты режутся на пачки EMBED_INGEST_BATCH"""
+    from unittest.mock import patch
+
+    service = EmbeddingService()
+    service.backend = FakeBackend()
+
+    with patch("app.services.embeddings.settings") as mock_settings:
+        mock_settings.EMBED_INGEST_BATCH = 2
+        embeddings = await service.embed_documents(["a", "bb", "ccc"])
+
+    assert embeddings == [[1.0], [2.0], [3.0]]
+    assert service.backend.batches == [2, 1]
@@ -0,0 +1,31 @@
+from app.services.extractive import extract_answer, split_sentences
+
+
+def test_split_sentences_skips_fragments():
+    text = "Отпуск оформляется через отдел кадров. Да.\nЗаявление подаётся за две недели до начала!"
+    assert split_sentences(text) == [
+        "Отпуск оформляется через отдел кадров.",
+        "Заявление подаётся за две недели до начала!",
+    ]
+
+
+def test_extract_answer_picks_matching_sentences_in_order():
+    """Берутся предложения с терминами вопроса, в порядке чанков; повторы из перекрытий — один раз"""
+    chunks = [
+        "Офис работает с 9 до 18 часов. Заявление на отпуск подаётся в отдел кадров.",
+        "Заявление на отпуск подаётся в отдел кадров. Отпуск согласует руководитель отдела.",
+        "Пароль от Wi-Fi выдаёт служба поддержки по заявке.",
+    ]
+
+    result = extract_answer("Как оформить отпуск?", chunks, max_sentences=2)
+
+    assert result == [
+        (0, "Заявление на отпуск подаётся в отдел кадров."),
+        (1, "Отпуск согласует руководитель отдела."),
+    ]
+
+
+def test_extract_answer_falls_back_to_nearest_chunk():
+    chunks = ["Пароль от Wi-Fi выдаёт служба поддержки по заявке."]
+    assert extract_answer("Когда зарплата?", chunks, max_sentences=3) == [(0, chunks[0])]
+    assert extract_answer("Когда зарплата?", [], max_sentences=3) == []
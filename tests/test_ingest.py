@@ -0,0 +1,113 @@
+import uuid
+
+import chromadb
+import pytest
+import pytest_asyncio
+from unittest.mock import patch
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.database import crud
+from app.database.models import Base
+from app.ingest import IngestCheckpoint, ingest_directory
+from app.services.other_functions import content_hash, split_text_into_chunks
+from app.services.vector_store import ShardedIndex
+
+
+class FakeEmbedder:
+    """Детерминированные эмбеддинги без модели"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def embed_documents(self, texts):
+        self.calls.append(len(texts))
+        return [[float(len(t)), 1.0, 0.0] for t in texts]
+
+
+@pytest_asyncio.fixture
+async def db():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    with patch.object(crud, "async_session", session_factory):
+        yield
+    await engine.dispose()
+
+
+@pytest.fixture
+def index():
+    return ShardedIndex(chromadb.EphemeralClient(), base_name=f"test_{uuid.uuid4().hex[:8]}", sharding="none")
+
+
+@pytest.fixture
+def collection(index):
+    return index.collection(index.base_name)
+
+
+@pytest.fixture
+def docs(tmp_path):
+    (tmp_path / "faq.txt").write_text("Отпуск оформляется через отдел кадров за две недели. " * 30, encoding="utf-8")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "guide.md").write_text("Пароль от Wi-Fi выдаёт служба поддержки по заявке. " * 5,
+                                               encoding="utf-8")
+    (tmp_path / "image.png").write_bytes(b"\x89PNG")
+    return tmp_path
+
+
+@pytest.mark.asyncio
+async def test_ingest_directory_and_resume(db, index, collection, docs):
+    """Файлы загружаются в БД и индекс; повторный запуск пропускает загруженное по прогрессу"""
+    embedder = FakeEmbedder()
+    checkpoint = IngestCheckpoint(docs / ".ingest_checkpoint.json")
+
+    report = await ingest_directory(docs, index, checkpoint, workers=1, embed_batch=1000, embedder=embedder)
+
+    assert report["files"] == 2
+    assert report["created"] == 2
+    assert report["chunks_added"] == collection.count() > 0
+    assert embedder.calls == [report["chunks_added"]]  # одна крупная пачка
+    assert set(checkpoint.files) == {"faq.txt", "sub/guide.md"}
+    assert {m["filename"] for m in collection.get(include=["metadatas"])["metadatas"]} == {"faq.txt", "sub/guide.md"}
+
+    report = await ingest_directory(docs, index, IngestCheckpoint(docs / ".ingest_checkpoint.json"),
+                                    workers=1, embedder=embedder)
+    assert report["skipped"] == 2
+    assert report["chunks_added"] == 0
+
+
+@pytest.mark.asyncio
+async def test_ingest_indexes_documents_missing_from_index(db, index, collection, docs):
+    """Документ уже в БД, но не в индексе (прерванный запуск) — векторизуются только его чанки"""
+    text = (docs / "faq.txt").read_text(encoding="utf-8")
+    await crud.upsert_document("faq.txt", content_hash(text), split_text_into_chunks(text))
+
+    report = await ingest_directory(docs, index, IngestCheckpoint(docs / "progress.json"),
+                                    workers=1, embedder=FakeEmbedder())
+
+    assert report["unchanged"] == 1
+    assert report["created"] == 1
+    assert collection.count() == report["chunks_added"]
+    assert len(collection.get(where={"filename": "faq.txt"})["ids"]) == len(split_text_into_chunks(text))
+
+
+@pytest.mark.asyncio
+async def test_ingest_new_documents_in_bulk_per_group(db, index, collection, docs):
+    """Новые документы пишутся в БД пачкой; прогресс ведётся отдельно для каждой группы"""
+    path = docs / "progress.json"
+    with patch("app.ingest.upsert_document") as upsert, \
+            patch("app.ingest.insert_documents", wraps=crud.insert_documents) as insert:
+        report = await ingest_directory(docs, index, IngestCheckpoint(path), workers=1, embedder=FakeEmbedder())
+        upsert.assert_not_called()
+        assert insert.call_count == 1
+        assert report["created"] == 2
+
+        report = await ingest_directory(docs, index, IngestCheckpoint(path, group_name="hr"), workers=1,
+                                        embedder=FakeEmbedder(), group_name="hr")
+        assert report["skipped"] == 0
+        assert report["created"] == 2
+
+    assert await crud.get_document_groups() == ["default", "hr"]
+    assert {m["group"] for m in collection.get(include=["metadatas"])["metadatas"]} == {"default", "hr"}
+    assert IngestCheckpoint(path).files.keys() == IngestCheckpoint(path, group_name="hr").files.keys()
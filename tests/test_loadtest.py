@@ -0,0 +1,78 @@
+import random
+
+import httpx
+import pytest
+
+from app.loadtest import QuestionPicker, percentiles, parse_mix, run_load_test
+from app.services.fake_models import FakeEmbeddingBackend, FakeLlama
+
+
+def test_percentiles_nearest_rank():
+    values = list(range(1, 101))
+    result = percentiles(values)
+    assert result["p50"] == 50
+    assert result["p99"] == 99
+    assert result["max"] == 100
+    assert percentiles([]) == {}
+
+
+def test_question_picker_cache_hit_ratio():
+    """Доля повторов «горячих» вопросов близка к cache_hit_ratio, остальные вопросы уникальны"""
+    questions = ["a", "b"]
+    picker = QuestionPicker(questions, cache_hit_ratio=0.3, rng=random.Random(1))
+    picked = [picker.next() for _ in range(2000)]
+
+    hot = sum(1 for q in picked if q in questions)
+    assert 0.25 < hot / len(picked) < 0.35
+    cold = [q for q in picked if q not in questions]
+    assert len(set(cold)) == len(cold)
+
+
+def test_parse_mix_rejects_unknown_kind():
+    assert parse_mix("ask=0.9,upload=0.1") == {"ask": 0.9, "upload": 0.1}
+    with pytest.raises(Exception):
+        parse_mix("delete=1")
+
+
+def test_fake_models_are_deterministic():
+    llm = FakeLlama(latency_ms=0, token_ms=0, answer_tokens=10)
+    answer = llm("вопрос и контекст", max_tokens=200)
+    assert answer == llm("вопрос и контекст", max_tokens=200)
+    assert answer["choices"][0]["text"].endswith(".")
+    assert answer["usage"]["completion_tokens"] == 10
+    assert float(llm("оценка", max_tokens=5)["choices"][0]["text"]) in (0.0, 0.5, 0.8, 1.0)
+
+    embedder = FakeEmbeddingBackend(dim=8, latency_ms=0)
+    first, second = embedder.encode(["один", "два"])
+    assert embedder.encode(["один"])[0] == first
+    assert first != second
+    assert sum(x * x for x in first) == pytest.approx(1.0)
+
+
+@pytest.mark.asyncio
+async def test_run_load_test_report():
+    """Отчёт: число запросов, ошибки (в т.ч. 429) и разбивка по типам"""
+    calls = {"ask": 0}
+
+    def handler(request: httpx.Request):
+        if request.url.path == "/api/ask":
+            calls["ask"] += 1
+            status = 429 if calls["ask"] % 4 == 0 else 200
+            return httpx.Response(status, json={"answer": "ok", "tokens": 1, "latency_ms": 1, "sources": []})
+        if request.url.path == "/api/documents":
+            return httpx.Response(200, json={"results": []})
+        return httpx.Response(200, json={"counters": {}})
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://test") as client:
+        report = await run_load_test(
+            client, mix={"ask": 3, "upload": 1}, concurrency=4, rate=0, duration=5,
+            max_requests=40, warmup=False, seed=7,
+        )
+
+    assert report["requests"] == 40
+    assert set(report["by_type"]) == {"ask", "upload"}
+    assert report["by_type"]["upload"]["errors"] == 0
+    assert report["errors"] == report["status_codes"].get("429", 0) > 0
+    assert report["error_rate"] == pytest.approx(report["errors"] / 40)
+    assert set(report["latency_ms"]) >= {"p50", "p95", "p99"}
+    assert report["server_metrics"] == {"counters": {}}
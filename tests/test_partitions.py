@@ -0,0 +1,90 @@
+from datetime import date, datetime, timedelta
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from app.core.config import irkutsk_tz, settings
+from app.database import partitions
+from app.database.partitions import PARTITION_NAME_RE, add_months, partition_name
+
+
+def test_add_months_crosses_year():
+    """Переход через границу года в обе стороны"""
+    assert add_months(date(2026, 11, 1), 2) == date(2027, 1, 1)
+    assert add_months(date(2026, 1, 1), -1) == date(2025, 12, 1)
+
+
+def test_partition_name_roundtrip():
+    """Имя месячной партиции распознаётся при архивации"""
+    name = partition_name(date(2026, 3, 1))
+
+    assert name == "query_history_y2026m03"
+    assert PARTITION_NAME_RE.match(name).groups() == ("2026", "03")
+
+
+class FakeConn:
+    def __init__(self, executed):
+        self.executed = executed
+
+    async def execute(self, statement, params=None):
+        self.executed.append(str(statement))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeEngine:
+    def __init__(self):
+        self.executed = []
+
+    def connect(self):
+        return FakeConn(self.executed)
+
+    begin = connect
+
+
+@pytest.mark.asyncio
+async def test_archive_keeps_partition_attached_when_export_fails(tmp_path):
+    """Партиция отсоединяется и удаляется только после успешной выгрузки"""
+    engine = FakeEngine()
+    old = [("query_history_y2020m01", date(2020, 1, 1)), ("query_history_y2020m02", date(2020, 2, 1))]
+
+    async def export(name, path):
+        if name == "query_history_y2020m01":
+            raise OSError("disk full")
+        return 3
+
+    with patch.object(partitions, "engine", engine), \
+            patch.object(partitions, "BASE_DIR", tmp_path), \
+            patch.object(partitions, "list_partitions", AsyncMock(return_value=old)), \
+            patch.object(partitions, "list_detached_partitions",
+                         AsyncMock(return_value=[("query_history_y2019m12", date(2019, 12, 1))])), \
+            patch.object(partitions, "_export_partition", side_effect=export), \
+            patch.object(partitions, "_archive_default_partition", AsyncMock(return_value=None)):
+        archived = await partitions.archive_old_partitions(retention_months=1)
+
+    assert [item["partition"] for item in archived] == ["query_history_y2020m02", "query_history_y2019m12"]
+    assert not any("y2020m01" in statement for statement in engine.executed)
+    assert engine.executed == [
+        "ALTER TABLE query_history DETACH PARTITION query_history_y2020m02",
+        "DROP TABLE query_history_y2020m02",
+        "DROP TABLE query_history_y2019m12",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_run_maintenance_prunes_minute_rollups():
+    """Минутные агрегаты чистятся вместе с обслуживанием партиций; ошибка очистки не мешает архивации"""
+    archive = AsyncMock(return_value=[])
+    with patch.object(partitions, "engine", FakeEngine()), \
+            patch.object(partitions, "prune_minute_rollups", AsyncMock(side_effect=OSError("db down"))) as prune, \
+            patch.object(partitions, "archive_old_partitions", archive):
+        await partitions.run_maintenance()
+
+    archive.assert_awaited_once()
+    before = prune.await_args.args[0]
+    expected = datetime.now(irkutsk_tz) - timedelta(hours=settings.STATS_MINUTE_RETENTION_HOURS)
+    assert abs((before - expected).total_seconds()) < 60
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+import pytest_asyncio
+from unittest.mock import AsyncMock, patch
+
+from app.core.config import settings
+from app.database.crud import IndexedChunk
+from app.services import prewarm as prewarm_module
+from app.services.admission import admission
+from app.services.cache import cache
+from app.services.prewarm import PrewarmJob
+
+
+# Вопросы близки к чанкам корпуса (расстояние < RERANK_ACCEPT_DISTANCE) — ответ генерируется и кэшируется
+QUESTIONS = [
+    "Как оформить отпуск в отделе кадров?",
+    "Пароль от Wi-Fi выдаёт служба поддержки?",
+    "Справку о доходах выдаёт бухгалтерия?",
+]
+
+
+@pytest_asyncio.fixture
+async def prewarm_rag(fake_rag):
+    """Поддельный RAG с небольшим корпусом вместо глобального rag; история запросов — QUESTIONS"""
+    await fake_rag._add_to_index([
+        IndexedChunk(1, 1, 0, "Отпуск оформляется заявлением в отделе кадров за две недели.", "hr.txt"),
+        IndexedChunk(2, 2, 0, "Пароль от Wi-Fi выдаёт служба поддержки по заявке.", "it.txt"),
+        IndexedChunk(3, 3, 0, "Справку о доходах выдаёт бухгалтерия за три дня.", "finance.txt"),
+    ])
+    with patch.object(prewarm_module, "rag", fake_rag), \
+            patch.object(prewarm_module, "get_top_questions", AsyncMock(return_value=[(q, 10) for q in QUESTIONS])), \
+            patch.object(settings, "PREWARM_INTERVAL_SEC", 0.0), \
+            patch.object(settings, "PREWARM_IDLE_POLL_SEC", 0.01), \
+            patch.object(fake_rag, "ask", wraps=fake_rag.ask) as ask:
+        yield ask
+
+
+@pytest.mark.asyncio
+async def test_prewarm_skips_cached_and_fills_cache(prewarm_rag):
+    """Вопросы, уже лежащие в кэше, не пересчитываются; остальные после прогрева отдаются из кэша"""
+    await cache.set_cached_answer(QUESTIONS[0], settings.PREWARM_TOP_K, {
+        "answer": "из кэша", "tokens": 1, "duration": 0.1, "sources": []
+    })
+    job = PrewarmJob()
+
+    await job.run(window_hours=24, limit=10)
+
+    assert job.state["status"] == "done"
+    assert (job.state["total"], job.state["already_cached"], job.state["warmed"], job.state["failed"]) == (3, 1, 2, 0)
+    assert [call.args[0] for call in prewarm_rag.call_args_list] == QUESTIONS[1:]
+    # Прогрев считает ответы с фоновым приоритетом и тем же top_k, что у /api/ask
+    assert all(call.kwargs["priority"] == "background" for call in prewarm_rag.call_args_list)
+    assert all(call.args[1] == settings.PREWARM_TOP_K for call in prewarm_rag.call_args_list)
+    for question in QUESTIONS[1:]:
+        assert await cache.get_cached_answer(question, settings.PREWARM_TOP_K)
+
+
+@pytest.mark.asyncio
+async def test_prewarm_waits_for_interactive_traffic(prewarm_rag):
+    """Пока LLM занята живым запросом, прогрев не отправляет вопросы"""
+    job = PrewarmJob()
+
+    async with admission.slot("interactive"):
+        task = asyncio.create_task(job.run(window_hours=24, limit=10))
+        await asyncio.sleep(0.1)
+        prewarm_rag.assert_not_called()
+        assert job.state["status"] == "running"
+
+    await asyncio.wait_for(task, timeout=5)
+    assert job.state["warmed"] == 3
+
+
+@pytest.mark.asyncio
+async def test_prewarm_rate_limited(prewarm_rag):
+    """Между пересчётами — не меньше PREWARM_INTERVAL_SEC"""
+    job = PrewarmJob()
+    asked_at = []
+
+    async def ask(*args, **kwargs):
+        asked_at.append(time.monotonic())
+
+    prewarm_rag.side_effect = ask
+    with patch.object(settings, "PREWARM_INTERVAL_SEC", 0.05):
+        await job.run(window_hours=24, limit=10)
+
+    assert len(asked_at) == 3
+    assert all(later - earlier >= 0.05 for earlier, later in zip(asked_at, asked_at[1:]))
+
+
+@pytest.mark.asyncio
+async def test_prewarm_endpoint_reports_progress_and_rejects_second_start(prewarm_rag):
+    """POST /api/prewarm запускает прогрев один раз, GET /api/prewarm показывает прогресс"""
+    from app.api.endpoints import app
+
+    job = PrewarmJob()
+    transport = httpx.ASGITransport(app=app)
+    with patch("app.api.endpoints.prewarm", job), patch.object(settings, "PREWARM_INTERVAL_SEC", 0.05):
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/api/prewarm", params={"window_hours": 24})
+            assert response.status_code == 202
+            assert response.json()["started"] is True
+
+            assert (await client.post("/api/prewarm")).json()["started"] is False
+
+            await asyncio.sleep(0.02)
+            progress = (await client.get("/api/prewarm")).json()
+            assert progress["status"] == "running"
+            assert progress["total"] == 3 and progress["window_hours"] == 24
+            assert progress["warmed"] < 3
+
+            await asyncio.wait_for(job._task, timeout=5)
+            done = (await client.get("/api/prewarm")).json()
+
+    assert done["status"] == "done" and done["warmed"] == 3
+    assert done["finished_at"] is not None
+    assert job.start() is True  # после завершения прогрев можно запустить снова
+    await job._task
@@ -0,0 +1,68 @@
+import json
+import threading
+import time
+
+import pytest
+from unittest.mock import patch
+
+from app.core.config import settings
+from app.services import profiling
+
+
+@pytest.fixture
+def profile_settings(tmp_path):
+    with patch.object(settings, "PROFILE_DIR", str(tmp_path)), \
+         patch.object(settings, "PROFILE_INTERVAL_MS", 1.0), \
+         patch.object(settings, "PROFILE_ADMIN_TOKEN", "secret"), \
+         patch.object(settings, "PROFILE_SAMPLE_RATE", 0.0):
+        yield tmp_path
+
+
+def test_stage_is_noop_without_profile():
+    """Без активного профиля stage() не создаёт объектов и ничего не пишет"""
+    assert profiling.stage("chroma_query") is profiling.stage("generate")
+
+
+def test_should_profile_requires_admin_token(profile_settings):
+    assert profiling.should_profile("secret")
+    assert not profiling.should_profile("wrong")
+    assert not profiling.should_profile(None)
+
+
+def busy_function(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profile_records_stages_and_samples(profile_settings):
+    """Профиль запроса: этапы по порядку и стеки в speedscope/collapsed-формате"""
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_function, args=(stop,), name="worker")
+
+    profile = profiling.start_profile({"path": "/api/ask"})
+    worker.start()
+    with profiling.stage("chroma_query"):
+        time.sleep(0.02)
+    for _ in range(2):
+        with profiling.stage("rerank_llm"):
+            time.sleep(0.01)
+    stop.set()
+    worker.join()
+    profiling.finish_profile(profile)
+    path = profiling.save_profile(profile)
+
+    assert profiling.stage("generate") is profiling._NULL
+    stages = json.loads((path / "stages.json").read_text(encoding="utf-8"))
+    assert [s["name"] for s in stages["stages"]] == ["chroma_query", "rerank_llm", "rerank_llm"]
+    assert stages["totals"]["rerank_llm"]["count"] == 2
+    assert stages["stages"][0]["duration_ms"] >= 20
+
+    collapsed = (path / "profile.collapsed.txt").read_text(encoding="utf-8")
+    assert any(line.startswith("worker;") and "busy_function" in line for line in collapsed.splitlines())
+    speedscope = json.loads((path / "profile.speedscope.json").read_text(encoding="utf-8"))
+    assert speedscope["profiles"][0]["type"] == "sampled"
+    assert len(speedscope["profiles"][0]["samples"]) == len(speedscope["profiles"][0]["weights"])
+
+    assert profiling.list_profiles()[0]["id"] == profile.id
+    assert profiling.profile_file(profile.id, "stages") == path / "stages.json"
+    assert profiling.profile_file("../etc", "stages") is None
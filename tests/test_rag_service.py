@@ -3,6 +3,8 @@ import asyncio
 from unittest.mock import Mock, AsyncMock, patch
 from pathlib import Path
 
+from app.services.vector_store import ShardedIndex
+
 
 @pytest.fixture(scope="session")
 def event_loop():
@@ -15,13 +17,14 @@ def event_loop():
 async def test_ask_no_relevant_documents():
     """Если Chroma не вернула документы, RAG возвращает сообщение об отсутствии релевантных"""
     with patch("app.services.rag.Llama") as mock_llama, \
-         patch("app.services.rag.chromadb.PersistentClient") as mock_chroma, \
+         patch("app.services.vector_store.chromadb.HttpClient") as mock_chroma, \
          patch("app.services.rag.BASE_DIR", Path("/fake/path")), \
          patch("app.services.rag.settings") as mock_settings, \
          patch("pathlib.Path.exists", return_value=True), \
          patch("app.services.rag.cache") as mock_cache:
 
         mock_settings.MODEL_PATH = "fake_model.gguf"
+        mock_settings.FAKE_MODELS = False
         mock_collection = Mock()
         mock_chroma.return_value.get_or_create_collection.return_value = mock_collection
         mock_collection.query.return_value = {"documents": [[]], "ids": [[]]}
@@ -33,9 +36,9 @@ async def test_ask_no_relevant_documents():
         from app.services.rag import RAGService
         service = RAGService()
         service.llm = mock_llama.return_value
-        service.collection = mock_collection
+        service.index = ShardedIndex(mock_chroma.return_value, sharding="none")
 
-        answer, tokens, duration, sources = await service.ask("тестовый вопрос")
+        answer, tokens, duration, sources, cached, answer_mode, generation_ms = await service.ask("тестовый вопрос")
 
         assert answer == "В базе нет релевантных документов."
         assert tokens == 0
@@ -47,13 +50,14 @@ async def test_ask_no_relevant_documents():
 async def test_ask_uses_cache():
     """Если есть кэш, Chroma и LLM не вызываются"""
     with patch("app.services.rag.Llama") as mock_llama, \
-         patch("app.services.rag.chromadb.PersistentClient") as mock_chroma, \
+         patch("app.services.vector_store.chromadb.HttpClient") as mock_chroma, \
          patch("app.services.rag.BASE_DIR", Path("/fake/path")), \
          patch("app.services.rag.settings") as mock_settings, \
          patch("pathlib.Path.exists", return_value=True), \
          patch("app.services.rag.cache") as mock_cache:
 
         mock_settings.MODEL_PATH = "fake_model.gguf"
+        mock_settings.FAKE_MODELS = False
         mock_collection = Mock()
         mock_chroma.return_value.get_or_create_collection.return_value = mock_collection
 
@@ -69,13 +73,300 @@ async def test_ask_uses_cache():
         from app.services.rag import RAGService
         service = RAGService()
         service.llm = mock_llama.return_value
-        service.collection = mock_collection
+        service.index = ShardedIndex(mock_chroma.return_value, sharding="none")
 
-        answer, tokens, duration, sources = await service.ask("вопрос в кэше")
+        answer, tokens, duration, sources, cached, answer_mode, generation_ms = await service.ask("вопрос в кэше")
 
         assert answer == "Кэшированный ответ"
         assert tokens == 12
         assert duration == 0.1
         assert sources == ["cached.pdf"]
+        assert cached is True
+        assert generation_ms == 0
         mock_collection.query.assert_not_called()
         mock_llama.return_value.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_ask_sources_from_index_metadata():
+    """Источники берутся из метаданных Chroma, запрос в БД не выполняется"""
+    with patch("app.services.rag.Llama") as mock_llama, \
+         patch("app.services.vector_store.chromadb.HttpClient") as mock_chroma, \
+         patch("app.services.rag.embedding_service", embed=AsyncMock(return_value=[[0.1, 0.2]])), \
+         patch("app.services.rag.BASE_DIR", Path("/fake/path")), \
+         patch("app.services.rag.settings") as mock_settings, \
+         patch("pathlib.Path.exists", return_value=True), \
+         patch("app.services.rag.get_sources_for_chunks", new_callable=AsyncMock) as mock_sources, \
+         patch("app.services.rag.cache") as mock_cache:
+
+        mock_settings.MODEL_PATH = "fake_model.gguf"
+        mock_settings.FAKE_MODELS = False
+        mock_collection = Mock()
+        mock_chroma.return_value.get_or_create_collection.return_value = mock_collection
+        mock_collection.query.return_value = {
+            "documents": [["Текст чанка"]],
+            "ids": [["1"]],
+            "metadatas": [[{"document_id": 1, "chunk_index": 0, "filename": "manual.pdf"}]],
+        }
+        mock_llama.return_value.return_value = {"choices": [{"text": "1.0"}], "usage": {"total_tokens": 10}}
+
+        mock_cache.get_cached_answer = AsyncMock(return_value=None)
+        mock_cache.set_cached_answer = AsyncMock()
+        mock_cache.get_rerank_scores = AsyncMock(return_value={})
+        mock_cache.set_rerank_scores = AsyncMock()
+
+        from app.services.rag import RAGService
+        service = RAGService()
+        service.llm = mock_llama.return_value
+        service.index = ShardedIndex(mock_chroma.return_value, sharding="none")
+
+        answer, tokens, duration, sources, cached, answer_mode, generation_ms = await service.ask("вопрос")
+
+        assert sources == ["manual.pdf"]
+        mock_sources.assert_not_awaited()
+        # Поиск использует эмбеддинг, посчитанный параллельно с проверкой кэша
+        assert "query_embeddings" in mock_collection.query.call_args.kwargs
+
+
+@pytest.mark.asyncio
+async def test_ask_reuses_cached_rerank_scores():
+    """LLM оценивает только пары (вопрос, чанк), которых нет в кэше оценок"""
+    with patch("app.services.rag.Llama") as mock_llama, \
+         patch("app.services.vector_store.chromadb.HttpClient") as mock_chroma, \
+         patch("app.services.rag.embedding_service", embed=AsyncMock(return_value=[[0.1, 0.2]])), \
+         patch("app.services.rag.BASE_DIR", Path("/fake/path")), \
+         patch("app.services.rag.settings") as mock_settings, \
+         patch("pathlib.Path.exists", return_value=True), \
+         patch("app.services.rag.cache") as mock_cache:
+
+        mock_settings.MODEL_PATH = "fake_model.gguf"
+        mock_settings.FAKE_MODELS = False
+        mock_collection = Mock()
+        mock_chroma.return_value.get_or_create_collection.return_value = mock_collection
+        mock_collection.query.return_value = {
+            "documents": [["Первый чанк", "Второй чанк"]],
+            "ids": [["1", "2"]],
+            "metadatas": [[{"filename": "a.pdf"}, {"filename": "b.pdf"}]],
+        }
+        mock_llama.return_value.return_value = {"choices": [{"text": "0.9"}], "usage": {"total_tokens": 10}}
+
+        mock_cache.get_cached_answer = AsyncMock(return_value=None)
+        mock_cache.set_cached_answer = AsyncMock()
+        mock_cache.get_rerank_scores = AsyncMock(return_value={1: 1.0})
+        mock_cache.set_rerank_scores = AsyncMock()
+
+        from app.services.rag import RAGService
+        service = RAGService()
+        service.llm = mock_llama.return_value
+        service.index = ShardedIndex(mock_chroma.return_value, sharding="none")
+
+        await service.ask("вопрос")
+
+        # 1 вызов для оценки второго чанка + 1 вызов генерации ответа
+        assert mock_llama.return_value.call_count == 2
+        mock_cache.set_rerank_scores.assert_awaited_once_with("вопрос", {2: 0.9})
+
+
+@pytest.mark.asyncio
+async def test_ask_degrades_to_extractive_when_overloaded():
+    """При перегрузке очереди LLM ответ собирается из предложений чанков без ранжирования и генерации"""
+    with patch("app.services.rag.Llama") as mock_llama, \
+         patch("app.services.vector_store.chromadb.HttpClient") as mock_chroma, \
+         patch("app.services.rag.embedding_service", embed=AsyncMock(return_value=[[0.1, 0.2]])), \
+         patch("app.services.rag.BASE_DIR", Path("/fake/path")), \
+         patch("app.services.rag.settings") as mock_settings, \
+         patch("pathlib.Path.exists", return_value=True), \
+         patch("app.services.rag.admission") as mock_admission, \
+         patch("app.services.rag.cache") as mock_cache:
+
+        mock_settings.MODEL_PATH = "fake_model.gguf"
+        mock_settings.FAKE_MODELS = False
+        mock_settings.RERANK_ADAPTIVE = True
+        mock_settings.RERANK_REJECT_DISTANCE = 1.5
+        mock_settings.EXTRACTIVE_MAX_SENTENCES = 2
+        mock_collection = Mock()
+        mock_chroma.return_value.get_or_create_collection.return_value = mock_collection
+        mock_collection.query.return_value = {
+            "documents": [["Отпуск оформляется через отдел кадров. Офис открыт с 9 утра.",
+                           "Отпуск за свой счёт оформляется через отдел кадров."]],
+            "ids": [["1", "2"]],
+            "metadatas": [[{"filename": "hr.pdf"}, {"filename": "far.pdf"}]],
+            "distances": [[0.4, 1.8]],
+        }
+        mock_admission.should_degrade.return_value = True
+        mock_cache.get_cached_answer = AsyncMock(return_value=None)
+        mock_cache.set_cached_answer = AsyncMock()
+
+        from app.services.rag import RAGService
+        service = RAGService()
+        service.llm = mock_llama.return_value
+        service.index = ShardedIndex(mock_chroma.return_value, sharding="none")
+
+        answer, tokens, duration, sources, cached, answer_mode, generation_ms = await service.ask(
+            "Как оформить отпуск?", latency_budget_ms=2000
+        )
+
+        assert answer_mode == "extractive"
+        assert answer == "Отпуск оформляется через отдел кадров."
+        assert sources == ["hr.pdf"]
+        assert tokens == 0 and generation_ms == 0
+        mock_admission.should_degrade.assert_called_once_with(2000)
+        mock_admission.slot.assert_not_called()
+        mock_llama.return_value.assert_not_called()
+        mock_cache.set_cached_answer.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_ask_scope_limits_search_and_cache_key():
+    """scope передаётся в поиск по шардам и входит в ключ кэша"""
+    with patch("app.services.rag.Llama") as mock_llama, \
+         patch("app.services.vector_store.chromadb.HttpClient"), \
+         patch("app.services.rag.BASE_DIR", Path("/fake/path")), \
+         patch("app.services.rag.settings") as mock_settings, \
+         patch("pathlib.Path.exists", return_value=True), \
+         patch("app.services.rag.cache") as mock_cache:
+
+        mock_settings.MODEL_PATH = "fake_model.gguf"
+        mock_settings.FAKE_MODELS = False
+        mock_cache.get_cached_answer = AsyncMock(return_value=None)
+        mock_cache.set_cached_answer = AsyncMock()
+
+        from app.services.rag import RAGService
+        service = RAGService()
+        service.llm = mock_llama.return_value
+        service.index.query = AsyncMock(return_value=([], [], [], []))
+
+        with patch.object(service, "_embed_query", AsyncMock(return_value=[0.1, 0.2])):
+            await service.ask("тестовый вопрос", scope=["hr"])
+
+        mock_cache.get_cached_answer.assert_awaited_once_with("тестовый вопрос", 5, ["hr"])
+        assert service.index.query.call_args.args[2] == ["hr"]
+
+
+def test_cache_key_depends_on_scope():
+    from app.services.cache import RedisCache
+    key = RedisCache()._generate_cache_key
+    assert key("вопрос", 5) != key("вопрос", 5, ["hr"])
+    assert key("вопрос", 5, ["hr", "it"]) == key("вопрос", 5, ["it", "hr"])
+
+
+@pytest.mark.asyncio
+async def test_cancelled_llm_call_keeps_slot_until_thread_returns():
+    """Отмена во время вызова LLM: следующий запрос получает слот только после завершения потока"""
+    from app.services.admission import AdmissionController
+    from app.services.fake_models import FakeLlama
+
+    with patch("app.services.rag.Llama"), \
+         patch("app.services.vector_store.chromadb.HttpClient"), \
+         patch("app.services.rag.BASE_DIR", Path("/fake/path")), \
+         patch("app.services.rag.settings") as mock_settings, \
+         patch("pathlib.Path.exists", return_value=True):
+
+        mock_settings.MODEL_PATH = "fake_model.gguf"
+        mock_settings.FAKE_MODELS = False
+
+        from app.services.rag import RAGService
+        service = RAGService()
+        fake = FakeLlama(latency_ms=300, token_ms=0, answer_tokens=10)
+        events = []
+
+        def slow_llm(prompt, **kwargs):
+            events.append("llm_start")
+            result = fake(prompt, **kwargs)
+            events.append("llm_end")
+            return result
+
+        service.llm = slow_llm
+        controller = AdmissionController(max_concurrent=1, max_queue=10)
+
+        async def first():
+            async with controller.slot():
+                await service._call_llm("долгий вопрос", max_tokens=200)
+
+        async def second():
+            async with controller.slot():
+                events.append("second_start")
+
+        first_task = asyncio.create_task(first())
+        await asyncio.sleep(0.05)
+        second_task = asyncio.create_task(second())
+        await asyncio.sleep(0)
+        first_task.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await first_task
+        await second_task
+
+        assert events == ["llm_start", "llm_end", "second_start"]
+        assert controller.active == 0
+
+
+@pytest.mark.asyncio
+async def test_explicit_extractive_skips_answer_cache():
+    """Явный answer_mode=extractive не отдаёт закэшированный генеративный ответ"""
+    with patch("app.services.rag.Llama") as mock_llama, \
+         patch("app.services.vector_store.chromadb.HttpClient") as mock_chroma, \
+         patch("app.services.rag.embedding_service", embed=AsyncMock(return_value=[[0.1, 0.2]])), \
+         patch("app.services.rag.BASE_DIR", Path("/fake/path")), \
+         patch("app.services.rag.settings") as mock_settings, \
+         patch("pathlib.Path.exists", return_value=True), \
+         patch("app.services.rag.cache") as mock_cache:
+
+        mock_settings.MODEL_PATH = "fake_model.gguf"
+        mock_settings.FAKE_MODELS = False
+        mock_settings.RERANK_ADAPTIVE = False
+        mock_settings.EXTRACTIVE_MAX_SENTENCES = 2
+        mock_collection = Mock()
+        mock_chroma.return_value.get_or_create_collection.return_value = mock_collection
+        mock_collection.query.return_value = {
+            "documents": [["Отпуск оформляется через отдел кадров."]],
+            "ids": [["1"]],
+            "metadatas": [[{"filename": "hr.pdf"}]],
+            "distances": [[0.4]],
+        }
+        mock_cache.get_cached_answer = AsyncMock(return_value={
+            "answer": "Генеративный ответ", "tokens": 12, "duration": 0.1, "sources": ["hr.pdf"],
+        })
+
+        from app.services.rag import RAGService
+        service = RAGService()
+        service.llm = mock_llama.return_value
+        service.index = ShardedIndex(mock_chroma.return_value, sharding="none")
+
+        answer, tokens, duration, sources, cached, answer_mode, generation_ms = await service.ask(
+            "Как оформить отпуск?", answer_mode="extractive"
+        )
+
+        assert answer_mode == "extractive"
+        assert answer == "Отпуск оформляется через отдел кадров."
+        assert not cached
+        mock_cache.get_cached_answer.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_fake_models_ask_reaches_llm_then_cache(fake_rag):
+    """FAKE_MODELS: близкий вопрос проходит поиск и доходит до генерации, повтор отдаётся из кэша"""
+    from app.database.crud import IndexedChunk
+
+    await fake_rag._add_to_index([
+        IndexedChunk(1, 1, 0, "Отпуск оформляется заявлением в отделе кадров за две недели.", "hr.txt", "default"),
+        IndexedChunk(2, 2, 0, "Пароль от Wi-Fi выдаёт служба поддержки по заявке.", "it.txt", "default"),
+    ])
+    fake_rag.llm = Mock(wraps=fake_rag.llm)
+
+    answer, tokens, _, sources, cached, answer_mode, generation_ms = await fake_rag.ask("Как оформить отпуск в отделе кадров?")
+
+    assert not cached and answer_mode == "generative"
+    assert tokens > 0 and sources == ["hr.txt"]
+    assert generation_ms > 0
+    assert fake_rag.llm.call_args.kwargs["max_tokens"] == 200
+    calls = fake_rag.llm.call_count
+
+    again = await fake_rag.ask("Как оформить отпуск в отделе кадров?")
+    assert again[0] == answer and again[4] is True and again[6] == 0
+    assert fake_rag.llm.call_count == calls
+
+    # Вопрос без общих слов с корпусом отсекается по расстоянию, без обращения к LLM
+    answer, *_ = await fake_rag.ask("Какая погода завтра?")
+    assert answer == "В базе нет релевантных документов."
+    assert fake_rag.llm.call_count == calls
@@ -0,0 +1,37 @@
+from app.services.rerank_policy import ACCEPT, REJECT, RERANK, plan_rerank
+
+
+def plan(distances):
+    return plan_rerank(distances, accept_distance=0.5, reject_distance=1.4, margin=0.25)
+
+
+def test_plan_rerank_all_irrelevant():
+    """Даже лучший кандидат далеко — ранжирование не нужно"""
+    decision, actions = plan([1.5, 1.6, 1.7])
+
+    assert decision == "skipped_irrelevant"
+    assert actions == [REJECT, REJECT, REJECT]
+
+
+def test_plan_rerank_clearly_separated():
+    """Лучший кандидат близко и с большим отрывом — берём его без LLM"""
+    decision, actions = plan([0.2, 0.9, 1.0])
+
+    assert decision == "skipped_separated"
+    assert actions == [ACCEPT, REJECT, REJECT]
+
+
+def test_plan_rerank_middle_band_only():
+    """LLM оценивает только кандидатов из неоднозначной зоны"""
+    decision, actions = plan([0.4, 0.5, 0.9, 1.5])
+
+    assert decision == "partial"
+    assert actions == [ACCEPT, ACCEPT, RERANK, REJECT]
+
+
+def test_plan_rerank_full():
+    """Все кандидаты в неоднозначной зоне"""
+    decision, actions = plan([0.8, 0.9, 1.0])
+
+    assert decision == "full"
+    assert actions == [RERANK, RERANK, RERANK]
@@ -0,0 +1,170 @@
+import uuid
+
+import chromadb
+import pytest
+import pytest_asyncio
+from unittest.mock import patch
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.database import crud
+from app.database.crud import IndexedChunk
+from app.database.models import Base
+from app.services.vector_store import GROUP_NAME_RE, ShardedIndex
+from app.shards import all_shards, backfill_groups, rebuild_shard
+
+
+class FakeEmbedder:
+    """Эмбеддинг — число в начале текста: чем оно больше, тем дальше чанк от запроса [0, 0]"""
+
+    async def embed_documents(self, texts):
+        return [[float(t.split()[0]), 0.0] for t in texts]
+
+
+QUERY = [0.0, 0.0]
+
+
+def make_index(sharding: str, shard_count: int = 3) -> ShardedIndex:
+    return ShardedIndex(chromadb.EphemeralClient(), base_name=f"test_{uuid.uuid4().hex[:8]}",
+                        sharding=sharding, shard_count=shard_count)
+
+
+def make_chunks(groups: dict[str, list[int]]) -> list[IndexedChunk]:
+    """{группа: [id документов]} -> по одному чанку на документ, расстояние = id документа"""
+    return [
+        IndexedChunk(doc_id * 10, doc_id, 0, f"{doc_id} текст документа", f"doc{doc_id}.txt", group)
+        for group, doc_ids in groups.items() for doc_id in doc_ids
+    ]
+
+
+@pytest_asyncio.fixture
+async def db():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    with patch.object(crud, "async_session", session_factory):
+        yield
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_hash_sharding_fans_out_and_merges_by_distance():
+    """Чанки документа — в шарде id % N; запрос без scope опрашивает все шарды, top-k — по расстоянию"""
+    index = make_index("hash")
+    await index.add(make_chunks({"default": [1, 2, 3, 4, 5, 6]}), FakeEmbedder())
+
+    assert index.shard_counts() == {f"{index.base_name}__h{i}": 2 for i in range(3)}
+
+    chunk_ids, documents, metadatas, distances = await index.query(QUERY, top_k=4)
+    assert chunk_ids == [10, 20, 30, 40]
+    assert distances == sorted(distances)
+    assert [m["document_id"] for m in metadatas] == [1, 2, 3, 4]
+    assert documents[0] == "1 текст документа"
+
+
+@pytest.mark.asyncio
+async def test_hash_sharding_scope_filters_by_group():
+    index = make_index("hash")
+    await index.add(make_chunks({"hr": [1, 2], "it": [3, 4], "legal": [5]}), FakeEmbedder())
+
+    chunk_ids, _, metadatas, _ = await index.query(QUERY, top_k=5, scope=["it"])
+    assert chunk_ids == [30, 40]
+
+    chunk_ids, _, metadatas, _ = await index.query(QUERY, top_k=5, scope=["legal", "hr"])
+    assert chunk_ids == [10, 20, 50]
+    assert {m["group"] for m in metadatas} == {"hr", "legal"}
+
+
+@pytest.mark.asyncio
+async def test_group_sharding_scope_selects_shards():
+    """Шард на группу: scope опрашивает только свои шарды, неизвестная группа — пустой результат"""
+    index = make_index("group")
+    await index.add(make_chunks({"hr": [1, 4], "it": [2, 3]}), FakeEmbedder())
+
+    assert index.shard_names() == [index.group_shard("hr"), index.group_shard("it")]
+    assert (await index.query(QUERY, top_k=5))[0] == [10, 20, 30, 40]
+    assert (await index.query(QUERY, top_k=5, scope=["hr"]))[0] == [10, 40]
+    assert (await index.query(QUERY, top_k=5, scope=["unknown"]))[0] == []
+    assert index.group_shard("unknown") not in index.shard_names()
+
+
+@pytest.mark.asyncio
+async def test_failed_shard_does_not_break_query():
+    index = make_index("hash")
+    await index.add(make_chunks({"default": [1, 2, 3, 4, 5, 6]}), FakeEmbedder())
+    broken = f"{index.base_name}__h1"
+    query_shard = index._query_shard
+
+    def flaky(name, *args):
+        if name == broken:
+            raise ConnectionError("shard down")
+        return query_shard(name, *args)
+
+    with patch.object(index, "_query_shard", side_effect=flaky):
+        chunk_ids, _, _, _ = await index.query(QUERY, top_k=6)
+
+    # Документы 1 и 4 лежат в шарде h1
+    assert chunk_ids == [20, 30, 50, 60]
+
+
+@pytest.mark.asyncio
+async def test_remove_and_update_metadata_across_shards():
+    index = make_index("hash")
+    chunks = make_chunks({"default": [1, 2, 3]})
+    await index.add(chunks, FakeEmbedder())
+
+    await index.remove([10, 30])
+    assert sum(index.shard_counts().values()) == 1
+
+    await index.update_metadata([chunks[1]._replace(chunk_index=5)])
+    _, _, metadatas, _ = await index.query(QUERY, top_k=1)
+    assert metadatas[0]["chunk_index"] == 5
+    assert await index.missing_chunk_ids(chunks) == {10, 30}
+
+
+@pytest.mark.asyncio
+async def test_rebuild_single_shard(db):
+    """Перестройка одного шарда из БД не затрагивает остальные"""
+    hr = await crud.upsert_document("hr.txt", "h1", ["1 отпуск", "2 больничный"], group_name="hr")
+    it = await crud.upsert_document("it.txt", "h2", ["3 пароль"], group_name="it")
+    index = make_index("group")
+    await index.add(hr["added"] + it["added"], FakeEmbedder())
+
+    hr_shard, it_shard = index.group_shard("hr"), index.group_shard("it")
+    index.collection(hr_shard).delete(ids=[str(hr["added"][0].id)])
+    assert await all_shards(index) == [hr_shard, it_shard]
+
+    assert await rebuild_shard(index, hr_shard, FakeEmbedder()) == 2
+    assert index.shard_counts() == {hr_shard: 2, it_shard: 1}
+    _, _, metadatas, _ = await index.query(QUERY, top_k=5, scope=["hr"])
+    assert {m["filename"] for m in metadatas} == {"hr.txt"}
+    assert {m["group"] for m in metadatas} == {"hr"}
+
+
+@pytest.mark.asyncio
+async def test_backfill_groups_enables_scope_for_old_index(db):
+    """Чанки, проиндексированные до появления групп (без group в метаданных), находятся по scope после backfill"""
+    hr = await crud.upsert_document("hr.txt", "h1", ["1 отпуск", "2 больничный"], group_name="hr")
+    index = make_index("hash")
+    for chunk in hr["added"]:
+        index.collection(index.shard_for(chunk)).add(
+            ids=[str(chunk.id)], embeddings=[[float(chunk.text.split()[0]), 0.0]], documents=[chunk.text],
+            metadatas=[{"document_id": chunk.document_id, "chunk_index": chunk.chunk_index, "filename": "hr.txt"}],
+        )
+    assert (await index.query(QUERY, top_k=5, scope=["hr"]))[0] == []
+
+    assert await backfill_groups(index) == 2
+    assert (await index.query(QUERY, top_k=5, scope=["hr"]))[0] == [c.id for c in hr["added"]]
+
+
+@pytest.mark.parametrize("group", ["hr", "h", "it-dept", "a_1", "x" * 40])
+def test_group_name_valid_for_chroma(group):
+    assert GROUP_NAME_RE.match(group)
+    # Chroma принимает имя коллекции шарда
+    make_index("group").collection(f"document_chunks__{group}")
+
+
+@pytest.mark.parametrize("group", ["hr-", "hr_", "-hr", "", "отдел", "x" * 41, "../hr"])
+def test_group_name_invalid(group):
+    assert not GROUP_NAME_RE.match(group)
@@ -0,0 +1,60 @@
+import uuid
+
+import chromadb
+import pytest
+
+from app.snapshot import SnapshotError, export_snapshot, import_snapshot, EMBEDDINGS_FILE
+
+
+def make_collection():
+    """Коллекция в памяти без эмбеддера: эмбеддинги передаются явно"""
+    client = chromadb.EphemeralClient()
+    return client.create_collection(name=f"test_{uuid.uuid4().hex[:8]}", embedding_function=None)
+
+
+@pytest.fixture
+def source():
+    collection = make_collection()
+    collection.add(
+        ids=["1", "2", "3"],
+        embeddings=[[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], [0.7, 0.8, 0.9]],
+        documents=["первый", "второй", "третий"],
+        metadatas=[{"filename": "a.pdf"}, {"filename": "a.pdf"}, {"filename": "b.pdf"}],
+    )
+    return collection
+
+
+def test_snapshot_roundtrip(source, tmp_path):
+    """Экспорт и загрузка снимка без пересчёта эмбеддингов"""
+    manifest = export_snapshot(source, tmp_path, model_id="fake-model", corpus_version=7)
+    assert manifest["count"] == 3
+    assert manifest["corpus_version"] == 7
+
+    target = make_collection()
+    import_snapshot(target, tmp_path, model_id="fake-model")
+
+    restored = target.get(ids=["2"], include=["embeddings", "documents", "metadatas"])
+    assert restored["documents"] == ["второй"]
+    assert restored["metadatas"] == [{"filename": "a.pdf"}]
+    assert restored["embeddings"][0] == pytest.approx([0.4, 0.5, 0.6], abs=1e-3)
+
+
+def test_snapshot_rejects_other_embedder(source, tmp_path):
+    """Снимок другого эмбеддера не загружается"""
+    export_snapshot(source, tmp_path, model_id="fake-model", corpus_version=1)
+
+    with pytest.raises(SnapshotError):
+        import_snapshot(make_collection(), tmp_path, model_id="other-model")
+
+
+def test_snapshot_rejects_corrupted_file(source, tmp_path):
+    """Повреждённый файл эмбеддингов не проходит проверку контрольной суммы"""
+    export_snapshot(source, tmp_path, model_id="fake-model", corpus_version=1)
+    with open(tmp_path / EMBEDDINGS_FILE, "r+b") as f:
+        f.seek(-1, 2)
+        last = f.read(1)
+        f.seek(-1, 2)
+        f.write(b"\x00" if last != b"\x00" else b"\x01")
+
+    with pytest.raises(SnapshotError):
+        import_snapshot(make_collection(), tmp_path, model_id="fake-model")
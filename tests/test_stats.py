@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from app.services.stats import bin_upper_ms, bucket_start, latency_bin, percentiles_from_histogram
+
+
+def test_latency_bin_error_is_bounded():
+    """Верхняя граница корзины отличается от задержки не более чем на 10%"""
+    for latency in [3, 42, 250, 1234, 98765]:
+        upper = bin_upper_ms(latency_bin(latency))
+        assert latency <= upper <= latency * 1.1
+
+
+def test_percentiles_from_histogram():
+    """Перцентили считаются по накопленным количествам в корзинах"""
+    histogram = {latency_bin(100): 90, latency_bin(1000): 9, latency_bin(5000): 1}
+
+    result = percentiles_from_histogram(histogram, [0.5, 0.95, 0.99])
+
+    assert 100 <= result["p50"] <= 110
+    assert 1000 <= result["p95"] <= 1100
+    assert 1000 <= result["p99"] <= 1100
+
+
+def test_bucket_start():
+    """Начало минутного и часового интервала"""
+    ts = datetime(2026, 1, 2, 13, 45, 30, 123)
+
+    assert bucket_start(ts, "minute") == datetime(2026, 1, 2, 13, 45)
+    assert bucket_start(ts, "hour") == datetime(2026, 1, 2, 13, 0)